@@ -0,0 +1,70 @@
+"""Scripted stand-in for gcloud and kubectl
+
+Run as ``python fakecli.py TOOL ARGS...`` (the benchmark puts small
+``gcloud`` and ``kubectl`` wrappers doing this on PATH). The command line
+is matched against the rules of the scenario file named by
+``DASK_GKE_BENCH_SCENARIO``; the first matching rule says how long to
+take, what to print and the exit code. Every invocation is appended to
+the file named by ``DASK_GKE_BENCH_LOG``, so that the benchmark can count
+them.
+
+A scenario is JSON like::
+
+    {"latency": 0.05,
+     "rules": [{"match": "^kubectl .*get pods", "output": "pods.json"},
+               {"match": "--watch", "output": "events.json", "watch": true,
+                "hold": 5},
+               {"match": "^gcloud container clusters create",
+                "latency": 2}]}
+
+``output`` is a file, relative to the scenario, printed as is; with
+``watch``, it must hold a JSON list, whose items are printed one by one,
+after which the process stays up for ``hold`` seconds, like a watch. A rule
+with ``after`` only matches once a command matching that has been run, so
+that, say, listings can change after deletions.
+"""
+import json
+import os
+import re
+import sys
+import time
+
+
+def main(argv):
+    cmd = ' '.join(argv)
+    log = os.environ['DASK_GKE_BENCH_LOG']
+    with open(log) as f:
+        ran = f.read().splitlines()
+    with open(log, 'a') as f:
+        f.write(cmd + '\n')
+    fn = os.environ['DASK_GKE_BENCH_SCENARIO']
+    with open(fn) as f:
+        scenario = json.load(f)
+    for rule in scenario['rules']:
+        if not re.search(rule['match'], cmd):
+            continue
+        if 'after' in rule and not any(re.search(rule['after'], line)
+                                       for line in ran):
+            continue
+        break
+    else:
+        rule = {}
+    time.sleep(rule.get('latency', scenario.get('latency', 0)))
+    if rule.get('output'):
+        path = os.path.join(os.path.dirname(fn), rule['output'])
+        out = sys.stdout
+        if rule.get('watch'):
+            with open(path) as f:
+                items = json.load(f)
+            for item in items:
+                out.write(json.dumps(item) + '\n')
+            out.flush()
+            time.sleep(rule.get('hold', 0))
+        else:
+            with open(path) as f:
+                out.write(f.read())
+    return rule.get('exit', 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,320 @@
+"""Time dask-gke commands end to end, against fake gcloud and kubectl
+
+Every command runs in a fresh process, with ``gcloud`` and ``kubectl``
+replaced on PATH by fakecli.py, answering from generated fixtures after a
+fixed latency, and HOME pointing at a scratch directory. What is measured
+is thus the orchestration itself: how long each command takes, how many
+gcloud/kubectl processes it starts, and its peak memory, with pod lists
+as large as you like.
+
+    python benchmarks/run.py --workers 2000 --output before.json
+    python benchmarks/run.py --workers 2000 --compare before.json
+
+With ``--compare``, the exit code is 1 if any command got slower by more
+than ``--threshold`` (and by more than a few latencies, to allow for noise).
+It is also 1 if ``dask-gke --help``, which is all start-up, takes longer
+than ``--startup-budget``.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+CLUSTER = 'bench'
+CONTEXT = 'gke_project_us-east1-b_' + CLUSTER
+
+# runs the CLI, then records the process' peak memory
+CHILD = """
+import json, resource, sys
+from dask_gke.cli.main import start
+sys.argv[0] = 'dask-gke'
+try:
+    start()
+finally:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open({rss!r}, 'w') as f:
+        json.dump(peak * (1 if sys.platform == 'darwin' else 1024), f)
+"""
+
+# name, arguments, stdin
+COMMANDS = [
+    ('help', ['--help'], None),
+    ('create', ['create', CLUSTER, '-s', 'cluster.pin_images=False'], None),
+    ('info', ['info', CLUSTER], None),
+    ('info-refresh', ['info', CLUSTER, '--refresh'], None),
+    ('info-all', ['info', '--all', '--refresh'], None),
+    ('resize-pods', ['resize', 'pods', CLUSTER, '10'], None),
+    ('resize-both', ['resize', 'both', CLUSTER, '20'], None),
+    ('rerender', ['rerender', CLUSTER], None),
+    ('delete', ['delete', CLUSTER, '--yes'], None),
+]
+# commands which only measure the CLI's start-up
+STARTUP = ['help']
+
+
+def service(name, ports, ip):
+    return {'metadata': {'name': name, 'labels': {'app': 'dask'}},
+            'spec': {'selector': {'name': name},
+                     'ports': [{'name': n, 'port': p} for n, p in ports]},
+            'status': {'loadBalancer': {'ingress': [{'ip': ip}]}}}
+
+
+def pod(name, container, ip):
+    return {'metadata': {'name': name, 'labels': {'app': 'dask'}},
+            'spec': {'containers': [{'name': container}]},
+            'status': {'podIP': ip, 'phase': 'Running',
+                       'containerStatuses': [{'ready': True}]}}
+
+
+def fixtures(workers):
+    """Fixture files of a running cluster with this many workers"""
+    services = [
+        service('jupyter-notebook', [('jupyter-http', 8888),
+                                     ('jupyter-lab-http', 8889)], '1.2.3.4'),
+        service('dask-scheduler', [('dask-scheduler-tcp', 8786),
+                                   ('dask-scheduler-bokeh', 8787)],
+                '1.2.3.5')]
+    pods = [pod('dask-worker-%05i' % i, 'dask-worker',
+                '10.%i.%i.%i' % (i // 65536, i // 256 % 256, i % 256))
+            for i in range(workers)]
+    pods += [pod('jupyter-notebook-0', 'jupyter-notebook', '10.255.0.1'),
+             pod('dask-scheduler-0', 'dask-scheduler', '10.255.0.2')]
+    nodes = [{'metadata': {'name': 'node-%04i' % i, 'labels': {
+        'cloud.google.com/gke-nodepool': 'dask-workers'}}}
+        for i in range(max(1, workers // 4))]
+    region = 'https://www.googleapis.com/compute/v1/projects/p/regions/' \
+        'us-east1'
+    rules = [{'name': 'a%i' % i, 'IPAddress': ip, 'region': region,
+              'target': region + '/targetPools/a%i' % i}
+             for i, ip in enumerate(['1.2.3.4', '1.2.3.5', '1.2.3.6'])]
+    pools = [{'name': r['name']} for r in rules]
+    firewalls = [{'name': 'k8s-fw-' + r['name']} for r in rules]
+    describe = {'nodePools': [
+        {'name': 'default-pool', 'autoscaling': {}},
+        {'name': 'dask-workers', 'autoscaling': {'enabled': False}}]}
+    rc = {'metadata': {'name': 'dask-worker'},
+          'spec': {'replicas': workers}, 'status': {'replicas': workers}}
+    return {
+        'services.json': {'items': services},
+        'pods.json': {'items': pods},
+        'nodes.json': {'items': nodes},
+        'rc.json': rc,
+        'snapshot.json': {'items': [dict(item, kind=kind) for kind, items in [
+            ('Service', services), ('Pod', pods), ('Node', nodes),
+            ('ReplicationController', [rc])] for item in items]},
+        'rules.json': rules,
+        'target-pools.json': pools,
+        'firewalls.json': firewalls,
+        'clusters.json': [{'name': CLUSTER, 'status': 'RUNNING'}],
+        'empty.json': [],
+        'describe.json': describe,
+        'events.json': services + pods,
+        'contexts.txt': 'other-context\n' + CONTEXT + '\n',
+    }
+
+
+def scenario(latency, hold):
+    return {'latency': latency, 'rules': [
+        {'match': r'^kubectl config (get-contexts|current-context)',
+         'output': 'contexts.txt'},
+        {'match': r'^kubectl .*--watch', 'output': 'events.json',
+         'watch': True, 'hold': hold},
+        {'match': r'^kubectl .*get pods,services,replicationcontrollers,nodes',
+         'output': 'snapshot.json'},
+        {'match': r'^kubectl .*get (services|svc)\b',
+         'output': 'services.json'},
+        {'match': r'^kubectl .*get pods\b', 'output': 'pods.json'},
+        {'match': r'^kubectl .*get nodes\b', 'output': 'nodes.json'},
+        {'match': r'^kubectl .*get (rc|replicationcontrollers?)\b',
+         'output': 'rc.json'},
+        # after deletion, nothing is left
+        {'match': r'^gcloud compute .* list', 'after': r' delete ',
+         'output': 'empty.json'},
+        {'match': r'^gcloud container clusters list',
+         'after': r'clusters delete', 'output': 'empty.json'},
+        {'match': r'^gcloud compute forwarding-rules list',
+         'output': 'rules.json'},
+        {'match': r'^gcloud compute target-pools list',
+         'output': 'target-pools.json'},
+        {'match': r'^gcloud compute firewall-rules list',
+         'output': 'firewalls.json'},
+        {'match': r'^gcloud container clusters list',
+         'output': 'clusters.json'},
+        {'match': r'^gcloud container clusters describe',
+         'output': 'describe.json'},
+    ]}
+
+
+def setup(work, workers, latency):
+    """Scratch HOME, fixtures, scenario and fake executables"""
+    data = os.path.join(work, 'data')
+    os.makedirs(data)
+    for fn, content in fixtures(workers).items():
+        with open(os.path.join(data, fn), 'w') as f:
+            if fn.endswith('.json'):
+                json.dump(content, f)
+            else:
+                f.write(content)
+    with open(os.path.join(data, 'scenario.json'), 'w') as f:
+        json.dump(scenario(latency, hold=30), f, indent=1)
+    bin = os.path.join(work, 'bin')
+    os.makedirs(bin)
+    for tool in ('gcloud', 'kubectl'):
+        fn = os.path.join(bin, tool)
+        with open(fn, 'w') as f:
+            f.write('#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(
+                sys.executable, os.path.join(HERE, 'fakecli.py'), tool))
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+    home = os.path.join(work, 'home')
+    os.makedirs(home)
+    env = dict(os.environ)
+    env.update({
+        'HOME': home,
+        'PATH': bin + os.pathsep + env.get('PATH', ''),
+        'PYTHONPATH': ROOT + os.pathsep + env.get('PYTHONPATH', ''),
+        'DASK_GKE_BENCH_SCENARIO': os.path.join(data, 'scenario.json'),
+        'DASK_GKE_BENCH_LOG': os.path.join(work, 'commands.log'),
+        'DASK_GKE_BACKEND': 'kubectl',
+    })
+    return env
+
+
+def run_command(env, args, stdin=None):
+    """Run the CLI once; returns dict of wall time, commands and memory"""
+    log = env['DASK_GKE_BENCH_LOG']
+    rss = os.path.join(os.path.dirname(log), 'rss.json')
+    open(log, 'w').close()
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, '-c', CHILD.format(rss=rss)] + args, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    out = proc.communicate(stdin.encode() if stdin else None)[0]
+    wall = time.time() - start
+    if proc.returncode:
+        raise RuntimeError("dask-gke {} failed:\n{}".format(
+            ' '.join(args), out.decode('utf-8', 'replace')))
+    with open(log) as f:
+        commands = [line for line in f if line.strip()]
+    with open(rss) as f:
+        peak = json.load(f)
+    return {'wall': wall, 'commands': len(commands), 'peak_rss_mb':
+            round(peak / 2. ** 20, 1)}
+
+
+def run(workers=1000, latency=0.05, repeat=3, only=None):
+    """Run the benchmark commands in order; returns the results document
+
+    Commands after ``create`` use the cluster it saved; each is repeated
+    ``repeat`` times, keeping the median wall time (``create`` and
+    ``delete``, which change the saved state, run once).
+    """
+    work = tempfile.mkdtemp(prefix='dask-gke-bench-')
+    try:
+        env = setup(work, workers, latency)
+        results = {}
+        for name, args, stdin in COMMANDS:
+            if only and name not in only and name != 'create':
+                continue
+            n = 1 if name in ('create', 'delete') else repeat
+            runs = [run_command(env, args, stdin) for _ in range(n)]
+            walls = sorted(r['wall'] for r in runs)
+            results[name] = {
+                'wall': round(walls[len(walls) // 2], 4),
+                'walls': [round(w, 4) for w in walls],
+                'commands': runs[-1]['commands'],
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs)}
+    finally:
+        shutil.rmtree(work, True)
+    return {'meta': meta(workers, latency, repeat), 'results': results}
+
+
+def meta(workers, latency, repeat):
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(), 'workers': workers,
+            'latency': latency, 'repeat': repeat}
+
+
+def over_budget(doc, budget):
+    """Names of the start-up commands slower than the budget (seconds)"""
+    return [name for name in STARTUP if name in doc['results'] and
+            doc['results'][name]['wall'] > budget]
+
+
+def format_results(doc, base=None, threshold=1.25):
+    """Text table of results, compared with a baseline if given
+
+    Returns (text, regressed command names)
+    """
+    latency = doc['meta']['latency']
+    lines = ['{:14} {:>9} {:>9} {:>9} {:>10}'.format(
+        'COMMAND', 'WALL (s)', 'COMMANDS', 'RSS (MB)', 'VS BASE')]
+    regressed = []
+    for name, r in doc['results'].items():
+        change = ''
+        old = (base or {}).get('results', {}).get(name)
+        if old:
+            ratio = r['wall'] / max(old['wall'], 1e-9)
+            change = '{:.2f}x'.format(ratio)
+            if (ratio > threshold and
+                    r['wall'] - old['wall'] > max(0.1, 3 * latency)):
+                regressed.append(name)
+                change += ' !'
+        lines.append('{:14} {:9.3f} {:9} {:9.1f} {:>10}'.format(
+            name, r['wall'], r['commands'], r['peak_rss_mb'], change))
+    return '\n'.join(lines), regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=1000,
+                        help="Worker pods in the fake cluster")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Seconds each fake gcloud/kubectl call takes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', default=None,
+                        help="Commands to run ({})".format(
+                            ', '.join(c[0] for c in COMMANDS)))
+    parser.add_argument('--output', help="Save results to this JSON file")
+    parser.add_argument('--compare', help="Results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Slow-down ratio counted as a regression")
+    parser.add_argument('--startup-budget', type=float, default=0.5,
+                        help="Most seconds `dask-gke --help` may take")
+    opts = parser.parse_args(argv)
+    doc = run(opts.workers, opts.latency, opts.repeat, opts.only)
+    base = None
+    if opts.compare:
+        with open(opts.compare) as f:
+            base = json.load(f)
+    text, regressed = format_results(doc, base, opts.threshold)
+    print(text)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+    slow = over_budget(doc, opts.startup_budget)
+    if slow:
+        print("Start-up over budget of {}s: {}".format(opts.startup_budget,
+                                                       ', '.join(slow)))
+    if regressed:
+        print("Slower than baseline: " + ', '.join(regressed))
+    return 1 if regressed or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Adaptive scaling of the workers, driven by the scheduler's load
+
+GKE's node autoscaler only reacts to pods which cannot be scheduled; it
+knows nothing of dask's task backlog. Here we poll the scheduler, decide
+how many workers the current load deserves, and resize the worker
+controller (and, optionally, the node pool) to match. Scaling down only
+removes idle workers, which the scheduler is first asked to retire, so
+that results held in their memory are moved elsewhere. Likewise, the node
+pool is never shrunk by count, which would let GKE pick the nodes to go:
+only nodes left running no dask pods are cordoned, then deleted.
+
+Numbers of workers here count worker containers (pods), each of which may
+run several dask-worker processes; the scheduler sees the processes. Only
+the workers of one controller are adapted: those of other worker groups
+are left out of the load, and never retired.
+"""
+import logging
+from math import ceil
+import time
+
+from .backend import SELECTOR
+from .scheduler import Load, host_of, worker_pods
+from .snapshot import POOL_LABEL
+
+logger = logging.getLogger(__name__)
+
+
+class Adaptive(object):
+    """Policy deciding the number of workers
+
+    Parameters
+    ----------
+    minimum, maximum: int
+        Bounds on the number of workers
+    tasks_per_worker: float
+        Unfinished tasks each worker container should have; more than this
+        per worker asks for more workers
+    memory_target: float
+        Mean fraction of worker memory in use above which to add workers
+    hysteresis: float
+        Only scale down when the wanted number is below the current one by
+        at least this fraction (and at least one worker)
+    wait_count: int
+        Consecutive polls which must all want fewer workers before scaling
+        down
+    cooldown_up, cooldown_down: float
+        Seconds after any change before scaling up, or down, again
+    """
+
+    def __init__(self, minimum=1, maximum=32, tasks_per_worker=4,
+                 memory_target=0.7, hysteresis=0.2, wait_count=3,
+                 cooldown_up=30, cooldown_down=300):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tasks_per_worker = tasks_per_worker
+        self.memory_target = memory_target
+        self.hysteresis = hysteresis
+        self.wait_count = wait_count
+        self.cooldown_up = cooldown_up
+        self.cooldown_down = cooldown_down
+        self.last_change = None
+        self.down_votes = 0
+
+    def desired(self, load):
+        """Workers wanted for the given scheduler Load, within bounds"""
+        want = int(ceil(load.queued / float(self.tasks_per_worker)))
+        fractions = [float(w['memory']) / w['memory_limit']
+                     for w in load.workers.values()
+                     if w.get('memory') and w.get('memory_limit')]
+        if fractions:
+            mean = sum(fractions) / len(fractions)
+            if mean > self.memory_target:
+                want = max(want, int(ceil(
+                    len(pods(load)) * mean / self.memory_target)))
+        return min(max(want, self.minimum), self.maximum)
+
+    def recommend(self, load, current, now=None):
+        """Decide what to do next
+
+        Parameters
+        ----------
+        load: scheduler.Load
+        current: int
+            Number of workers currently requested from kubernetes
+        now: float or None
+            Time stamp, for testing
+
+        Returns
+        -------
+        (target, retire): new number of workers, and the addresses of the
+        workers to retire first when scaling down
+        """
+        now = time.time() if now is None else now
+        want = self.desired(load)
+        since = (float('inf') if self.last_change is None
+                 else now - self.last_change)
+        if want > current:
+            self.down_votes = 0
+            if since >= self.cooldown_up:
+                self.last_change = now
+                return want, []
+            return current, []
+        if current - want < max(1, self.hysteresis * current):
+            self.down_votes = 0
+            return current, []
+        self.down_votes += 1
+        if self.down_votes < self.wait_count or since < self.cooldown_down:
+            return current, []
+        # only retire containers in which every process has nothing to do
+        idle = set(load.idle)
+        hosts = pods(load)
+        idle_hosts = [h for h, addrs in hosts.items()
+                      if all(a in idle for a in addrs)]
+        target = max(want, current - len(idle_hosts))
+        if target >= current:
+            return current, []
+
+        def memory(host):
+            return sum(load.workers[a].get('memory') or 0
+                       for a in hosts[host])
+        chosen = sorted(idle_hosts, key=memory)[:current - target]
+        retire = [a for h in chosen for a in sorted(hosts[h])]
+        self.last_change = now
+        self.down_votes = 0
+        return target, retire
+
+
+def pods(load):
+    """Worker addresses of a Load, grouped by the pod (IP) they run in"""
+    out = {}
+    for addr in load.workers:
+        out.setdefault(host_of(addr), []).append(addr)
+    return out
+
+
+def only_pods(load, pods):
+    """The part of a Load due to the workers running in the given pods
+
+    Tasks being processed by other workers are not counted as queued.
+    """
+    ips = set(p.get('status', {}).get('podIP') for p in pods)
+    workers = {a: w for a, w in load.workers.items() if host_of(a) in ips}
+    others = sum(w.get('processing') or 0 for a, w in load.workers.items()
+                 if a not in workers)
+    return Load(workers, max(0, load.queued - others),
+                [a for a in load.idle if a in workers])
+
+
+def cordon_empty(kube, count, pool=None, exclude=()):
+    """Cordon up to ``count`` worker nodes which run no dask pods
+
+    Nodes are checked again once cordoned, in case a pod was placed on
+    them meanwhile; those are uncordoned, and not returned.
+
+    Parameters
+    ----------
+    kube: backend.Backend
+    count: int
+    pool: str or None
+        Workers' node pool, or None if they share the default pool
+    exclude: names of nodes not to consider, like those being deleted
+
+    Returns
+    -------
+    list of the cordoned nodes
+    """
+    def busy():
+        return set(p.get('spec', {}).get('nodeName')
+                   for p in kube.list('pods', SELECTOR))
+    nodes = [n for n in kube.list('nodes', POOL_LABEL + '=' + pool
+                                  if pool else None)
+             if 'dask_main' not in n['metadata'].get('labels', {})
+             and n['metadata']['name'] not in exclude]
+    running = busy()
+    # nodes already cordoned, as by an earlier attempt, first
+    nodes = sorted((n for n in nodes if n['metadata']['name'] not in running),
+                   key=lambda n: not n.get('spec', {}).get('unschedulable')
+                   )[:max(0, count)]
+    if not nodes:
+        return []
+    for node in nodes:
+        kube.cordon(node['metadata']['name'])
+    running = busy()
+    out = []
+    for node in nodes:
+        if node['metadata']['name'] in running:
+            kube.cordon(node['metadata']['name'], False)
+        else:
+            out.append(node)
+    return out
+
+
+def step(adaptive, client, kube, resize_nodes=None, name='dask-worker'):
+    """Poll the scheduler once, and scale if the policy says so
+
+    Parameters
+    ----------
+    adaptive: Adaptive
+    client: scheduler.SchedulerClient
+    kube: backend.Backend
+        For the cluster's context
+    resize_nodes: callable or None
+        Called with the number of workers after each step, to fit the node
+        pool to them: before scaling up, else afterwards, so that nodes
+        emptied by retirement can go once their pods are gone
+    name: str
+        Worker replication controller
+
+    Returns
+    -------
+    Number of workers requested after this step
+    """
+    pods = kube.list('pods', 'name=' + name)
+    load = only_pods(client.load(), pods)
+    current = kube.replicas(name)
+    target, retire = adaptive.recommend(load, current)
+    logger.debug("{} workers connected, {} tasks queued, {} idle; "
+                 "{} requested, {} wanted".format(
+                     len(load.workers), load.queued, len(load.idle), current,
+                     target))
+    if target == current:
+        if resize_nodes is not None:
+            resize_nodes(current)
+        return current
+    logger.info("Scaling workers from {} to {}".format(current, target))
+    if target > current and resize_nodes is not None:
+        resize_nodes(target)
+    if retire:
+        client.retire_workers(retire)
+        # remove exactly the retired pods; the controller's replacements
+        # are still pending, so are the first removed by scaling down
+        for pod in worker_pods(pods, retire):
+            kube.delete('pods', pod)
+    kube.scale(name, target)
+    if target < current and resize_nodes is not None:
+        # only nodes left empty are removed; those whose retired pods are
+        # still terminating go at a later step
+        resize_nodes(target)
+    return target
+
+
+def run(adaptive, client, kube, resize_nodes=None, interval=10, once=False):
+    """Run step() every ``interval`` seconds, until interrupted"""
+    while True:
+        try:
+            step(adaptive, client, kube, resize_nodes)
+        except (IOError, ValueError, RuntimeError) as e:
+            logger.warning("Adapting failed, will retry: {}".format(e))
+        if once:
+            return
+        time.sleep(interval)
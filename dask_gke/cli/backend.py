@@ -0,0 +1,472 @@
+"""Ways of querying and changing the kubernetes objects of a cluster
+
+``KubectlBackend`` runs kubectl for every operation, which re-reads the
+kubeconfig and re-authenticates each time. ``APIBackend`` instead talks to
+the API server directly, using the credentials of a kubeconfig context,
+over a small pool of kept-alive HTTP(S) connections.
+
+Which is used is chosen with ``use()`` (the ``--backend`` option of the
+CLI, or the ``DASK_GKE_BACKEND`` environment variable); if the API backend
+cannot be set up for a context, kubectl is used instead.
+"""
+import base64
+import calendar
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import six
+from six.moves.urllib.parse import urlencode, urlparse
+import yaml
+
+from . import profile
+from .utils import check_output, mem_bytes, parse_pods, parse_services
+
+logger = logging.getLogger(__name__)
+
+SELECTOR = 'app=dask'
+NAMESPACE = 'default'
+METRICS_PATHS = {
+    'pods': '/apis/metrics.k8s.io/v1beta1/namespaces/{ns}/pods',
+    'nodes': '/apis/metrics.k8s.io/v1beta1/nodes',
+}
+SNAPSHOT_KINDS = ('pods', 'services', 'replicationcontrollers', 'nodes')
+# kind of object, as in its "kind" field, to the kind in requests
+KIND_NAMES = {'Pod': 'pods', 'Service': 'services',
+              'ReplicationController': 'replicationcontrollers',
+              'Node': 'nodes'}
+BACKENDS = ('kubectl', 'api')
+backend_name = os.environ.get('DASK_GKE_BACKEND', 'kubectl')
+_backends = {}
+
+
+def use(name):
+    """Set the kind of backend returned by get_backend"""
+    global backend_name
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend {}, choose from {}".format(
+            name, BACKENDS))
+    backend_name = name
+    _backends.clear()
+
+
+def get_backend(context):
+    """Backend for the given context, reused within this process"""
+    if context not in _backends:
+        backend = None
+        if backend_name == 'api':
+            try:
+                backend = APIBackend.from_kubeconfig(context)
+            except Exception as e:
+                logger.warning("Falling back to kubectl, could not use the "
+                               "API directly: {}".format(e))
+        if backend is None:
+            backend = KubectlBackend(context)
+        _backends[context] = backend
+    return _backends[context]
+
+
+def contexts():
+    """Names of all contexts in the kubeconfig"""
+    if backend_name == 'api':
+        try:
+            return [c['name'] for c in load_kubeconfig()['contexts']]
+        except Exception as e:
+            logger.debug("Could not read kubeconfig: {}".format(e))
+    output = check_output("kubectl config get-contexts -o name")
+    return output.strip().split('\n')
+
+
+class Backend(object):
+    """Operations common to all backends, in terms of list() and scale()"""
+    namespace = NAMESPACE
+
+    def services(self):
+        return parse_services(self.list('services', SELECTOR))
+
+    def pods(self):
+        return parse_pods(self.list('pods', SELECTOR))
+
+    def nodes(self):
+        return self.list('nodes')
+
+    def snapshot(self, kinds=SNAPSHOT_KINDS):
+        """The dask objects of several kinds, as a dict of kind to list"""
+        return {kind: self.list(kind, SELECTOR) for kind in kinds}
+
+    def replicas(self, name):
+        """Desired number of replicas of a replication controller"""
+        return self.get('replicationcontrollers', name)['spec']['replicas']
+
+    def usage(self, kind):
+        """Current use of the dask pods, or of all nodes, from the metrics
+        server
+
+        Parameters
+        ----------
+        kind: "pods" or "nodes"
+
+        Returns
+        -------
+        dict of name to (cpu cores, memory bytes)
+        """
+        from .planner import cpu_value
+        out = {}
+        for item in self.metrics(kind):
+            usages = [c['usage'] for c in item.get('containers', [item])]
+            out[item['metadata']['name']] = (
+                sum(cpu_value(u['cpu']) for u in usages),
+                sum(mem_bytes(u['memory']) for u in usages))
+        return out
+
+    def metrics_path(self, kind):
+        path = METRICS_PATHS[kind].format(ns=self.namespace)
+        if kind == 'pods':
+            path += '?' + urlencode({'labelSelector': SELECTOR})
+        return path
+
+
+class KubectlBackend(Backend):
+    def __init__(self, context):
+        self.context = context
+
+    def kubectl(self, args):
+        return check_output("kubectl --context {0} {1}".format(
+            self.context, args))
+
+    def list(self, kind, selector=None):
+        args = "get {} --output=json".format(kind)
+        if selector:
+            args += " -l " + selector
+        return json.loads(self.kubectl(args))['items']
+
+    def get(self, kind, name):
+        return json.loads(self.kubectl("get {} {} --output=json".format(
+            kind, name)))
+
+    def snapshot(self, kinds=SNAPSHOT_KINDS):
+        # a single run of kubectl, rather than one per kind
+        items = json.loads(self.kubectl("get {} -l {} --output=json".format(
+            ','.join(kinds), SELECTOR)))['items']
+        out = {kind: [] for kind in kinds}
+        for item in items:
+            kind = KIND_NAMES.get(item.get('kind'))
+            if kind in out:
+                out[kind].append(item)
+        return out
+
+    def scale(self, name, replicas):
+        self.kubectl("scale rc {} --replicas {}".format(name, replicas))
+
+    def delete(self, kind, name):
+        self.kubectl("delete {} {}".format(kind, name))
+
+    def cordon(self, name, unschedulable=True):
+        self.kubectl("{} {}".format(
+            'cordon' if unschedulable else 'uncordon', name))
+
+    def metrics(self, kind):
+        return json.loads(self.kubectl("get --raw '{}'".format(
+            self.metrics_path(kind))))['items']
+
+
+class ConnectionPool(object):
+    """Kept-alive HTTP(S) connections to one server, reused across requests
+
+    Thread-safe: each request takes an idle connection (or makes a new one)
+    and gives it back when done.
+    """
+
+    def __init__(self, url, ssl_context=None, maxsize=4, timeout=30):
+        parsed = urlparse(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.ssl_context = ssl_context
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        from six.moves import http_client
+        if self.scheme == 'https':
+            return http_client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout,
+                context=self.ssl_context)
+        return http_client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def get(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Make a request, returning (status, body bytes)
+
+        A reused connection may have been closed by the server, in which
+        case the request is retried once on a fresh connection.
+        """
+        from six.moves import http_client
+        for attempt in range(2):
+            conn = self.get() if attempt == 0 else self.connect()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http_client.HTTPException, IOError, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if resp.getheader('connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self.put(conn)
+            return resp.status, data
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+
+class APIBackend(Backend):
+    """Talk to the kubernetes API server directly
+
+    Parameters
+    ----------
+    server: str
+        URL of the API server
+    token: str or callable or None
+        Bearer token, or function returning one
+    ssl_context: ssl.SSLContext or None
+        For https servers: CA and client certificates
+    namespace: str
+        Where the dask objects live
+    """
+    paths = {
+        'pods': '/api/v1/namespaces/{ns}/pods',
+        'services': '/api/v1/namespaces/{ns}/services',
+        'replicationcontrollers':
+            '/api/v1/namespaces/{ns}/replicationcontrollers',
+        'events': '/api/v1/namespaces/{ns}/events',
+        'nodes': '/api/v1/nodes',
+    }
+
+    def __init__(self, server, token=None, ssl_context=None,
+                 namespace=NAMESPACE):
+        self.server = server
+        self.token = token
+        self.namespace = namespace
+        self.pool = ConnectionPool(server, ssl_context=ssl_context)
+
+    @classmethod
+    def from_kubeconfig(cls, context, kubeconfig=None):
+        """Make backend with the server and credentials of a context"""
+        config = load_kubeconfig(kubeconfig)
+        ctx = _named(config, 'contexts', context)['context']
+        cluster = _named(config, 'clusters', ctx['cluster'])['cluster']
+        user = _named(config, 'users', ctx['user'])['user']
+        server = cluster['server']
+        ssl_context = None
+        if server.startswith('https'):
+            ssl_context = _ssl_context(cluster, user)
+        token = _token(user)
+        if callable(token):
+            # fail now, so that kubectl is used instead
+            token()
+        return cls(server, token=token, ssl_context=ssl_context,
+                   namespace=ctx.get('namespace', NAMESPACE))
+
+    def request(self, method, path, body=None,
+                content_type='application/json'):
+        headers = {'Accept': 'application/json'}
+        token = self.token() if callable(self.token) else self.token
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = content_type
+        logger.debug("API request: {} {}".format(method, path))
+        with profile.span('{} {}'.format(method, path), 'api') as rec:
+            status, data = self.pool.request(method, path, body, headers)
+            rec['status'] = status
+            rec['output_bytes'] = len(data)
+        if status >= 400:
+            raise RuntimeError("API request {} {} failed ({}): {}".format(
+                method, path, status, data.decode('utf-8', 'replace')))
+        return json.loads(data.decode('utf-8'))
+
+    def path(self, kind, name=None):
+        path = self.paths[kind].format(ns=self.namespace)
+        if name:
+            path += '/' + name
+        return path
+
+    def list(self, kind, selector=None):
+        path = self.path(kind)
+        if selector:
+            path += '?' + urlencode({'labelSelector': selector})
+        return self.request('GET', path)['items']
+
+    def get(self, kind, name):
+        return self.request('GET', self.path(kind, name))
+
+    def scale(self, name, replicas):
+        self.request('PATCH',
+                     self.path('replicationcontrollers', name) + '/scale',
+                     {'spec': {'replicas': int(replicas)}},
+                     content_type='application/merge-patch+json')
+
+    def delete(self, kind, name):
+        self.request('DELETE', self.path(kind, name))
+
+    def cordon(self, name, unschedulable=True):
+        self.request('PATCH', self.path('nodes', name),
+                     {'spec': {'unschedulable': unschedulable}},
+                     content_type='application/merge-patch+json')
+
+    def metrics(self, kind):
+        return self.request('GET', self.metrics_path(kind))['items']
+
+
+def load_kubeconfig(path=None):
+    if path is None:
+        path = os.environ.get('KUBECONFIG', '').split(os.pathsep)[0] or \
+            os.path.join(os.path.expanduser('~'), '.kube', 'config')
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def _named(config, section, name):
+    for item in config.get(section) or []:
+        if item['name'] == name:
+            return item
+    raise KeyError("No {} named {} in kubeconfig".format(section, name))
+
+
+def _data_file(data):
+    """Write base64 data from the kubeconfig to a private temporary file"""
+    import tempfile
+    fd, fn = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(base64.b64decode(data))
+    return fn
+
+
+def _ssl_context(cluster, user):
+    import ssl
+    if cluster.get('insecure-skip-tls-verify'):
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    elif 'certificate-authority-data' in cluster:
+        ctx = ssl.create_default_context(cadata=base64.b64decode(
+            cluster['certificate-authority-data']).decode('ascii'))
+    else:
+        ctx = ssl.create_default_context(
+            cafile=cluster.get('certificate-authority'))
+    if 'client-certificate-data' in user:
+        cert = _data_file(user['client-certificate-data'])
+        key = _data_file(user['client-key-data'])
+        try:
+            ctx.load_cert_chain(cert, key)
+        finally:
+            os.remove(cert)
+            os.remove(key)
+    elif 'client-certificate' in user:
+        ctx.load_cert_chain(user['client-certificate'], user.get('client-key'))
+    return ctx
+
+
+def _token(user):
+    """Static token, or function refreshing one from an exec credential
+    plugin (like gke-gcloud-auth-plugin) or from gcloud"""
+    if 'token' in user:
+        return user['token']
+    if user.get('exec'):
+        return _refreshing(lambda: _exec_credential(user['exec']))
+    provider = user.get('auth-provider') or {}
+    if provider.get('name') != 'gcp':
+        if 'client-certificate-data' in user or 'client-certificate' in user:
+            return None
+        raise ValueError("Unsupported kubeconfig credentials")
+    config = provider.get('config') or {}
+
+    def gcloud():
+        out = json.loads(subprocess.check_output(
+            ['gcloud', 'config', 'config-helper', '--format=json']
+        ).decode('utf-8'))
+        return (out['credential']['access_token'],
+                _parse_expiry(out['credential'].get('token_expiry')))
+    return _refreshing(gcloud, config.get('access-token'),
+                       _parse_expiry(config.get('expiry')))
+
+
+def _refreshing(fetch, token=None, expiry=0):
+    """Function returning a token, fetched anew once it has expired
+
+    ``fetch`` returns (token, expiry in seconds since the epoch).
+    """
+    state = {'token': token, 'expiry': expiry}
+
+    def token():
+        # same as kubectl: refresh a minute before the token expires
+        if not state['token'] or state['expiry'] < time.time() + 60:
+            state['token'], state['expiry'] = fetch()
+        return state['token']
+    return token
+
+
+def _exec_credential(spec):
+    """Run a kubeconfig exec plugin, and return the token of the
+    ExecCredential it prints, with its expiry
+
+    A credential without expirationTimestamp is used for as long as the
+    process runs, as kubectl does.
+    """
+    env = dict(os.environ)
+    env.update((e['name'], e['value']) for e in spec.get('env') or [])
+    env['KUBERNETES_EXEC_INFO'] = json.dumps({
+        'apiVersion': spec.get('apiVersion'), 'kind': 'ExecCredential',
+        'spec': {'interactive': False}})
+    args = [spec['command']] + list(spec.get('args') or [])
+    try:
+        with profile.span(' '.join(args), 'command') as rec:
+            out = subprocess.check_output(args, env=env)
+            rec['output_bytes'] = len(out)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise ValueError("Credential plugin {} failed: {}".format(
+            spec['command'], e))
+    status = json.loads(out.decode('utf-8')).get('status') or {}
+    if not status.get('token'):
+        # client certificates from a plugin are not supported
+        raise ValueError("Credential plugin {} gave no token".format(
+            spec['command']))
+    expiry = status.get('expirationTimestamp')
+    return (status['token'],
+            _parse_expiry(expiry) if expiry else float('inf'))
+
+
+def _parse_expiry(text):
+    """Seconds since the epoch, from an RFC3339 time stamp; 0 if unknown"""
+    if not text:
+        return 0
+    if not isinstance(text, six.string_types):
+        # yaml may have parsed the time stamp already
+        text = text.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S'))
@@ -0,0 +1,115 @@
+"""Persistent cache of slowly-changing cluster state
+
+Load-balancer addresses, in particular, hardly ever change once assigned,
+so there is no need to ask kubernetes for them on every command. Values are
+kept per cluster in a JSON file next to the saved config, each with a time
+stamp, and are discarded after a time-to-live depending on the kind of
+value, or when a command changes the cluster.
+"""
+import json
+import logging
+import os
+import time
+
+from .utils import pardir
+
+logger = logging.getLogger(__name__)
+
+# seconds for which each kind of value is trusted
+TTLS = {
+    'services': 3600,
+    'pods': 15,
+    'nodes': 60,
+    'replicas': 15,
+    'groups': 15,
+}
+
+
+def cache_path(cluster):
+    # not inside pardir(cluster), which is passed to ``kubectl apply``
+    return pardir(cluster) + '.cache.json'
+
+
+def load(cluster):
+    """All cached entries for the cluster, as a dict"""
+    try:
+        with open(cache_path(cluster)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save(cluster, entries):
+    fn = cache_path(cluster)
+    if not os.path.isdir(os.path.dirname(fn)):
+        return
+    tmp = fn + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(entries, f)
+    os.rename(tmp, fn)
+
+
+def entry(value):
+    """Cache entry of a value obtained now"""
+    return {'time': time.time(), 'value': value}
+
+
+def store(cluster, key, value):
+    """Record a freshly obtained value"""
+    entries = load(cluster)
+    entries[key] = entry(value)
+    save(cluster, entries)
+
+
+def lookup(cluster, key, ttl=None):
+    """Cached value, or None if absent or expired"""
+    entry = load(cluster).get(key)
+    if ttl is None:
+        ttl = TTLS.get(key, 0)
+    if entry is None or time.time() - entry['time'] > ttl:
+        return None
+    return entry['value']
+
+
+def cached(cluster, key, func, ttl=None, refresh=False, valid=None):
+    """Return func(), remembering the result for the cluster
+
+    Parameters
+    ----------
+    cluster: str
+        Name of the cluster
+    key: str
+        Kind of value, which sets the default TTL
+    func: callable
+        Fetches the current value; must return something JSON-serialisable
+    ttl: float or None
+        Override for how long the value is trusted, in seconds
+    refresh: bool
+        Ignore any cached value, and fetch anew
+    valid: callable or None
+        If given, only results for which valid(result) is True are stored,
+        e.g., to avoid remembering services without addresses
+    """
+    if not refresh:
+        value = lookup(cluster, key, ttl)
+        if value is not None:
+            logger.debug("Using cached {} for {}".format(key, cluster))
+            return value
+    value = func()
+    if valid is None or valid(value):
+        store(cluster, key, value)
+    return value
+
+
+def invalidate(cluster, *keys):
+    """Forget the given kinds of value, or everything if none are given"""
+    if not keys:
+        try:
+            os.remove(cache_path(cluster))
+        except OSError:
+            pass
+        return
+    entries = load(cluster)
+    removed = [entries.pop(key, None) for key in keys]
+    if any(entry is not None for entry in removed):
+        save(cluster, entries)
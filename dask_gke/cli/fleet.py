@@ -0,0 +1,147 @@
+"""Status of all the clusters with saved configuration
+
+Each cluster is queried in its own thread, with a time limit counted from
+the start of its query, so that a dozen clusters take about as long as the
+slowest one, and one unreachable cluster does not hold up the rest: the
+thread of a cluster which timed out is abandoned, and another cluster's
+query starts in its place.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from .backend import get_backend
+from .snapshot import cluster_state
+from .utils import load_config, pardir
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [('cluster', 'CLUSTER'), ('scheduler', 'SCHEDULER'),
+           ('notebook', 'NOTEBOOK'), ('nodes', 'NODES'),
+           ('workers', 'WORKERS'), ('pods', 'PODS LIVE/DEAD'),
+           ('error', 'ERROR')]
+
+
+def saved_clusters():
+    """Names of clusters with a saved config, in ~/.dask/kubernetes"""
+    pattern = os.path.join(os.path.dirname(pardir('x')), '*.yaml')
+    return sorted(os.path.basename(fn)[:-5] for fn in glob.glob(pattern))
+
+
+def cluster_status(cluster, refresh=False):
+    """Endpoints, pods, nodes and workers of one cluster, as a dict"""
+    conf = load_config(cluster)
+    kube = get_backend(conf['context'])
+    state = cluster_state(cluster, conf, kube, refresh=refresh)
+    jupyter, jport, jlport, scheduler, sport, bport = state['services']
+    live, dead = state['pods']
+    return {
+        'cluster': cluster,
+        'context': conf['context'],
+        'scheduler': '{}:{}'.format(scheduler, sport) if scheduler else None,
+        'dashboard': ('http://{}:{}/status'.format(scheduler, bport)
+                      if scheduler else None),
+        'notebook': 'http://{}:{}'.format(jupyter, jport) if jupyter else None,
+        'live': {k: len(v) for k, v in live.items()},
+        'dead': {k: len(v) for k, v in dead.items()},
+        'nodes': state['nodes'],
+        'workers': state['replicas'],
+        'suspended': bool(conf.get('suspended')),
+        'error': None,
+    }
+
+
+def fleet_status(clusters=None, max_workers=8, timeout=60, refresh=False):
+    """cluster_status() of many clusters, queried concurrently
+
+    Parameters
+    ----------
+    clusters: list of str or None
+        Names; all saved clusters by default
+    max_workers: int
+        Most clusters to query at once
+    timeout: float
+        Seconds after the start of its query to give up on a cluster
+    refresh: bool
+        Ignore cached state
+
+    Returns
+    -------
+    List of dicts, in the order of ``clusters``; failures are recorded in
+    the 'error' field.
+    """
+    if clusters is None:
+        clusters = saved_clusters()
+    results = {}
+    finished = threading.Event()
+
+    def query(cluster):
+        try:
+            row = cluster_status(cluster, refresh)
+        except Exception as e:
+            logger.debug("Status of {} failed".format(cluster),
+                         exc_info=True)
+            row = {'cluster': cluster,
+                   'error': str(e).strip().split('\n')[-1]}
+        # a cluster which timed out keeps that result
+        results.setdefault(cluster, row)
+        finished.set()
+
+    pending, running = list(clusters), {}
+    while pending or running:
+        finished.clear()
+        now = time.time()
+        for cluster, (thread, start) in list(running.items()):
+            if cluster in results:
+                del running[cluster]
+            elif now - start > timeout:
+                results.setdefault(cluster, {'cluster': cluster,
+                                             'error': 'timed out'})
+                del running[cluster]
+        while pending and len(running) < max_workers:
+            cluster = pending.pop(0)
+            thread = threading.Thread(target=query, args=(cluster, ))
+            thread.daemon = True
+            running[cluster] = thread, time.time()
+            thread.start()
+        if running:
+            finished.wait(max(0, min(start for _, start in running.values())
+                              + timeout - time.time()) + 0.01)
+    return [results[cluster] for cluster in clusters]
+
+
+def _cells(row):
+    live, dead = row.get('live') or {}, row.get('dead') or {}
+    workers = ''
+    if row.get('workers') is not None:
+        workers = '{}/{}'.format(live.get('dask-worker', 0), row['workers'])
+    if row.get('suspended'):
+        workers += ' (suspended)'
+    pods = ''
+    if 'live' in row:
+        pods = '{}/{}'.format(sum(live.values()), sum(dead.values()))
+    return {'cluster': row['cluster'],
+            'scheduler': row.get('scheduler') or '',
+            'notebook': row.get('notebook') or '',
+            'nodes': '' if row.get('nodes') is None else str(row['nodes']),
+            'workers': workers, 'pods': pods,
+            'error': row.get('error') or ''}
+
+
+def format_table(rows):
+    """Text table of fleet_status() output, one line per cluster"""
+    cells = [_cells(row) for row in rows]
+    widths = {key: max([len(title)] + [len(c[key]) for c in cells])
+              for key, title in COLUMNS}
+    lines = ['  '.join(title.ljust(widths[key]) for key, title in COLUMNS)]
+    for c in cells:
+        lines.append('  '.join(c[key].ljust(widths[key])
+                               for key, title in COLUMNS))
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+def format_json(rows):
+    return json.dumps(rows, indent=2, sort_keys=True)
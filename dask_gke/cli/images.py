@@ -0,0 +1,142 @@
+"""Pinning container images to the digests their tags point to
+
+A tag such as ``latest`` can move while a cluster is running, so that
+containers started later (new workers, replacements of preempted ones)
+run a different image, and ``imagePullPolicy: Always`` is needed to pick
+it up at all. Resolving each tag to its digest once, at ``create``, means
+every container of the cluster runs the same image, which nodes can keep
+(``IfNotPresent``) without asking the registry again.
+
+Digests come from the registry's v2 HTTP API, with an anonymous token
+where the registry asks for one; images on Google's registries, which may
+be private, are described with gcloud instead.
+"""
+import json
+import logging
+import re
+
+from six.moves.urllib.parse import urlencode
+
+from .utils import run
+
+logger = logging.getLogger(__name__)
+
+DOCKER_HUB = 'registry-1.docker.io'
+GOOGLE_REGISTRIES = ('gcr.io', 'docker.pkg.dev')
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+])
+SECTIONS = ('jupyter', 'scheduler', 'workers')
+
+
+def split_image(image):
+    """(registry, repository, tag) of an image name
+
+    Follows docker's rules: the first component is a registry if it looks
+    like a host name, otherwise the image is on Docker Hub, where
+    single-component names live under ``library/``.
+    """
+    name, tag = image, 'latest'
+    if ':' in image.rsplit('/', 1)[-1]:
+        name, tag = image.rsplit(':', 1)
+    parts = name.split('/', 1)
+    if len(parts) == 2 and ('.' in parts[0] or ':' in parts[0] or
+                            parts[0] == 'localhost'):
+        return parts[0], parts[1], tag
+    if len(parts) == 1:
+        name = 'library/' + name
+    return DOCKER_HUB, name, tag
+
+
+def _get(url, headers, timeout):
+    from six.moves.urllib.request import Request, urlopen
+    resp = urlopen(Request(url, headers=headers), timeout=timeout)
+    try:
+        return resp.info(), resp.read()
+    finally:
+        resp.close()
+
+
+def _token(challenge, repository, timeout):
+    """Anonymous bearer token answering a WWW-Authenticate challenge"""
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop('realm', None)
+    if not challenge.lower().startswith('bearer') or not realm:
+        raise RuntimeError("Registry needs unsupported authentication: "
+                           "{}".format(challenge))
+    params.setdefault('scope', 'repository:{}:pull'.format(repository))
+    headers, body = _get(realm + '?' + urlencode(sorted(params.items())), {},
+                         timeout)
+    out = json.loads(body.decode('utf-8'))
+    return out.get('token') or out['access_token']
+
+
+def resolve_digest(image, timeout=10):
+    """Digest ("sha256:...") of the manifest an image's tag points to
+
+    Raises RuntimeError if the registry cannot be asked.
+    """
+    from six.moves.urllib.error import HTTPError
+    registry, repository, tag = split_image(image)
+    if registry.endswith(GOOGLE_REGISTRIES):
+        code, out = run("gcloud container images describe {} --format "
+                        "'value(image_summary.digest)'".format(image))
+        # output includes any warnings on stderr; the digest comes last
+        digest = out.strip().split('\n')[-1]
+        if code or not digest.startswith('sha256:'):
+            raise RuntimeError("No digest for {}: {}".format(image, digest))
+        return digest
+    local = registry.split(':')[0] in ('localhost', '127.0.0.1')
+    url = '{}://{}/v2/{}/manifests/{}'.format(
+        'http' if local else 'https', registry, repository, tag)
+    headers = {'Accept': MANIFEST_TYPES}
+    try:
+        try:
+            info, body = _get(url, headers, timeout)
+        except HTTPError as e:
+            if e.code != 401:
+                raise
+            challenge = e.info().get('WWW-Authenticate', '')
+            headers['Authorization'] = 'Bearer ' + _token(
+                challenge, repository, timeout)
+            info, body = _get(url, headers, timeout)
+    except (IOError, ValueError, KeyError) as e:
+        raise RuntimeError("Could not resolve {}: {}".format(image, e))
+    digest = info.get('Docker-Content-Digest')
+    if not digest:
+        raise RuntimeError("Registry gave no digest for {}".format(image))
+    return digest
+
+
+def pin_images(conf, timeout=10):
+    """Replace the images of a configuration, worker groups' included, by
+    tag@digest references
+
+    Each distinct image is resolved once. Images which are already pinned
+    are left alone, as are those which cannot be resolved, with a warning.
+
+    Returns
+    -------
+    dict of original image name to pinned reference
+    """
+    pinned = {}
+    sections = [conf[section] for section in SECTIONS]
+    sections += conf['workers'].get('groups') or []
+    for section in sections:
+        image = section['image']
+        if '@' in image:
+            continue
+        if image not in pinned:
+            try:
+                pinned[image] = '{}@{}'.format(
+                    image, resolve_digest(image, timeout))
+                logger.info("Pinned {}".format(pinned[image]))
+            except RuntimeError as e:
+                logger.warning("Not pinning image, which will be pulled "
+                               "each time a container starts: {}".format(e))
+                pinned[image] = image
+        section['image'] = pinned[image]
+    return pinned
@@ -1,21 +1,28 @@
 #!/usr/bin/env python
 
 import click
+import contextlib
 import json
 import logging
 from math import ceil
 import os
-import re
 import shutil
 import subprocess
 import sys
 import time
 import traceback
-import webbrowser
+import yaml
 
+from . import (adapt as adaptive, backend, cache, fleet, images, manifests,
+               planner, portforward, preemption, profile, snapshot, startup,
+               teardown, top as monitor, usage as history, watch)
 from .config import setup_logging
-from .utils import (call, check_output, required_commands, get_conf, makedirs,
-                    render_templates, write_templates, pardir, load_config)
+from .scheduler import SchedulerClient
+from .utils import (as_bool, call, check_commands, check_output,
+                    required_commands, get_conf, makedirs, render_templates,
+                    write_templates, pardir, load_config, save_config, spawn,
+                    worker_groups, worker_pool, worker_target,
+                    worker_targets)
 
 
 logger = logging.getLogger(__name__)
@@ -38,9 +45,17 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.version_option(prog_name="dask-gke", version="0.0.1")
 @click.pass_context
-@required_commands("gcloud", "kubectl")
 @click.option('--verbose', '-v', required=False, default=False, is_flag=True)
-def cli(ctx, verbose):
+@click.option('--backend', 'backend_name', default=backend.backend_name,
+              type=click.Choice(backend.BACKENDS),
+              help="Query kubernetes by running kubectl, or directly through "
+                   "its API")
+@click.option('--profile', 'show_profile', default=False, is_flag=True,
+              help="Print the time taken by each command and phase at exit")
+@click.option('--trace-file', default=None, type=click.Path(),
+              help="Write a Chrome-trace JSON timeline of commands and "
+                   "phases to this file")
+def cli(ctx, verbose, backend_name, show_profile, trace_file):
     """
     Create and manage Dask clusters on Kubernetes.
     """
@@ -48,117 +63,308 @@ def cli(ctx, verbose):
         setup_logging(logging.DEBUG)
     else:
         setup_logging(logging.INFO)
+    backend.use(backend_name)
     ctx.obj = {}
 
+    def report():
+        if show_profile:
+            click.echo(profile.summary(), err=True)
+        if trace_file:
+            profile.write_trace(trace_file)
+    ctx.call_on_close(report)
+
+
+wait_workers_option = click.option(
+    '--wait-workers', default='0',
+    help="Also wait until the scheduler reports the workers of this many "
+         "dask-worker pods connected, or of this fraction of the pods of "
+         "each group, like 0.9 or 90%")
+
 
 @cli.command(short_help="Create a cluster.")
 @click.pass_context
+@required_commands("gcloud", "kubectl")
 @click.argument('name', required=True)
 @click.argument("settings_file", default=None, required=False)
 @click.option('--set', '-s', multiple=True,
               help="Additional key-value pairs to fill in the template.")
 @click.option('--nowait', '-n', default=False, is_flag=True,
               help="Don't wait for kubernetes to respond")
-def create(ctx, name, settings_file, set, nowait):
+@wait_workers_option
+@click.option('--timeout', default=None, type=float,
+              help="Give up waiting after this many seconds")
+def create(ctx, name, settings_file, set, nowait, wait_workers, timeout):
     conf = get_conf(settings_file, set)
+    conf['cluster']['num_nodes'] = planner.num_nodes(conf)
     zone = conf['cluster']['zone']
+    # one after the other: both rewrite the same gcloud properties file
     call("gcloud config set compute/zone {0}".format(zone))
-    call("gcloud config set compute/region {0}".format(zone.rsplit('-', 1)[0]))
+    call("gcloud config set compute/region {0}".format(
+        zone.rsplit('-', 1)[0]))
 
-    if conf['cluster']['autoscaling']:
+    cluster = conf['cluster']
+    if as_bool(cluster['autoscaling']):
         autoscaling = (
             '--enable-autoscaling --min-nodes={min} --max-nodes={max}'.format(
-                min=conf['cluster']['min_nodes'],
-                max=conf['cluster']['max_nodes']))
+                min=cluster['min_nodes'],
+                max=cluster['max_nodes']))
     else:
         autoscaling = ''
-    if conf['cluster']['preemptible']:
+    if as_bool(cluster['preemptible']):
         preemptible = '--preemptible'
     else:
         preemptible = ''
-    call("gcloud container clusters create {0} --num-nodes {1} --machine-type"
-         " {2} --no-async --disk-size {3} {autoscaling} {preemptible} --tags=dask --scopes "
-         "https://www.googleapis.com/auth/cloud-platform".format(
-            name, conf['cluster']['num_nodes'], conf['cluster']['machine_type'],
-            conf['cluster']['disk_size'],
-            autoscaling=autoscaling,
-            preemptible=preemptible))
+    if int(cluster.get('local_ssd_count') or 0):
+        # pods' emptyDir volumes, and so workers' spill, go on local SSD
+        ssd = '--ephemeral-storage-local-ssd count={}'.format(
+            cluster['local_ssd_count'])
+    else:
+        ssd = ''
+    nodes = "--num-nodes {0} --machine-type {1} --disk-size {2}"
+    scopes = ("--tags=dask --scopes "
+              "https://www.googleapis.com/auth/cloud-platform")
+    # nodes are labelled, like the dask objects, so that snapshot.py finds
+    # them along with the rest
+    workers = ("{nodes} {autoscaling} {preemptible} {ssd} --node-labels "
+               "app=dask {scopes}").format(
+        nodes=nodes.format(cluster['num_nodes'], cluster['machine_type'],
+                           cluster['disk_size']),
+        autoscaling=autoscaling, preemptible=preemptible, ssd=ssd,
+        scopes=scopes)
+    pool = worker_pool(conf)
+    if pool:
+        # small, stable pool for scheduler and jupyter; workers added below
+        main = cluster['main_pool']
+        proc = spawn(
+            "gcloud container clusters create {0} {1} --no-async "
+            "--node-labels dask_main=thisone,app=dask {2}".format(
+                name, nodes.format(main['num_nodes'], main['machine_type'],
+                                   main['disk_size']), scopes))
+    else:
+        proc = spawn("gcloud container clusters create {0} --no-async "
+                     "{1}".format(name, workers))
+    # render while the cluster is provisioning; only the saved config
+    # depends on the context, which is known afterwards
+    par = pardir(name)
+    if as_bool(cluster.get('pin_images')):
+        with profile.span('pin-images'):
+            images.pin_images(conf)
+    with profile.span('render'):
+        configs = render_templates(conf, par)
+    with profile.span('provision'):
+        code = proc.wait()
+    if code:
+        raise RuntimeError('Creating cluster failed!')
+    if pool:
+        # the workers' nodes come up while the rest is set up
+        pool_proc = spawn("gcloud container node-pools create {0} --cluster "
+                          "{1} {2}".format(pool, name, workers))
     get_credentials(name)
     context = get_context_from_cluster(name)
-    # specify label for notebook and scheduler
-    out = json.loads(check_output('kubectl get nodes --output=json'
-                                 ' --context ' + context))
-    node0 = out['items'][0]['metadata']['name']
-    call('kubectl label nodes {} dask_main=thisone'.format(node0))
-    par = pardir(name)
-    shutil.rmtree(par, True)
+    if not pool:
+        # specify label for notebook and scheduler
+        out = json.loads(check_output('kubectl get nodes --output=json'
+                                      ' --context ' + context))
+        node0 = out['items'][0]['metadata']['name']
+        call('kubectl label nodes {} dask_main=thisone'.format(node0))
+    # including what was recorded as applied to an earlier cluster
+    forget(name)
+    cache.invalidate(name)
     conf['context'] = context
+    configs[par + '.yaml'] = yaml.dump(conf, default_flow_style=False)
     logger.info("Copying template config to %s" % par)
     makedirs(par, exist_ok=True)
-    write_templates(render_templates(conf, par))
-    call("kubectl create -f {0}  --save-config".format(par))
+    with profile.span('write'):
+        write_templates(configs)
+    failed = call("kubectl create -f {0}  --save-config".format(par))
+    if not failed:
+        manifests.save_applied(name, configs)
+    if pool:
+        with profile.span('provision-workers'):
+            code = pool_proc.wait()
+        if code:
+            raise RuntimeError('Creating worker node pool failed!')
+    if failed:
+        # nothing is recorded as applied, so update_config applies it all
+        raise RuntimeError("Creating the kubernetes objects failed; run "
+                           "`dask-gke {} {}` to retry".format(
+                               update_config.name, name))
     if not nowait:
-        wait_until_ready(name, context)
+        deadline = None if timeout is None else time.time() + timeout
+        workers = worker_targets(wait_workers, worker_groups(conf))
+        wait_until_ready(name, context, workers=sum(workers.values()),
+                         timeout=timeout)
+        if any(workers.values()):
+            wait_for_workers(name, context, workers, remaining(deadline))
         print_info(name, context)
 
 
 def get_credentials(name):
-    try:
-        subprocess.check_call("gcloud container clusters get-credentials {0}".
-                              format(name), shell=True)
-    except:
+    with profile.span('get-credentials'):
+        code = call("gcloud container clusters get-credentials "
+                    "{0}".format(name))
+    if code:
         raise RuntimeError('Connecting to cluster failed!')
 
 
 @cli.command(short_help='Set kubernetes credentials in this shell')
 @click.pass_context
+@required_commands("gcloud")
 @click.argument('cluster', required=True)
 def credentials(ctx, cluster):
     get_credentials(cluster)
 
 
-def wait_until_ready(cluster, context=None, poll_time=3):
-    """Repeatedly poll kubernetes until cluster is up"""
+def wait_until_ready(cluster, context=None, workers=0, timeout=None):
+    """Follow kubernetes events until cluster is up"""
     logger.info('Waiting for kubernetes... (^C to stop)')
     if context is None:
         context = get_context_from_settings(cluster)
-    while True:
-        logger.debug('Polling for services')
-        jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
-        if jport and sport:
-            break
-        time.sleep(poll_time)
-    logger.info('Services are up')
-    while True:
-        logger.debug('Polling for pods')
-        live, dead = get_pods(context)
-        if 'jupyter-notebook' in live and 'dask-scheduler' in live:
-            break
-        time.sleep(3)
-    logger.info('Pods are up')
+    state = watch.wait_until_ready(context, workers=workers, timeout=timeout)
+    if all(state.services()):
+        cache.store(cluster, 'services', state.services())
+    cache.store(cluster, 'pods', state.pods())
+
+
+def wait_for_workers(cluster, context, workers, timeout=None):
+    """Block until the scheduler reports the processes of this many worker
+    pods connected
+
+    ``workers`` is a number of ``dask-worker`` pods, or a dict of worker
+    controller to number of pods; the pods of any other groups count at
+    the number now ready.
+    """
+    conf = load_config(cluster)
+    if not isinstance(workers, dict):
+        workers = {'dask-worker': workers}
+    groups = {g.get('controller', 'dask-worker'): g
+              for g in worker_groups(conf)}
+    if set(groups) - set(workers):
+        ready = cluster_state(cluster, context, ('groups', ),
+                              refresh=True)['groups']
+        workers = dict({c: ready[c][1] for c in groups if c in ready},
+                       **workers)
+    n = sum(pods * int(groups[c].get('processes', 1))
+            for c, pods in workers.items() if c in groups)
+    logger.info("Waiting for the scheduler to report {} workers... "
+                "(^C to stop)".format(n))
+    start = time.time()
+    with scheduler_client(cluster, conf) as client:
+        client.wait_for_workers(n, timeout)
+    profile.record('wait-for-workers', start, time.time(), workers=n)
+    logger.info("{} workers connected after {:.1f}s".format(
+        n, time.time() - start))
+
+
+@contextlib.contextmanager
+def scheduler_client(cluster, conf):
+    """SchedulerClient for a saved cluster; the ports of a tunnelled
+    cluster are forwarded while it is in use"""
+    client = SchedulerClient.from_services(
+        cluster_services(cluster, conf['context']), conf)
+    if not tunnelled(cluster):
+        yield client
+        return
+    with portforward.Tunnel(conf, conf['context']):
+        if not portforward.wait_for_port(conf['scheduler']['http_port']):
+            logger.warning("Scheduler port not forwarded yet")
+        yield client
+
+
+def remaining(deadline):
+    """Seconds left until a time.time() deadline, or None if there is none"""
+    return None if deadline is None else max(0, deadline - time.time())
+
+
+def apply_changes(cluster, configs, nodes=None, dry_run=False):
+    """Apply only the objects of the manifests which changed since last time
+
+    Prints the plan first. ``nodes`` is (old, new) if the number of worker
+    nodes is also to change. Nothing is sent to kubernetes if nothing
+    changed. If any command fails, RuntimeError is raised and nothing is
+    recorded as applied, so that the next run tries again.
+    """
+    changes = manifests.diff(manifests.load_applied(cluster), configs)
+    click.echo(manifests.format_changes(changes, nodes))
+    if dry_run or not (changes.files or changes.removed or nodes):
+        return changes
+    context = get_context_from_settings(cluster)
+    failed = []
+    if changes.files:
+        cmd = "kubectl --context {} apply {}".format(
+            context, ' '.join('-f ' + fn for fn in changes.files))
+        if call(cmd):
+            failed.append(cmd)
+    if changes.removed:
+        cmd = "kubectl --context {} delete {}".format(
+            context, ' '.join(k.lower() for k in changes.removed))
+        if call(cmd):
+            failed.append(cmd)
+    if nodes:
+        cmd = resize_command(cluster, nodes[1])
+        if call(cmd):
+            failed.append(cmd)
+            # the saved config already has the new size; put back the old
+            # one, so that the resize is planned again
+            conf = load_config(cluster)
+            conf['cluster']['num_nodes'] = nodes[0]
+            save_config(cluster, conf)
+    cache.invalidate(cluster)
+    if failed:
+        raise RuntimeError("Commands failed; run again to retry:\n" +
+                           "\n".join(failed))
+    manifests.save_applied(cluster, configs)
+    return changes
 
 
 @cli.command(short_help='Update config from parameter files')
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
-def update_config(ctx, cluster):
-    context = get_context_from_settings(cluster)
-    par = pardir(cluster)
-    call("kubectl --context {} apply -f {}".format(context, par))
+@click.option('--dry-run', default=False, is_flag=True,
+              help="Only show which objects would be applied")
+def update_config(ctx, cluster, dry_run):
+    apply_changes(cluster, manifests.rendered(cluster), dry_run=dry_run)
 
 
 @cli.command(short_help="Reset kubernetes values from file or command line "
                         "and apply")
 @click.pass_context
-@click.argument('name', required=True)
+@required_commands("gcloud", "kubectl")
+@click.argument('cluster', required=True)
 @click.argument("settings_file", default=None, required=False)
 @click.argument('args', nargs=-1)
-def rerender(ctx, cluster, settings_file, args):
+@click.option('--dry-run', default=False, is_flag=True,
+              help="Only show which objects and node counts would change")
+def rerender(ctx, cluster, settings_file, args, dry_run):
+    old = load_config(cluster)
     conf = get_conf(settings_file, args)
+    conf['context'] = old['context']
+    if old.get('suspended'):
+        conf['suspended'] = old['suspended']
+    pairs = [(old[section], conf[section]) for section in images.SECTIONS]
+    old_groups = {g['name']: g for g in old['workers'].get('groups') or []}
+    pairs += [(old_groups[g['name']], g) for g in conf['workers']['groups']
+              if g['name'] in old_groups]
+    for before, settings in pairs:
+        # keep the digests pinned at create, unless the image changes
+        if before['image'].startswith(settings['image'] + '@'):
+            settings['image'] = before['image']
+    conf['cluster']['num_nodes'] = planner.num_nodes(conf)
+    nodes = None
+    if conf['cluster']['num_nodes'] != int(old['cluster']['num_nodes']):
+        nodes = (old['cluster']['num_nodes'], conf['cluster']['num_nodes'])
     par = pardir(cluster)
-    # TODO: apply num_nodes change
-    write_templates(render_templates(conf, par))
-    update_config(ctx, cluster)
+    configs = render_templates(conf, par)
+    if dry_run:
+        apply_changes(cluster, configs, nodes, dry_run=True)
+        return
+    for fn in manifests.rendered(cluster):
+        if fn not in configs:
+            # optional object switched off; deleted by apply_changes
+            os.remove(fn)
+    write_templates(configs)
+    apply_changes(cluster, configs, nodes)
 
 
 @cli.group('resize', short_help="Resize a cluster.")
@@ -168,18 +374,79 @@ def resize():
 
 def autoscaling_enabled(cluster):
     """
-    Returns True if autoscaling is enabled for a cluster; False otherwise.
+    Returns True if autoscaling is enabled for a cluster's workers; False
+    otherwise.
     """
     out = check_output(
         "gcloud container clusters describe {cluster} --format json".format(
             cluster=cluster))
     out = json.loads(out)
-    autoscaling_info = out['nodePools'][0].get('autoscaling')
+    pools = out['nodePools']
+    name = worker_pool_of(cluster)
+    pool = ([p for p in pools if p['name'] == name] or pools)[0]
+    autoscaling_info = pool.get('autoscaling')
     return autoscaling_info and autoscaling_info.get('enabled')
 
 
+def worker_pool_of(cluster):
+    """Name of the workers' node pool of a saved cluster, or None if they
+    share the default pool"""
+    try:
+        return worker_pool(load_config(cluster))
+    except (IOError, OSError):
+        return None
+
+
+def resize_command(cluster, size):
+    """gcloud command to resize the nodes running workers"""
+    pool = worker_pool_of(cluster)
+    return "gcloud container clusters resize {0} {1}--size {2} --async".format(
+        cluster, '--node-pool {} '.format(pool) if pool else '', size)
+
+
+def instance_groups(cluster):
+    """Managed instance groups of the workers' node pool, by zone"""
+    out = json.loads(check_output(
+        "gcloud container node-pools describe {0} --cluster {1} "
+        "--format json".format(worker_pool_of(cluster) or 'default-pool',
+                               cluster)))
+    # .../zones/ZONE/instanceGroupManagers/NAME
+    return {url.split('/')[-3]: url.split('/')[-1]
+            for url in out.get('instanceGroupUrls', [])}
+
+
+def delete_nodes(cluster, kube, nodes):
+    """Delete the VMs of cordoned worker nodes, and shrink the pool by as
+    many; nodes which cannot be deleted are uncordoned
+
+    Returns
+    -------
+    names of the nodes deleted
+    """
+    groups = instance_groups(cluster)
+    by_zone = {}
+    for node in nodes:
+        labels = node['metadata'].get('labels', {})
+        zone = labels.get('topology.kubernetes.io/zone',
+                          labels.get('failure-domain.beta.kubernetes.io/zone'))
+        by_zone.setdefault(zone, []).append(node['metadata']['name'])
+    deleted = []
+    for zone, names in sorted(by_zone.items()):
+        if zone in groups and not call(
+                "gcloud compute instance-groups managed delete-instances {0} "
+                "--instances {1} --zone {2} --quiet".format(
+                    groups[zone], ','.join(names), zone)):
+            deleted.extend(names)
+            continue
+        logger.warning("Could not delete nodes {}".format(', '.join(names)))
+        for name in names:
+            kube.cordon(name, False)
+    return deleted
+
+
 @resize.command("nodes", short_help="Resize the number of nodes in a cluster.")
 @click.pass_context
+@required_commands("gcloud")
 @click.argument('cluster', required=True)
 @click.argument('value', required=True)
 def nodes(ctx, cluster, value):
@@ -189,17 +456,21 @@ def nodes(ctx, cluster, value):
                 'Are you sure you want to proceed?'):
             return
 
-    call("gcloud container clusters resize {0} --size {1} --async".format(
-        cluster, value))
+    call(resize_command(cluster, value))
+    cache.invalidate(cluster, 'nodes')
 
 
 @resize.command("both",
                 short_help="Resize the number of pods in a cluster,"
                            " and resize number of nodes proportionately")
 @click.pass_context
+@required_commands("gcloud", "kubectl")
 @click.argument('cluster', required=True)
 @click.argument('value', required=True)
-def both(ctx, cluster, value):
+@wait_workers_option
+@click.option('--timeout', default=None, type=float,
+              help="Give up waiting after this many seconds")
+def both(ctx, cluster, value, wait_workers, timeout):
     if autoscaling_enabled(cluster):
         if not click.confirm(
                 'Node autoscaling is enabled for this cluster. '
@@ -208,21 +479,28 @@ def both(ctx, cluster, value):
 
     value = int(value)
     context = get_context_from_settings(cluster)
-    n, p = counts(cluster)
-
-    call("gcloud container clusters resize {0} --size {1} --async".format(
-        cluster, ceil(n * value/p)))
-    call("kubectl --context {0} scale rc dask-worker --replicas {1}".format(
-        context, value))
+    try:
+        size = planner.pool_nodes(load_config(cluster), value,
+                                  group_counts(cluster, context))
+    except ValueError as e:
+        logger.warning("Could not plan node count ({}), keeping the "
+                       "current workers:nodes ratio".format(e))
+        n, p = counts(cluster)
+        size = ceil(n * value/p)
+
+    call(resize_command(cluster, size))
+    backend.get_backend(context).scale('dask-worker', value)
+    cache.invalidate(cluster, 'nodes', 'pods', 'replicas', 'groups')
+    workers = worker_target(wait_workers, value)
+    if workers:
+        wait_for_workers(cluster, context, workers, timeout)
 
 
 def get_context_from_cluster(cluster):
     """
     Returns context for a cluster.
     """
-    output = check_output("kubectl config get-contexts -o name")
-    contexts = output.strip().split('\n')
-    for context in contexts:
+    for context in backend.contexts():
         # Each context uses the format: gke_{PROJECT}_{ZONE}_{CLUSTER}
         if context.split('_')[-1] == cluster:
             return context
@@ -237,31 +515,386 @@ def get_context_from_settings(cluster):
     return conf['context']
 
 
+def worker_controller(cluster, group=None):
+    """Controller of one of a saved cluster's ``workers.groups``, or of
+    the main workers"""
+    if not group:
+        return 'dask-worker'
+    names = [g['name'] for g in
+             load_config(cluster)['workers'].get('groups') or []]
+    if group not in names:
+        raise RuntimeError("{} has no worker group {} (groups: {})".format(
+            cluster, group, ', '.join(names) or 'none'))
+    return 'dask-worker-' + group
+
+
 @resize.command("pods", short_help="Resize the number of pods in a cluster.")
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
 @click.argument('value', required=True)
-def pods(ctx, cluster, value):
+@click.option('--group', '-g', default=None,
+              help="Resize this group of workers.groups instead")
+@wait_workers_option
+@click.option('--timeout', default=None, type=float,
+              help="Give up waiting after this many seconds")
+def pods(ctx, cluster, value, group, wait_workers, timeout):
     context = get_context_from_settings(cluster)
-    call("kubectl --context {0} scale rc dask-worker --replicas {1}".format(
-        context, value))
+    controller = worker_controller(cluster, group)
+    backend.get_backend(context).scale(controller, value)
+    cache.invalidate(cluster, 'pods', 'replicas', 'groups')
+    workers = worker_target(wait_workers, int(value))
+    if workers:
+        wait_for_workers(cluster, context, {controller: workers}, timeout)
+
+
+@cli.command(short_help="Remove the workers of an idle cluster, and their "
+                        "nodes.")
+@click.pass_context
+@required_commands("gcloud", "kubectl")
+@click.argument('cluster', required=True)
+def suspend(ctx, cluster):
+    conf = load_config(cluster)
+    if conf.get('suspended'):
+        raise RuntimeError("{} is already suspended".format(cluster))
+    kube = backend.get_backend(conf['context'])
+    pool = worker_pool(conf)
+    nodes = None
+    if pool and not autoscaling_enabled(cluster):
+        nodes = node_count(cluster, refresh=True)
+    groups = [g['controller'] for g in conf['workers'].get('groups') or []]
+    # saved first, so that an interrupted suspend can still be resumed
+    conf['suspended'] = {'workers': kube.replicas('dask-worker'),
+                         'nodes': nodes}
+    if groups:
+        conf['suspended']['groups'] = {c: kube.replicas(c) for c in groups}
+    save_config(cluster, conf)
+    for controller in ['dask-worker'] + groups:
+        kube.scale(controller, 0)
+    if nodes:
+        call(resize_command(cluster, 0) + " --quiet")
+    elif pool:
+        logger.info("The autoscaler will remove the idle worker nodes")
+    else:
+        logger.info("Workers share the default node pool, whose nodes are "
+                    "kept; enable cluster.main_pool to release them too")
+    cache.invalidate(cluster, 'nodes', 'pods', 'replicas', 'groups')
+    total = conf['suspended']['workers'] + sum(
+        conf['suspended'].get('groups', {}).values())
+    print("Suspended {} workers{}; `dask-gke resume {}` brings them "
+          "back".format(total, ' and {} nodes'.format(nodes) if nodes else '',
+                        cluster))
+
+
+@cli.command(short_help="Bring back the workers of a suspended cluster.")
+@click.pass_context
+@required_commands("gcloud", "kubectl")
+@click.argument('cluster', required=True)
+@click.option('--nowait', '-n', default=False, is_flag=True,
+              help="Don't wait for the workers to connect")
+@click.option('--timeout', default=None, type=float,
+              help="Give up waiting after this many seconds")
+def resume(ctx, cluster, nowait, timeout):
+    conf = load_config(cluster)
+    sizes = conf.get('suspended')
+    if not sizes:
+        raise RuntimeError("{} is not suspended".format(cluster))
+    context = conf['context']
+    # nodes are resized asynchronously; the pods are scheduled as they come
+    if sizes.get('nodes'):
+        call(resize_command(cluster, sizes['nodes']) + " --quiet")
+    workers = dict(sizes.get('groups') or {}, **{
+        'dask-worker': sizes['workers']})
+    kube = backend.get_backend(context)
+    for controller, size in sorted(workers.items()):
+        kube.scale(controller, size)
+    del conf['suspended']
+    save_config(cluster, conf)
+    cache.invalidate(cluster, 'nodes', 'pods', 'replicas', 'groups')
+    if not nowait:
+        wait_for_workers(cluster, context, workers, timeout)
+
+
+@cli.command(short_help="Show how workers fit onto nodes.")
+@click.pass_context
+@click.argument("settings_file", default=None, required=False)
+@click.option('--set', '-s', multiple=True,
+              help="Additional key-value pairs to fill in the template.")
+@click.option('--cluster', '-c', default=None,
+              help="Use the saved config of this cluster instead.")
+@click.option('--workers', '-w', default=None, type=int,
+              help="Target number of workers (default: workers.count)")
+def plan(ctx, settings_file, set, cluster, workers):
+    if cluster:
+        conf = load_config(cluster)
+    else:
+        conf = get_conf(settings_file, set)
+    print(planner.format_plan(planner.plan(conf, workers)))
+
+
+@cli.command(short_help="Scale workers with the scheduler's load.")
+@click.pass_context
+@required_commands("gcloud", "kubectl")
+@click.argument('cluster', required=True)
+@click.option('--minimum', default=1, type=int,
+              help="Fewest workers to keep")
+@click.option('--maximum', default=None, type=int,
+              help="Most workers to run (default: as many as fit on "
+                   "cluster.max_nodes nodes)")
+@click.option('--tasks-per-worker', default=None, type=float,
+              help="Unfinished tasks per worker above which to add workers "
+                   "(default: twice the threads per worker container)")
+@click.option('--interval', default=10, type=float,
+              help="Seconds between polls of the scheduler")
+@click.option('--cooldown-up', default=30, type=float,
+              help="Seconds after scaling before scaling up again")
+@click.option('--cooldown-down', default=300, type=float,
+              help="Seconds after scaling before scaling down again")
+@click.option('--nodes/--no-nodes', 'scale_nodes', default=True,
+              help="Also resize the node pool, unless GKE autoscales it")
+@click.option('--once', default=False, is_flag=True,
+              help="Make a single decision and exit")
+def adapt(ctx, cluster, minimum, maximum, tasks_per_worker, interval,
+          cooldown_up, cooldown_down, scale_nodes, once):
+    conf = load_config(cluster)
+    context = conf['context']
+    if maximum is None:
+        # the nodes the worker groups sharing the pool need are not free
+        maximum = planner.capacity(conf, int(conf['cluster']['max_nodes']) -
+                                   planner.group_nodes(conf))
+    if tasks_per_worker is None:
+        tasks_per_worker = 2 * conf['workers']['cpus_per_worker2'] * int(
+            conf['workers'].get('processes', 1))
+    policy = adaptive.Adaptive(
+        minimum=minimum, maximum=maximum, tasks_per_worker=tasks_per_worker,
+        cooldown_up=cooldown_up, cooldown_down=cooldown_down)
+
+    kube = backend.get_backend(context)
+    resize_nodes = None
+    if scale_nodes and not autoscaling_enabled(cluster):
+        sizes, deleted = [node_count(cluster)], set()
+
+        def resize_nodes(workers):
+            size = max(planner.pool_nodes(conf, workers,
+                                          group_counts(cluster, context)),
+                       int(conf['cluster']['min_nodes']))
+            if size > sizes[-1]:
+                call(resize_command(cluster, size) + " --quiet")
+                sizes.append(size)
+                cache.invalidate(cluster, 'nodes')
+            elif size < sizes[-1]:
+                # resizing would let GKE pick the nodes to remove, busy
+                # ones included: delete only nodes left empty
+                nodes = adaptive.cordon_empty(kube, sizes[-1] - size,
+                                              worker_pool(conf), deleted)
+                if nodes:
+                    names = delete_nodes(cluster, kube, nodes)
+                    deleted.update(names)
+                    sizes.append(sizes[-1] - len(names))
+                    cache.invalidate(cluster, 'nodes')
+
+    logger.info("Adapting between {} and {} workers (^C to stop)".format(
+        minimum, maximum))
+    with scheduler_client(cluster, conf) as client:
+        adaptive.run(policy, client, kube, resize_nodes, interval=interval,
+                     once=once)
+    cache.invalidate(cluster, 'pods', 'replicas', 'groups')
+
+
+@cli.command(short_help="Live view of the workers' load.")
+@click.pass_context
+@required_commands("kubectl")
+@click.argument('cluster', required=True)
+@click.option('--interval', default=2, type=float,
+              help="Seconds between samples")
+@click.option('--history', default=60, type=int,
+              help="Samples kept per worker, for sparklines and averages")
+@click.option('--sort', default='memory', type=click.Choice(
+    sorted(monitor.SORT_KEYS)), help="Order of the workers")
+@click.option('--log', default=None, type=click.Path(),
+              help="Append every sample to this file, as JSON lines")
+@click.option('--once', default=False, is_flag=True,
+              help="Print one sample and exit")
+def top(ctx, cluster, interval, history, sort, log, once):
+    conf = load_config(cluster)
+    context = conf['context']
+    clear = None if once or not sys.stdout.isatty() else click.clear
+    with scheduler_client(cluster, conf) as client:
+        monitor.run(client, backend.get_backend(context), click.echo,
+                    interval=interval, history_size=history, sort=sort,
+                    log=log, once=once, clear=clear)
+
+
+@cli.command('startup-report',
+             short_help="Show how long each phase of worker start-up took.")
+@click.pass_context
+@click.argument('cluster', required=False)
+@click.option('--load', 'load_file', default=None, type=click.Path(),
+              help="Report on pods, nodes and events saved with --save, "
+                   "rather than on a cluster")
+@click.option('--save', 'save_file', default=None, type=click.Path(),
+              help="Also save the cluster's pods, nodes and events")
+@click.option('--compare', default=None, type=click.Path(),
+              help="Show the medians of data saved before, alongside")
+def startup_report(ctx, cluster, load_file, save_file, compare):
+    if load_file:
+        data = startup.load(load_file)
+    elif cluster:
+        check_commands("kubectl")
+        context = get_context_from_settings(cluster)
+        data = startup.collect(backend.get_backend(context))
+    else:
+        raise click.UsageError("Give a cluster, or --load")
+    if save_file:
+        startup.save(data, save_file)
+    baseline = startup.load(compare) if compare else None
+    print(startup.format_report(data, baseline))
+
+
+@cli.command(short_help="Retire and replace workers on preempted nodes.")
+@click.pass_context
+@required_commands("kubectl")
+@click.argument('cluster', required=True)
+@click.option('--replace/--no-replace', default=True,
+              help="Delete the retired workers' pods at once, so that "
+                   "replacements are scheduled before the node goes")
+def supervise(ctx, cluster, replace):
+    conf = load_config(cluster)
+    context = conf['context']
+    if not as_bool(conf['cluster'].get('preemptible')):
+        logger.warning("{} does not use preemptible nodes".format(cluster))
+    pool = worker_pool(conf)
+    node_selector = pool and 'cloud.google.com/gke-nodepool=' + pool
+    with scheduler_client(cluster, conf) as client:
+        supervisor = preemption.Supervisor(
+            client, backend.get_backend(context), replace=replace)
+        logger.info("Watching for preempted nodes (^C to stop)")
+        try:
+            with watch.Watcher(context, kinds=('nodes', 'pods'),
+                               selector={'pods': backend.SELECTOR,
+                                         'nodes': node_selector}) as watcher:
+                supervisor.run(watcher.events())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for rec in supervisor.recoveries:
+                print("{}: {} workers retired in {:.1f}s, recovered in "
+                      "{:.1f}s".format(rec.node, len(rec.pods),
+                                       rec.retired_at - rec.notice,
+                                       rec.recovered_at - rec.notice))
+            for before, rec in supervisor.pending:
+                print("{}: {} workers retired, not yet replaced".format(
+                    rec.node, len(rec.pods)))
+            cache.invalidate(cluster, 'pods', 'groups')
+
+
+refresh_option = click.option(
+    '--refresh', '-r', default=False, is_flag=True,
+    help="Ignore cached cluster state, and ask kubernetes again")
+json_option = click.option(
+    '--json', 'as_json', default=False, is_flag=True,
+    help="Print JSON, for scripting")
+timeout_option = click.option(
+    '--timeout', default=60, type=float,
+    help="Give up on clusters which have not answered after this many "
+         "seconds")
 
 
 @cli.command(short_help="Show all clusters.")
 @click.pass_context
-def list(ctx):
-    call("gcloud container clusters list")
+@required_commands("gcloud", "kubectl")
+@click.option('--detailed', '-d', default=False, is_flag=True,
+              help="Query every saved cluster for its status, in parallel")
+@refresh_option
+@json_option
+@timeout_option
+def list(ctx, detailed, refresh, as_json, timeout):
+    if detailed:
+        print_fleet(refresh, as_json, timeout)
+    else:
+        call("gcloud container clusters list")
 
 
 @cli.command(short_help='Detailed info about your running  dask cluster')
 @click.pass_context
-@click.argument('cluster', required=True)
-def info(ctx, cluster):
+@required_commands("kubectl")
+@click.argument('cluster', required=False)
+@click.option('--all', '-a', 'all_clusters', default=False, is_flag=True,
+              help="Summarise every saved cluster instead")
+@refresh_option
+@json_option
+@timeout_option
+def info(ctx, cluster, all_clusters, refresh, as_json, timeout):
+    if all_clusters:
+        print_fleet(refresh, as_json, timeout)
+        return
+    if cluster is None:
+        raise click.UsageError("Give a cluster name, or --all")
     context = get_context_from_settings(cluster)
-    print_info(cluster, context)
+    print_info(cluster, context, refresh)
 
 
-def print_info(cluster, context):
+def print_fleet(refresh=False, as_json=False, timeout=60):
+    rows = fleet.fleet_status(refresh=refresh, timeout=timeout)
+    if as_json:
+        print(fleet.format_json(rows))
+    elif rows:
+        print(fleet.format_table(rows))
+    else:
+        logger.info("No saved clusters in {}".format(
+            os.path.dirname(pardir('x'))))
+
+
+@cli.command(short_help="Node-hours, worker-hours and idle time of clusters.")
+@click.pass_context
+@click.argument('names', nargs=-1)
+@click.option('--days', default=30, type=float,
+              help="Report on this many days back")
+@click.option('--sample', default=False, is_flag=True,
+              help="Instead, record samples of one cluster and its "
+                   "scheduler's load until interrupted")
+@click.option('--interval', default=60, type=float,
+              help="Seconds between samples")
+@click.option('--once', default=False, is_flag=True,
+              help="Record one sample and exit")
+@json_option
+def usage(ctx, names, days, sample, interval, once, as_json):
+    if sample:
+        if len(names) != 1:
+            raise click.UsageError("Give one cluster to sample")
+        check_commands("kubectl")
+        cluster = names[0]
+        conf = load_config(cluster)
+        kube = backend.get_backend(conf['context'])
+
+        def state():
+            return snapshot.cluster_state(cluster, conf, kube, refresh=True,
+                                          record=False)
+        with scheduler_client(cluster, conf) as client:
+            history.run(cluster, state, client, interval=interval,
+                        once=once)
+        return
+    usages = history.summarize(history.samples(
+        names, since=time.time() - days * 86400))
+    confs = {}
+    for u in usages:
+        if os.path.exists(pardir(u.cluster) + '.yaml'):
+            confs[u.cluster] = load_config(u.cluster)
+    if as_json:
+        out = []
+        for u in usages:
+            row = u._asdict()
+            row['suggested_workers'], row['suggested_nodes'] = (
+                history.suggest(u, confs.get(u.cluster)))
+            out.append(row)
+        print(json.dumps(out, indent=2, sort_keys=True))
+    elif usages:
+        print(history.format_usage(usages, confs))
+    else:
+        logger.info("No usage recorded in {}".format(history.db_path()))
+
+
+def print_info(cluster, context, refresh=False):
     template = """Addresses
 ---------
    Web Interface:  http://{scheduler}:{bport}/status
@@ -282,86 +915,127 @@ c = Client('{scheduler}:{sport}')
 Live pods:
 {live}
 """
-    jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
-    live, _ = get_pods(context)
+    conf = load_config(cluster)
+    keys = ('services', 'pods', 'groups') if conf['workers'].get(
+        'groups') else ('services', 'pods')
+    state = cluster_state(cluster, context, keys, refresh)
+    jupyter, jport, jlport, scheduler, sport, bport = state['services']
+    live, _ = state['pods']
     par = pardir(cluster)
     print(template.format(jupyter=jupyter, scheduler=scheduler, par=par,
                           sport=sport, bport=bport, jport=jport, jlport=jlport,
                           live=live))
+    if 'groups' in state:
+        print(format_groups(conf, state['groups']))
+    if tunnelled(cluster):
+        print("Run `dask-gke tunnel {}` to reach these addresses".format(
+            cluster))
 
 
-def services_in_context(context):
-    out = check_output("kubectl --output=json --context {0}"
-                       " get services".format(context))
-    out = json.loads(out)['items']
-    (jupyter, jupyter_port, jupyterl_port, scheduler, scheduler_port,
-     bokeh_port) = [None] * 6
-    for item in out:
-        try:
-            name = item['spec']['selector']['name']
-            ports = item['spec']['ports']
-            ip = item['status']['loadBalancer']['ingress'][0]['ip']
-        except KeyError:
-            continue
-        if name == 'jupyter-notebook':
-            jupyter = ip
-            for port in ports:
-                if port['name'] == 'jupyter-http':
-                    jupyter_port = port['port']
-                if port['name'] == 'jupyter-lab-http':
-                    jupyterl_port = port['port']
-        if name == 'dask-scheduler':
-            scheduler = ip
-            for port in ports:
-                if port['name'] == 'dask-scheduler-tcp':
-                    scheduler_port = port['port']
-                if port['name'] == 'dask-scheduler-bokeh':
-                    bokeh_port = port['port']
-    return jupyter, jupyter_port, jupyterl_port, scheduler, scheduler_port, bokeh_port
-
-
-def get_pods(context):
-    out = check_output("kubectl --output=json --context {0}"
-                       " get pods".format(context))
-    live, dead = {}, {}
-    out = json.loads(out)['items']
-    for item in out:
-        try:
-            container = item['spec']['containers'][0]
-            name = container['name']
-            if name in ['jupyter-notebook', 'dask-scheduler', 'dask-worker']:
-                ready = item['status']['containerStatuses'][0]['ready']
-                pod = item['metadata']['name']
-                if ready:
-                    live.setdefault(name, []).append(pod)
-                else:
-                    dead.setdefault(name, []).append(pod)
-        except:
-            continue
-    return live, dead
+def format_groups(conf, counts):
+    """Table of the worker groups of a configuration, with their pods
+
+    ``counts`` is the 'groups' value of snapshot.cluster_state()
+    """
+    lines = ['Worker groups:']
+    for group in worker_groups(conf):
+        controller = group.get('controller', 'dask-worker')
+        desired, ready, _ = counts.get(controller, (0, 0, 0))
+        lines.append('{:<30} {:>4}/{:<4} ready  {} cpus, {}{}'.format(
+            controller, ready, desired, group['cpus_per_worker'],
+            group['memory_per_worker'],
+            ', resources ' + group['resources_arg']
+            if group.get('resources_arg') else ''))
+    return '\n'.join(lines)
+
+
+def tunnelled(cluster):
+    """Whether a saved cluster's services are reached by port-forwards"""
+    return load_config(cluster)['cluster'].get('access') == 'tunnel'
+
+
+def cluster_state(cluster, context, keys, refresh=False):
+    """Values of snapshot.cluster_state(), cached or from one query"""
+    return snapshot.cluster_state(cluster, load_config(cluster),
+                                  backend.get_backend(context), keys,
+                                  refresh=refresh)
+
+
+def cluster_services(cluster, context, refresh=False):
+    """Addresses and ports, as from parse_services(), cached until the
+    addresses might change"""
+    return tuple(cluster_state(cluster, context, ('services', ),
+                               refresh)['services'])
+
+
+def node_count(cluster, refresh=False):
+    """Number of nodes which can run workers"""
+    context = get_context_from_settings(cluster)
+    return cluster_state(cluster, context, ('nodes', ), refresh)['nodes']
+
+
+def group_counts(cluster, context):
+    """Desired pods of each of a cluster's worker groups, by controller"""
+    if not load_config(cluster)['workers'].get('groups'):
+        return {}
+    groups = cluster_state(cluster, context, ('groups', ))['groups']
+    return {name: group[0] for name, group in groups.items()}
 
 
 def counts(cluster):
-    # TODO: replace by get_pods?
+    """Current worker nodes and desired workers, from one query"""
     context = get_context_from_settings(cluster)
-    out = check_output('gcloud container clusters describe {}'.format(cluster))
-    nodes = int(re.search('currentNodeCount: (\d+)', out).groups()[0])
-    out = check_output(
-        'kubectl --context {} get rc dask-worker'.format(context))
-    lines = [o for o in out.split('\n') if o.startswith('dask-worker')]
-    pods = int(lines[0].split()[1])
-    return nodes, pods
+    state = cluster_state(cluster, context, ('nodes', 'replicas'),
+                          refresh=True)
+    return state['nodes'], state['replicas']
+
+
+def open_browser(url):
+    import webbrowser
+    webbrowser.open(url)
+
+
+def browse(cluster, context, url, port):
+    """Open the url; for a tunnelled cluster, first forward its ports, and
+    keep them forwarded until interrupted"""
+    if not tunnelled(cluster):
+        open_browser(url)
+        return
+    with portforward.Tunnel(load_config(cluster), context):
+        if not portforward.wait_for_port(port):
+            logger.warning("Port {} not forwarded yet".format(port))
+        open_browser(url)
+        logger.info('Forwarding ports - press ^C to exit')
+        while True:
+            time.sleep(100)
+
+
+@cli.command(short_help="Forward a cluster's ports to localhost")
+@click.pass_context
+@required_commands("kubectl")
+@click.argument('cluster', required=True)
+def tunnel(ctx, cluster):
+    conf = load_config(cluster)
+    context = conf['context']
+    with portforward.Tunnel(conf, context) as t:
+        for port in t.ports():
+            portforward.wait_for_port(port)
+        print_info(cluster, context)
+        logger.info('Forwarding ports - press ^C to exit')
+        while True:
+            time.sleep(100)
 
 
 @cli.command(short_help='Open the remote kubernetes console in the browser')
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
 def dashboard(ctx, cluster):
     context = get_context_from_settings(cluster)
     try:
         P = subprocess.Popen('kubectl --context {0} proxy'.format(
             context).split())
-        webbrowser.open('http://localhost:8001/ui')
+        open_browser('http://localhost:8001/ui')
         logger.info('\nProxy running - press ^C to exit')
         while True:
             time.sleep(100)
@@ -371,67 +1045,94 @@ def dashboard(ctx, cluster):
 
 @cli.command(short_help='Open the remote jupyter notebook in the browser')
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
-def notebook(ctx, cluster):
+@refresh_option
+def notebook(ctx, cluster, refresh):
     context = get_context_from_settings(cluster)
-    jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
+    jupyter, jport, jlport, scheduler, sport, bport = cluster_services(
+        cluster, context, refresh)
     if jupyter and jport:
-        webbrowser.open('http://{}:{}'.format(jupyter, jport))
+        browse(cluster, context, 'http://{}:{}'.format(jupyter, jport), jport)
     else:
         logger.info('Notebook service not ready')
 
 
 @cli.command(short_help='Open the remote jupyter-lab application in the browser')
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
-def lab(ctx, cluster):
+@refresh_option
+def lab(ctx, cluster, refresh):
     context = get_context_from_settings(cluster)
-    jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
+    jupyter, jport, jlport, scheduler, sport, bport = cluster_services(
+        cluster, context, refresh)
     if jupyter and jport:
-        webbrowser.open('http://{}:{}'.format(jupyter, jlport))
+        browse(cluster, context, 'http://{}:{}'.format(jupyter, jlport),
+               jlport)
     else:
         logger.info('Jupyterlab not ready')
 
 
 @cli.command(short_help='Open the dask status dashboard in the browser')
 @click.pass_context
+@required_commands("kubectl")
 @click.argument('cluster', required=True)
-def status(ctx, cluster):
+@refresh_option
+def status(ctx, cluster, refresh):
     context = get_context_from_settings(cluster)
-    jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
+    jupyter, jport, jlport, scheduler, sport, bport = cluster_services(
+        cluster, context, refresh)
     if scheduler and bport:
-        webbrowser.open('http://{}:{}/status'.format(scheduler, bport))
+        browse(cluster, context,
+               'http://{}:{}/status'.format(scheduler, bport), bport)
     else:
         logger.info('Status service not ready')
 
 
-@cli.command(short_help="Delete a cluster.")
+@cli.command(short_help="Delete clusters, and their load balancers.")
 @click.pass_context
-@click.argument('name', required=True)
-def delete(ctx, name):
-    if not click.confirm('Delete cluster {}?'.format(name)):
+@required_commands("gcloud", "kubectl")
+@click.argument('names', nargs=-1)
+@click.option('--all', '-a', 'all_clusters', default=False, is_flag=True,
+              help="Delete every saved cluster")
+@click.option('--yes', '-y', default=False, is_flag=True,
+              help="Don't ask for confirmation")
+@click.option('--timeout', default=900, type=float,
+              help="Seconds to wait for everything to be gone")
+def delete(ctx, names, all_clusters, yes, timeout):
+    if all_clusters:
+        names = fleet.saved_clusters()
+    if not names:
+        raise click.UsageError("Give the clusters to delete, or --all")
+    if not yes and not click.confirm('Delete {} {}?'.format(
+            'cluster' if len(names) == 1 else 'clusters', ', '.join(names))):
         return
-    conf = load_config(name)
-    region = conf['cluster']['zone']
-    zone = '-'.join(region.split('-')[:2])
-    context = get_context_from_settings(name)
-    jupyter, jport, jlport, scheduler, sport, bport = services_in_context(context)
-    cmd = "kubectl delete services --all --context {0}".format(context)
-    logger.info(cmd)
-    call(cmd)
-    cmd = 'gcloud compute forwarding-rules list --format json'
-    logger.info(cmd)
-    out = check_output(cmd)
-    items = json.loads(out)
-    for item in items:
-        if item["IPAddress"] in [jupyter, scheduler]:
-            assert ('jupyter-notebook' in item['description'] or
-                    'dask-scheduler' in item['description'])
-            cmd = ('gcloud compute forwarding-rules delete ' +
-                   item['name'] + ' --region ' + zone)
-            logger.info(cmd)
-            call(cmd)
-    call("gcloud container clusters delete {0}".format(name))
+    clusters = []
+    for name in names:
+        conf = load_config(name)
+        clusters.append((name, conf['cluster']['zone'], conf['context']))
+    left = teardown.teardown(clusters, timeout=timeout)
+    for name in names:
+        cache.invalidate(name)
+        if name not in {r.cluster for r in left}:
+            forget(name)
+    if left:
+        print("Still there after {} seconds:".format(timeout))
+        for r in left:
+            print("  " + teardown.delete_command(r))
+        raise RuntimeError("Not everything was deleted")
+    print("Deleted {}".format(', '.join(names)))
+
+
+def forget(cluster):
+    """Remove the saved config and state of a deleted cluster"""
+    par = pardir(cluster)
+    shutil.rmtree(par, True)
+    for fn in (par + '.yaml', manifests.applied_path(cluster)):
+        if os.path.exists(fn):
+            os.remove(fn)
+
 
 if __name__ == '__main__':
     start()
@@ -0,0 +1,112 @@
+"""Content hashes of the kubernetes objects applied to a cluster
+
+Each object of the rendered templates is hashed (after parsing, so that
+formatting does not matter), and the hashes last applied to a cluster are
+kept next to its saved config. Comparing a new rendering against them
+tells which objects were added, changed or removed, so that only those need
+to be sent to kubernetes, and nothing at all when the rendering is the
+same.
+"""
+from collections import namedtuple
+import glob
+import hashlib
+import json
+import os
+
+import yaml
+
+from .utils import pardir
+
+# keys are "Kind/name"; files are the manifests to apply, removed the keys
+# of objects to delete
+Changes = namedtuple('Changes', ['added', 'changed', 'removed', 'files'])
+
+
+def applied_path(cluster):
+    # not inside pardir(cluster), which is passed to ``kubectl apply``
+    return pardir(cluster) + '.applied.json'
+
+
+def digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str)
+                          .encode('utf-8')).hexdigest()
+
+
+def objects(configs):
+    """Hashes of the objects in rendered manifests
+
+    Parameters
+    ----------
+    configs: dict
+        Filename to text, as from render_templates(); documents which are
+        not kubernetes objects (the saved settings) are skipped
+
+    Returns
+    -------
+    dict of "Kind/name" to (hash, filename)
+    """
+    out = {}
+    for fn in sorted(configs):
+        for obj in yaml.safe_load_all(configs[fn]):
+            if not isinstance(obj, dict) or 'kind' not in obj:
+                continue
+            key = '{}/{}'.format(obj['kind'], obj['metadata']['name'])
+            out[key] = (digest(obj), fn)
+    return out
+
+
+def rendered(cluster):
+    """Manifests currently saved for the cluster, as filename to text"""
+    out = {}
+    for fn in glob.glob(os.path.join(pardir(cluster), '*.yaml')):
+        with open(fn) as f:
+            out[fn] = f.read()
+    return out
+
+
+def load_applied(cluster):
+    """Hashes last applied to the cluster, or None if not recorded"""
+    try:
+        with open(applied_path(cluster)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_applied(cluster, configs):
+    """Record the objects of these manifests as applied"""
+    hashes = {k: h for k, (h, fn) in objects(configs).items()}
+    fn = applied_path(cluster)
+    tmp = fn + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    os.rename(tmp, fn)
+
+
+def diff(applied, configs):
+    """Changes needed to go from applied hashes to the given manifests
+
+    If ``applied`` is None (nothing recorded), everything counts as changed.
+    """
+    new = objects(configs)
+    if applied is None:
+        applied = {}
+        changed = sorted(new)
+        added = []
+    else:
+        added = sorted(k for k in new if k not in applied)
+        changed = sorted(k for k in new if k in applied and
+                         new[k][0] != applied[k])
+    removed = sorted(k for k in applied if k not in new)
+    files = sorted(set(new[k][1] for k in added + changed))
+    return Changes(added, changed, removed, files)
+
+
+def format_changes(changes, nodes=None):
+    """Text plan of Changes, with (old, new) node counts if they differ"""
+    lines = (['+ ' + k for k in changes.added] +
+             ['~ ' + k for k in changes.changed] +
+             ['- ' + k for k in changes.removed])
+    if nodes:
+        lines.append('~ nodes: {} -> {}'.format(*nodes))
+    return '\n'.join(lines) or 'No changes'
@@ -0,0 +1,249 @@
+"""Fit dask worker containers onto GKE nodes
+
+Knows the shapes of the common machine types and how much of each node
+kubernetes keeps for itself, so that we can work out how many workers fit
+on each node, how much capacity is left idle, and how many nodes a given
+number of workers needs. The scheduler and jupyter containers either run
+on a pool of their own, or on the first node of the workers' pool (which
+is labelled ``dask_main``).
+
+No network access is needed: everything comes from the tables here.
+"""
+from collections import namedtuple
+import logging
+from math import ceil, floor
+
+import six
+
+from .utils import mem_bytes, worker_pool
+
+logger = logging.getLogger(__name__)
+MiB = 2 ** 20
+
+# name: (vCPUs, memory in MiB)
+MACHINE_TYPES = {
+    'f1-micro': (0.2, 614),
+    'g1-small': (0.5, 1740),
+}
+for _n in (1, 2, 4, 8, 16, 32, 64, 96):
+    MACHINE_TYPES['n1-standard-%i' % _n] = (_n, 3840 * _n)
+for _n in (2, 4, 8, 16, 32, 64, 96):
+    MACHINE_TYPES['n1-highmem-%i' % _n] = (_n, 6656 * _n)
+    MACHINE_TYPES['n1-highcpu-%i' % _n] = (_n, 921.6 * _n)
+for _n in (2, 4, 8, 16, 32, 48, 64, 80):
+    MACHINE_TYPES['n2-standard-%i' % _n] = (_n, 4096 * _n)
+    MACHINE_TYPES['n2-highmem-%i' % _n] = (_n, 8192 * _n)
+    MACHINE_TYPES['n2-highcpu-%i' % _n] = (_n, 1024 * _n)
+for _n in (2, 4, 8, 16, 32):
+    MACHINE_TYPES['e2-standard-%i' % _n] = (_n, 4096 * _n)
+    MACHINE_TYPES['e2-highmem-%i' % _n] = (_n, 8192 * _n)
+    MACHINE_TYPES['e2-highcpu-%i' % _n] = (_n, 1024 * _n)
+
+# resources requested on every node by kube-system daemons (kube-proxy,
+# logging, monitoring); approximate
+SYSTEM_CPU = 0.2
+SYSTEM_MEMORY = 300 * MiB
+# memory below which the kubelet starts evicting pods
+EVICTION_MEMORY = 100 * MiB
+CPU_UNITS = {'m': 1e3, 'u': 1e6, 'n': 1e9}
+
+Plan = namedtuple('Plan', [
+    'machine_type', 'node_cpu', 'node_memory', 'workers_per_node',
+    'workers_on_main', 'workers', 'nodes', 'wasted_cpu', 'wasted_memory',
+    'main_pool'])
+
+
+def machine_shape(machine_type):
+    """(cpus, memory bytes) of a machine type, including custom types
+    like ``custom-4-16384`` (memory in MB)"""
+    if machine_type.startswith('custom-'):
+        parts = machine_type.split('-')
+        cpus, memory = int(parts[1]), int(parts[2])
+    else:
+        try:
+            cpus, memory = MACHINE_TYPES[machine_type]
+        except KeyError:
+            raise ValueError("Unknown machine type: {}".format(machine_type))
+    return cpus, int(memory * MiB)
+
+
+def allocatable(cpus, memory):
+    """(cpus, memory bytes) of a node which pods can request
+
+    Follows GKE's reservations for the kubelet and system, which are
+    tiered by node size.
+    """
+    reserved_cpu, lower = 0, 0
+    for upto, frac in ((1, 0.06), (2, 0.01), (4, 0.005),
+                       (float('inf'), 0.0025)):
+        reserved_cpu += frac * max(0, min(cpus, upto) - lower)
+        lower = upto
+    if memory < 1024 * MiB:
+        reserved_mem = 255 * MiB
+    else:
+        reserved_mem, lower = 0, 0
+        for upto, frac in ((4, 0.25), (8, 0.2), (16, 0.1), (128, 0.06),
+                           (float('inf'), 0.02)):
+            upto = upto * 1024 * MiB
+            reserved_mem += frac * max(0, min(memory, upto) - lower)
+            lower = upto
+    return (cpus - reserved_cpu - SYSTEM_CPU,
+            int(memory - reserved_mem - EVICTION_MEMORY - SYSTEM_MEMORY))
+
+
+def cpu_value(c):
+    """Translate kubernetes CPU spec (e.g., 1.5, "500m" or, as the metrics
+    server reports it, "12345678n") to cores"""
+    if isinstance(c, six.string_types) and c[-1:] in CPU_UNITS:
+        return float(c[:-1]) / CPU_UNITS[c[-1]]
+    return float(c)
+
+
+def fits(cpu, memory, worker_cpu, worker_memory):
+    """How many workers fit in the given cpu/memory"""
+    if cpu < 0 or memory < 0:
+        return 0
+    return int(min(floor(cpu / worker_cpu + 1e-9),
+                   floor(memory / float(worker_memory))))
+
+
+def plan(conf, workers=None):
+    """Work out how the workers of a configuration fit onto nodes
+
+    Parameters
+    ----------
+    conf: dict
+        Configuration, from get_conf() or load_config()
+    workers: int or None
+        Target number of workers; defaults to ``workers.count``
+
+    Returns
+    -------
+    Plan, giving the minimal number of nodes for the workers, and the
+    capacity left unrequested on those nodes. With a separate main pool,
+    the nodes are those of the workers' pool only.
+    """
+    if workers is None:
+        workers = conf['workers']['count']
+    workers = int(workers)
+    machine_type = conf['cluster']['machine_type']
+    cpu, memory = allocatable(*machine_shape(machine_type))
+    wcpu = cpu_value(conf['workers']['cpus_per_worker'])
+    wmem = mem_bytes(conf['workers']['memory_per_worker'])
+    main_cpu = sum(cpu_value(conf[k]['cpus']) for k in
+                   ('scheduler', 'jupyter'))
+    main_mem = sum(mem_bytes(conf[k]['memory']) for k in
+                   ('scheduler', 'jupyter'))
+    main_pool = None
+    if worker_pool(conf):
+        main_pool = conf['cluster']['main_pool']['machine_type']
+        pool_cpu, pool_mem = allocatable(*machine_shape(main_pool))
+        if main_cpu > pool_cpu or main_mem > pool_mem:
+            raise ValueError("Scheduler and jupyter do not fit on a {} node"
+                             "".format(main_pool))
+        main_cpu, main_mem = 0, 0
+    elif main_cpu > cpu or main_mem > memory:
+        raise ValueError("Scheduler and jupyter do not fit on a {} node"
+                         "".format(machine_type))
+    per_node = fits(cpu, memory, wcpu, wmem)
+    on_main = 0 if main_pool else fits(cpu - main_cpu, memory - main_mem,
+                                       wcpu, wmem)
+    if per_node == 0 and workers:
+        raise ValueError("A worker of {} cpus and {} bytes does not fit on a "
+                         "{} node".format(wcpu, wmem, machine_type))
+    if main_pool:
+        nodes = int(ceil(workers / float(per_node))) if workers else 0
+    elif workers <= on_main:
+        nodes = 1
+    else:
+        nodes = 1 + int(ceil((workers - on_main) / float(per_node)))
+    return Plan(machine_type=machine_type, node_cpu=cpu, node_memory=memory,
+                workers_per_node=per_node, workers_on_main=on_main,
+                workers=workers, nodes=nodes,
+                wasted_cpu=nodes * cpu - main_cpu - workers * wcpu,
+                wasted_memory=nodes * memory - main_mem - workers * wmem,
+                main_pool=main_pool)
+
+
+def capacity(conf, nodes):
+    """Most workers which fit on the given number of (worker) nodes"""
+    p = plan(conf, 0)
+    if p.main_pool:
+        return p.workers_per_node * nodes
+    return p.workers_on_main + p.workers_per_node * (nodes - 1)
+
+
+def group_nodes(conf, counts=None):
+    """Nodes needed by the groups of ``workers.groups`` which run on the
+    workers' nodes (have the same node selector)
+
+    Each group is packed onto nodes of its own, so this is an upper bound;
+    groups sent elsewhere by their node selector are not counted.
+    ``counts`` gives the current pods of groups by controller, if they
+    may have been resized since the configuration was saved.
+    """
+    cpu, memory = allocatable(*machine_shape(conf['cluster']['machine_type']))
+    counts = counts or {}
+    nodes = 0
+    for group in conf['workers'].get('groups') or []:
+        count = int(counts.get(group['controller'], group['count']))
+        if group['node_selector'] != conf['workers']['node_selector'] or \
+                not count:
+            continue
+        per_node = fits(cpu, memory, cpu_value(group['cpus_per_worker']),
+                        mem_bytes(group['memory_per_worker']))
+        if per_node == 0:
+            raise ValueError("A worker of group {} does not fit on a {} "
+                             "node".format(group['name'],
+                                           conf['cluster']['machine_type']))
+        nodes += int(ceil(count / float(per_node)))
+    return nodes
+
+
+def pool_nodes(conf, workers=None, counts=None):
+    """Nodes for ``workers`` main workers (default ``workers.count``) and
+    the groups of workers which share their nodes, with ``counts`` as for
+    group_nodes()"""
+    return plan(conf, workers).nodes + group_nodes(conf, counts)
+
+
+def format_plan(p):
+    if p.main_pool:
+        main = "scheduler and jupyter on their own {} pool".format(
+            p.main_pool)
+    else:
+        main = "{} on the main node, with scheduler and jupyter".format(
+            p.workers_on_main)
+    return """Machine type:       {p.machine_type}
+Allocatable/node:   {p.node_cpu:.2f} cpus, {mem:.2f} GiB
+Workers per node:   {p.workers_per_node} ({main})
+Workers:            {p.workers}
+Nodes needed:       {p.nodes}
+Unused capacity:    {p.wasted_cpu:.2f} cpus, {wasted:.2f} GiB
+""".format(p=p, main=main, mem=p.node_memory / 2. ** 30,
+           wasted=p.wasted_memory / 2. ** 30)
+
+
+def num_nodes(conf):
+    """Number of nodes to create for a configuration
+
+    ``cluster.num_nodes`` may be "auto", to use the planned minimum for
+    ``workers.count`` and the groups of workers on the same nodes;
+    otherwise it is used as given, with a warning if it is too small for
+    the workers to start.
+    """
+    requested = conf['cluster']['num_nodes']
+    try:
+        needed = pool_nodes(conf)
+    except ValueError as e:
+        if requested == 'auto':
+            raise
+        logger.warning("Could not plan node count: {}".format(e))
+        return int(requested)
+    if requested == 'auto':
+        return needed
+    if int(requested) < needed:
+        logger.warning("The workers need {} nodes, but num_nodes is {}; "
+                       "some workers will not start".format(needed,
+                                                            requested))
+    return int(requested)
@@ -0,0 +1,157 @@
+"""Local access to a cluster's services through ``kubectl port-forward``
+
+With ``cluster.access: tunnel``, jupyter and the scheduler have no
+external IP; instead, their ports are forwarded to the same ports on
+localhost. A port-forward dies whenever its pod is replaced or the
+connection to the API server drops, so each one is supervised, and
+restarted with a growing delay while it keeps failing.
+"""
+from collections import deque
+import logging
+import socket
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PortForward(object):
+    """Supervised ``kubectl port-forward`` of one service
+
+    Parameters
+    ----------
+    context: str
+        kubernetes context of the cluster
+    service: str
+        Name of the service
+    ports: list of int
+        Service ports, each forwarded to the same port on localhost
+    kubectl: str
+        kubectl executable to run
+    backoff, max_backoff: float
+        Seconds to wait before the first restart, and at most
+    """
+    # lines of output kept for the warning when the port-forward ends;
+    # the rest is dropped, as a forward may run for days
+    keep_lines = 5
+
+    def __init__(self, context, service, ports, kubectl='kubectl',
+                 backoff=1, max_backoff=30):
+        self.context = context
+        self.service = service
+        self.ports = [int(p) for p in ports]
+        self.kubectl = kubectl
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.proc = None
+        self.restarts = 0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def command(self):
+        cmd = [self.kubectl, 'port-forward', 'service/' + self.service]
+        cmd += ['{0}:{0}'.format(p) for p in self.ports]
+        if self.context:
+            cmd[1:1] = ['--context', self.context]
+        return cmd
+
+    def _supervise(self):
+        delay = self.backoff
+        while not self.stopped.is_set():
+            with self.lock:
+                if self.stopped.is_set():
+                    break
+                logger.debug("starting: {}".format(' '.join(self.command())))
+                self.proc = subprocess.Popen(self.command(),
+                                             stdout=subprocess.PIPE,
+                                             stderr=subprocess.STDOUT)
+            started = time.time()
+            out = deque(maxlen=self.keep_lines)
+            for line in iter(self.proc.stdout.readline, b''):
+                out.append(line)
+            self.proc.stdout.close()
+            self.proc.wait()
+            if self.stopped.is_set():
+                break
+            if time.time() - started > 10 * self.backoff:
+                # it worked for a while: try again promptly
+                delay = self.backoff
+            self.restarts += 1
+            logger.warning("Port-forward to {} ended, restarting in {}s: {}"
+                           "".format(self.service, delay,
+                                     b''.join(out).decode(
+                                         'utf-8', 'replace').strip()))
+            self.stopped.wait(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def start(self):
+        thread = threading.Thread(target=self._supervise)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.stopped.set()
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.terminate()
+                self.proc.wait()
+
+
+class Tunnel(object):
+    """Port-forwards of jupyter and the scheduler, as a context manager
+
+    Parameters
+    ----------
+    conf: dict
+        Saved configuration of the cluster
+    context: str
+        kubernetes context of the cluster
+    kubectl: str
+        kubectl executable to run
+    """
+
+    def __init__(self, conf, context, kubectl='kubectl'):
+        scheduler, jupyter = conf['scheduler'], conf['jupyter']
+        self.forwards = [
+            PortForward(context, 'dask-scheduler',
+                        [scheduler['tcp_port'], scheduler['http_port'],
+                         scheduler['bokeh_port']], kubectl=kubectl),
+            PortForward(context, 'jupyter-notebook',
+                        [jupyter['port'], jupyter['lab_port']],
+                        kubectl=kubectl),
+        ]
+
+    def ports(self):
+        return [p for f in self.forwards for p in f.ports]
+
+    def start(self):
+        for forward in self.forwards:
+            forward.start()
+        return self
+
+    def stop(self):
+        for forward in self.forwards:
+            forward.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def wait_for_port(port, host='localhost', timeout=30):
+    """Block until something accepts connections on the port
+
+    Returns False if nothing did within the timeout.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except (IOError, OSError):
+            time.sleep(0.2)
+    return False
@@ -0,0 +1,169 @@
+"""Recovering workers from node preemption
+
+Preemptible nodes get about 30 seconds' notice before they are reclaimed:
+GKE taints them, marks them unschedulable, and kubernetes starts shutting
+their pods down. Left alone, the workers there die mid-task, losing the
+results in their memory, and their replacements only start once the
+controller notices. The supervisor here follows node and pod events and,
+at the first notice for a node, asks the scheduler to retire the workers on
+it (so their data moves to other workers), then deletes their pods so that
+replacements are scheduled at once. Each recovery is timed until as many
+workers are ready again as before the notice.
+"""
+from collections import namedtuple
+import logging
+import time
+
+from . import profile
+from .scheduler import host_of
+from .watch import ClusterState, unwrap
+
+logger = logging.getLogger(__name__)
+
+# taints put on nodes about to go away
+TERMINATION_TAINTS = {
+    'cloud.google.com/impending-node-termination',
+    'node.kubernetes.io/unschedulable',
+    'ToBeDeletedByClusterAutoscaler',
+}
+# reasons given to pods killed by a node shutting down
+TERMINATION_REASONS = {'Terminated', 'Shutdown', 'NodeShutdown'}
+
+# node: name; notice: time of the first notice; retired: worker addresses
+# retired; pods: pods deleted; retired_at: when retiring finished;
+# recovered_at: when enough workers were ready again, or None
+Recovery = namedtuple('Recovery', ['node', 'notice', 'retired', 'pods',
+                                   'retired_at', 'recovered_at'])
+
+
+def node_doomed(event, node):
+    """Reason a node is going away, or None"""
+    if event == 'DELETED':
+        return 'deleted'
+    spec = node.get('spec', {})
+    for taint in spec.get('taints') or []:
+        if taint.get('key') in TERMINATION_TAINTS:
+            return taint['key']
+    if spec.get('unschedulable'):
+        return 'unschedulable'
+    for cond in node.get('status', {}).get('conditions') or []:
+        if cond.get('type') == 'Ready' and cond.get('status') != 'True':
+            return 'not ready'
+    return None
+
+
+class Supervisor(object):
+    """Retire and replace the workers of nodes about to be reclaimed
+
+    Parameters
+    ----------
+    client: scheduler.SchedulerClient
+    kube: backend.Backend
+    replace: bool
+        Delete the retired workers' pods, so that their replacements are
+        scheduled at once rather than when the node dies
+    clock: callable
+        Source of time stamps, for testing
+    """
+
+    def __init__(self, client, kube, replace=True, clock=time.time):
+        self.client = client
+        self.kube = kube
+        self.replace = replace
+        self.clock = clock
+        self.state = ClusterState()
+        self.pod_nodes = {}
+        self.pod_ips = {}
+        self.doomed = set()
+        self.pending = []
+        self.recoveries = []
+
+    def workers(self):
+        return self.state.ready_count['dask-worker']
+
+    def handle(self, kind, obj):
+        """Apply one watch event, acting on any termination notice"""
+        event, obj = unwrap(obj)
+        name = obj.get('metadata', {}).get('name')
+        if name is None:
+            return
+        if kind == 'nodes':
+            reason = node_doomed(event, obj)
+            if reason and name not in self.doomed:
+                self.doomed.add(name)
+                self.evacuate(name, reason)
+            elif not reason:
+                self.doomed.discard(name)
+        elif kind == 'pods':
+            node = obj.get('spec', {}).get('nodeName')
+            if node:
+                self.pod_nodes[name] = node
+            ip = obj.get('status', {}).get('podIP')
+            if ip:
+                self.pod_ips[name] = ip
+            reason = obj.get('status', {}).get('reason')
+            if (reason in TERMINATION_REASONS and node and
+                    node not in self.doomed):
+                # the pod heard of the shutdown before we saw the node
+                self.doomed.add(node)
+                self.evacuate(node, reason)
+            self.state.update('pods', {'type': event, 'object': obj})
+            if event == 'DELETED':
+                self.pod_nodes.pop(name, None)
+                self.pod_ips.pop(name, None)
+        self.check_recovered()
+
+    def evacuate(self, node, reason):
+        """Retire the workers on a node, and replace their pods"""
+        notice = self.clock()
+        before = self.workers()
+        pods = sorted(p for p, n in self.pod_nodes.items() if n == node and
+                      self.state.ready.get(p) == 'dask-worker')
+        logger.warning("Node {} is going away ({}), with {} workers".format(
+            node, reason, len(pods)))
+        if not pods:
+            return
+        ips = set(self.pod_ips[p] for p in pods if p in self.pod_ips)
+        try:
+            addresses = sorted(a for a in self.client.load().workers
+                               if host_of(a) in ips)
+            if addresses:
+                self.client.retire_workers(addresses)
+        except (IOError, ValueError, RuntimeError) as e:
+            logger.warning("Could not retire workers: {}".format(e))
+            addresses = []
+        retired_at = self.clock()
+        if self.replace:
+            for pod in pods:
+                try:
+                    self.kube.delete('pods', pod)
+                except Exception as e:
+                    logger.warning("Could not delete pod {}: {}".format(
+                        pod, e))
+        self.pending.append((before, Recovery(node, notice, addresses, pods,
+                                              retired_at, None)))
+
+    def check_recovered(self):
+        """Finish recoveries whose workers are gone, and replaced"""
+        pending = []
+        for before, rec in self.pending:
+            if (self.workers() < before or
+                    any(p in self.state.ready for p in rec.pods)):
+                pending.append((before, rec))
+                continue
+            now = self.clock()
+            rec = rec._replace(recovered_at=now)
+            self.recoveries.append(rec)
+            logger.info("Recovered from losing {} in {:.1f}s ({} workers "
+                        "retired in {:.1f}s)".format(
+                            rec.node, now - rec.notice, len(rec.retired),
+                            rec.retired_at - rec.notice))
+            profile.record('recover', rec.notice, now, node=rec.node,
+                           workers=len(rec.pods))
+        self.pending = pending
+
+    def run(self, events):
+        """Handle (kind, object) events until they run out"""
+        for kind, obj in events:
+            self.handle(kind, obj)
+
@@ -0,0 +1,97 @@
+"""Timing of external commands and internal phases of CLI commands
+
+Every gcloud/kubectl invocation made through ``utils`` and every phase
+wrapped in ``span()`` is recorded here, so that a slow ``create`` can be
+broken down. The records can be printed as a summary table, or written as
+a Chrome trace (load in chrome://tracing or https://ui.perfetto.dev).
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+records = []
+origin = time.time()
+_lock = threading.Lock()
+_threads = {}
+
+
+def record(name, start, end, category='phase', **args):
+    """Add a finished span, with times from time.time()"""
+    ident = threading.current_thread().ident
+    with _lock:
+        tid = _threads.setdefault(ident, len(_threads))
+        records.append({'name': name, 'cat': category, 'start': start,
+                        'end': end, 'tid': tid, 'args': args})
+
+
+@contextmanager
+def span(name, category='phase', **args):
+    """Time the enclosed block
+
+    Yields the dict of arguments to be recorded, to which results such as
+    exit codes can be added.
+    """
+    start = time.time()
+    try:
+        yield args
+    finally:
+        record(name, start, time.time(), category, **args)
+
+
+def clear():
+    global origin
+    with _lock:
+        records[:] = []
+        _threads.clear()
+        origin = time.time()
+
+
+def summary():
+    """Table of total, mean and max durations, grouped by span name"""
+    groups = {}
+    order = []
+    for rec in records:
+        key = (rec['cat'], rec['name'])
+        if key not in groups:
+            order.append(key)
+        groups.setdefault(key, []).append(rec)
+    lines = ['{:<8} {:>5} {:>9} {:>9} {:>9} {:>5} {:>9}  {}'.format(
+        'kind', 'count', 'total(s)', 'mean(s)', 'max(s)', 'exit', 'out(B)',
+        'name')]
+    for cat, name in order:
+        recs = groups[(cat, name)]
+        durations = [r['end'] - r['start'] for r in recs]
+        codes = set(r['args'].get('exit_code') for r in recs) - {None}
+        out = sum(r['args'].get('output_bytes', 0) for r in recs)
+        lines.append('{:<8} {:>5} {:>9.3f} {:>9.3f} {:>9.3f} {:>5} {:>9}  {}'
+                     .format(cat, len(recs), sum(durations),
+                             sum(durations) / len(recs), max(durations),
+                             ','.join(str(c) for c in sorted(codes)) or '-',
+                             out or '-', _shorten(name)))
+    if records:
+        wall = max(r['end'] for r in records) - origin
+        lines.append('wall time since start: {:.3f}s'.format(wall))
+    return '\n'.join(lines)
+
+
+def _shorten(name, width=70):
+    return name if len(name) <= width else name[:width - 3] + '...'
+
+
+def chrome_trace():
+    """Records in the Chrome trace-event JSON format"""
+    pid = os.getpid()
+    events = [{'name': r['name'], 'cat': r['cat'], 'ph': 'X',
+               'ts': int((r['start'] - origin) * 1e6),
+               'dur': int((r['end'] - r['start']) * 1e6),
+               'pid': pid, 'tid': r['tid'], 'args': r['args']}
+              for r in records]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'start': origin}}
+
+
+def write_trace(fn):
+    with open(fn, 'w') as f:
+        json.dump(chrome_trace(), f)
@@ -0,0 +1,162 @@
+"""Talking to the running dask scheduler
+
+Load information comes from the scheduler's HTTP/JSON port
+(``scheduler.http_port``), which needs nothing but the standard library.
+Retiring workers gracefully needs the scheduler's RPC, and so the optional
+``distributed`` package.
+"""
+from collections import namedtuple
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# snapshot of the scheduler's load
+#   workers: dict of worker address to dict with (where known) 'ncores',
+#            'memory' (bytes in use), 'memory_limit', 'cpu' (percent),
+#            'processing' (number of tasks assigned) and 'spilled' (bytes)
+#   queued: number of tasks waiting or assigned but not yet finished
+#   idle: sorted list of worker addresses with nothing to do
+Load = namedtuple('Load', ['workers', 'queued', 'idle'])
+
+
+class SchedulerClient(object):
+    """Client for one scheduler
+
+    Parameters
+    ----------
+    host: str
+        Address of the scheduler service
+    http_port: int
+        Port of the HTTP/JSON interface
+    tcp_port: int
+        Port of the scheduler itself, for retiring workers
+    timeout: float
+        Seconds to wait for each request
+    """
+
+    def __init__(self, host, http_port=9786, tcp_port=8786, timeout=10):
+        self.host = host
+        self.http_port = http_port
+        self.tcp_port = tcp_port
+        self.timeout = timeout
+
+    @classmethod
+    def from_services(cls, services, conf):
+        """Client for the scheduler found by services_in_context()"""
+        jupyter, jport, jlport, scheduler, sport, bport = services
+        if not scheduler:
+            raise RuntimeError("Scheduler service has no address yet")
+        return cls(scheduler, conf['scheduler']['http_port'], sport)
+
+    def get(self, route):
+        from six.moves.urllib.request import urlopen
+        url = 'http://{}:{}/{}'.format(self.host, self.http_port, route)
+        resp = urlopen(url, timeout=self.timeout)
+        try:
+            return json.loads(resp.read().decode('utf-8'))
+        finally:
+            resp.close()
+
+    def load(self):
+        """Current Load of the scheduler"""
+        workers = {}
+        for addr, info in self.get('workers.json').items():
+            metrics = info.get('metrics', info)
+            workers[addr] = {
+                'ncores': info.get('ncores'),
+                'memory_limit': info.get('memory_limit'),
+                'memory': metrics.get('memory'),
+                'cpu': metrics.get('cpu'),
+                'spilled': metrics.get('spilled_nbytes', 0),
+                'processing': 0,
+            }
+        try:
+            processing = self.get('processing.json')
+        except (IOError, ValueError):
+            processing = {}
+        for addr, tasks in processing.items():
+            if addr in workers:
+                workers[addr]['processing'] = (
+                    tasks if isinstance(tasks, int) else len(tasks))
+        tasks = self.get('tasks.json')
+        queued = sum(tasks.get(k, 0) for k in ('waiting', 'ready',
+                                               'processing', 'no-worker'))
+        idle = sorted(a for a, w in workers.items() if not w['processing'])
+        return Load(workers, queued, idle)
+
+    def n_workers(self):
+        return len(self.get('workers.json'))
+
+    def wait_for_workers(self, n, timeout=None, interval=1):
+        """Block until at least ``n`` workers are connected
+
+        Raises RuntimeError if they are not within ``timeout`` seconds.
+        Returns the number of connected workers.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                count = self.n_workers()
+            except (IOError, ValueError) as e:
+                logger.debug("Scheduler not answering: {}".format(e))
+                count = 0
+            if count >= n:
+                return count
+            if deadline is not None and time.time() > deadline:
+                raise RuntimeError("Only {} of {} workers connected after {} "
+                                   "seconds".format(count, n, timeout))
+            time.sleep(interval)
+
+    def retire_workers(self, addresses):
+        """Ask the scheduler to move data off these workers and close them
+
+        Returns False if this is not possible, because ``distributed`` is not
+        installed, in which case the workers' data will be lost when their
+        pods are removed.
+        """
+        if not addresses:
+            return True
+        try:
+            from distributed import Client
+        except ImportError:
+            logger.warning("Install distributed to retire workers gracefully;"
+                           " removing them without moving their data")
+            return False
+        client = Client('{}:{}'.format(self.host, self.tcp_port),
+                        timeout=self.timeout)
+        try:
+            client.retire_workers(workers=list(addresses))
+        finally:
+            client.close()
+        return True
+
+
+def host_of(address):
+    """IP of a worker address like "tcp://10.0.0.4:41234"; with one IP per
+    pod, this identifies the pod"""
+    return address.split('://')[-1].rsplit(':', 1)[0]
+
+
+def worker_pods(pods, addresses):
+    """Names of the pods running the given worker addresses
+
+    Parameters
+    ----------
+    pods: list of dict
+        Pod objects, as returned by kubernetes
+    addresses: list of str
+        Worker addresses like "tcp://10.0.0.4:41234"
+    """
+    ips = {}
+    for pod in pods:
+        ip = pod.get('status', {}).get('podIP')
+        if ip:
+            ips[ip] = pod['metadata']['name']
+    out = []
+    for addr in addresses:
+        host = host_of(addr)
+        if host in ips and ips[host] not in out:
+            out.append(ips[host])
+    return out
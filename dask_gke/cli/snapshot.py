@@ -0,0 +1,125 @@
+"""The state of a cluster, from a single query
+
+Commands used to ask kubernetes separately for services, pods, replication
+controllers and nodes, each time fetching every object of the kind and
+going through it in Python. Instead, everything labelled ``app=dask`` is
+fetched at once (``kubectl get pods,services,replicationcontrollers,nodes
+-l app=dask``), gone through once, and reduced to the few values commands
+need, which are cached together. Each new snapshot is also recorded in the
+usage history.
+"""
+from collections import Counter
+import logging
+
+from . import cache, usage
+from .utils import parse_pods, parse_services, worker_pool
+
+logger = logging.getLogger(__name__)
+
+POOL_LABEL = 'cloud.google.com/gke-nodepool'
+
+
+class Snapshot(object):
+    """Values derived from the dask objects of a cluster
+
+    Parameters
+    ----------
+    objects: dict
+        Kind to list of objects, from Backend.snapshot()
+
+    Attributes
+    ----------
+    services: tuple, as from parse_services()
+    pods: (live, dead), as from parse_pods()
+    replicas: dict of replication controller to its desired replicas
+    groups: dict of worker controller (``dask-worker`` and those of
+        ``workers.groups``) to [desired, ready, not ready] pods
+    pools: Counter of node pool to number of nodes, or None if no nodes
+        carry the label (clusters made before nodes were labelled)
+    """
+
+    def __init__(self, objects):
+        self.services = parse_services(objects.get('services', []))
+        self.pods = parse_pods(objects.get('pods', []))
+        self.replicas = {rc['metadata']['name']: rc['spec']['replicas']
+                         for rc in objects.get('replicationcontrollers', [])}
+        self.groups = {name: [count, 0, 0] for name, count in
+                       self.replicas.items()
+                       if name.startswith('dask-worker')}
+        for pod in objects.get('pods', []):
+            group = self.groups.get(
+                pod['metadata'].get('labels', {}).get('name'))
+            if group is not None:
+                statuses = pod.get('status', {}).get('containerStatuses')
+                group[1 if statuses and statuses[0].get('ready') else 2] += 1
+        nodes = objects.get('nodes', [])
+        self.pools = Counter(n['metadata'].get('labels', {}).get(POOL_LABEL)
+                             for n in nodes) if nodes else None
+
+    def worker_nodes(self, pool=None):
+        """Number of nodes in the workers' pool, or of all nodes"""
+        if self.pools is None:
+            return None
+        if pool:
+            return self.pools[pool]
+        return sum(self.pools.values())
+
+    def values(self, pool=None):
+        """Everything, as JSON-compatible values by cache key"""
+        return {'services': list(self.services),
+                'pods': list(self.pods),
+                'replicas': self.replicas.get('dask-worker'),
+                'groups': self.groups,
+                'nodes': self.worker_nodes(pool)}
+
+
+def worker_nodes(conf, kube):
+    """Number of nodes which can run workers, listing them"""
+    pool = worker_pool(conf)
+    if pool:
+        return len(kube.list('nodes', POOL_LABEL + '=' + pool))
+    return len(kube.nodes())
+
+
+def cluster_state(cluster, conf, kube, keys=('services', 'pods', 'nodes',
+                                             'replicas'), refresh=False,
+                  record=True):
+    """Values of a cluster, by cache key
+
+    They come from the cache if all the ``keys`` are there, else from one
+    new snapshot, which replaces all of them in the cache.
+
+    Parameters
+    ----------
+    cluster: str
+    conf: dict
+        Saved configuration of the cluster
+    kube: backend.Backend
+    keys: iterable of str
+        Values wanted, of 'services', 'pods', 'nodes', 'replicas' and
+        'groups'
+    refresh: bool
+        Ignore cached values
+    record: bool
+        Add a new snapshot to the usage history
+    """
+    if not refresh:
+        out = {key: cache.lookup(cluster, key) for key in keys}
+        if all(value is not None for value in out.values()):
+            logger.debug("Using cached {} for {}".format(
+                ', '.join(keys), cluster))
+            return out
+    values = Snapshot(kube.snapshot()).values(worker_pool(conf))
+    if values['nodes'] is None and 'nodes' in keys:
+        values['nodes'] = worker_nodes(conf, kube)
+    entries = cache.load(cluster)
+    for key, value in values.items():
+        if value is None or key == 'services' and not all(value):
+            # services without addresses yet are not remembered
+            entries.pop(key, None)
+        else:
+            entries[key] = cache.entry(value)
+    cache.save(cluster, entries)
+    if record:
+        usage.record_values(cluster, values)
+    return values
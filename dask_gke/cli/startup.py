@@ -0,0 +1,201 @@
+"""Where the time goes when worker pods start
+
+Every worker pod goes through the same steps: waiting for a node (which
+the autoscaler may have to add), being scheduled onto it, pulling the
+image, creating and starting the container, and becoming ready. The time
+stamps of these steps are in the pods' status conditions and in the
+events kubernetes records for them, so the report is computed from a
+collection of pods, nodes and events, which can be saved as JSON and
+reported on, or compared, later. Events are only kept for about an hour,
+so collect soon after the workers started.
+"""
+import calendar
+from collections import namedtuple
+import json
+import time
+
+from .backend import SELECTOR
+
+# name, from step, to step
+PHASES = [
+    ('node', 'created', 'node_ready'),
+    ('schedule', 'created', 'scheduled'),
+    ('pull', 'pulling', 'pulled'),
+    ('create', 'pulled', 'container_created'),
+    ('start', 'container_created', 'started'),
+    ('ready', 'started', 'ready'),
+    ('total', 'created', 'ready'),
+]
+# event reason to step
+EVENT_STEPS = {'Scheduled': 'scheduled', 'Pulling': 'pulling',
+               'Pulled': 'pulled', 'Created': 'container_created',
+               'Started': 'started'}
+# condition type to step
+CONDITION_STEPS = {'PodScheduled': 'scheduled', 'Ready': 'ready'}
+
+# count, p50, p95 and max of one phase's durations, in seconds
+Stats = namedtuple('Stats', ['count', 'p50', 'p95', 'max'])
+
+
+def parse_time(text):
+    """Seconds since the epoch, from an RFC3339 time stamp, or None"""
+    if not text:
+        return None
+    seconds = calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S'))
+    if text[19:20] == '.':
+        fraction = text[20:].rstrip('Z').split('+')[0].split('-')[0]
+        seconds += float('0.' + fraction) if fraction else 0
+    return seconds
+
+
+def collect(kube):
+    """Pods, nodes and events of a cluster, as saved by ``--save``"""
+    return {'pods': kube.list('pods', SELECTOR), 'nodes': kube.nodes(),
+            'events': kube.list('events')}
+
+
+def _event_time(event):
+    return parse_time(event.get('firstTimestamp') or event.get('eventTime')
+                      or event.get('metadata', {}).get('creationTimestamp'))
+
+
+def timelines(data, container='dask-worker'):
+    """Time of each step of each pod running ``container``
+
+    Returns
+    -------
+    dict of pod name to dict of step to time, with 'node' the name of its
+    node
+    """
+    nodes = {}
+    for node in data.get('nodes', []):
+        ready = None
+        for cond in node.get('status', {}).get('conditions') or []:
+            if cond.get('type') == 'Ready' and cond.get('status') == 'True':
+                ready = parse_time(cond.get('lastTransitionTime'))
+        nodes[node['metadata']['name']] = (
+            parse_time(node['metadata'].get('creationTimestamp')), ready)
+    out = {}
+    for pod in data.get('pods', []):
+        containers = pod.get('spec', {}).get('containers') or [{}]
+        if containers[0].get('name') != container:
+            continue
+        steps = {'created': parse_time(
+            pod['metadata'].get('creationTimestamp')),
+            'node': pod.get('spec', {}).get('nodeName')}
+        for cond in pod.get('status', {}).get('conditions') or []:
+            step = CONDITION_STEPS.get(cond.get('type'))
+            if step and cond.get('status') == 'True':
+                steps[step] = parse_time(cond.get('lastTransitionTime'))
+        created, ready = nodes.get(steps['node'], (None, None))
+        if created and steps['created'] and created > steps['created']:
+            # the pod had to wait for this node to be added
+            steps['node_ready'] = ready
+        out[pod['metadata']['name']] = steps
+    # first occurrences only, should containers have been restarted
+    for event in sorted(data.get('events', []),
+                        key=lambda e: _event_time(e) or 0):
+        obj = event.get('involvedObject', {})
+        step = EVENT_STEPS.get(event.get('reason'))
+        if obj.get('kind') != 'Pod' or obj.get('name') not in out or not step:
+            continue
+        out[obj['name']].setdefault(step, _event_time(event))
+    for steps in out.values():
+        if 'pulled' in steps and 'pulling' not in steps:
+            # already present on the node: no time spent pulling
+            steps['pulling'] = steps['pulled']
+    return out
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, int(-(-q * len(values) // 100)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def durations(timelines):
+    """Seconds spent in each phase, as dict of phase to {pod: seconds}"""
+    out = {}
+    for name, start, end in PHASES:
+        for pod, steps in timelines.items():
+            if steps.get(start) is not None and steps.get(end) is not None:
+                out.setdefault(name, {})[pod] = max(0, steps[end] -
+                                                    steps[start])
+    return out
+
+
+def stats(durations):
+    """Stats of each phase"""
+    out = {}
+    for phase, values in durations.items():
+        values = sorted(values.values())
+        out[phase] = Stats(len(values), percentile(values, 50),
+                           percentile(values, 95), values[-1])
+    return out
+
+
+def outliers(timelines, durations, factor=2, slack=5):
+    """Nodes whose pods are slow in some phase
+
+    A node is flagged when the median time of its pods in a phase is more
+    than ``factor`` times, and ``slack`` seconds more than, that of all
+    pods.
+
+    Returns
+    -------
+    list of (phase, node, node's median, overall median, number of pods)
+    """
+    out = []
+    for name, start, end in PHASES:
+        if name in ('total', 'node') or name not in durations:
+            continue
+        by_node = {}
+        for pod, seconds in durations[name].items():
+            by_node.setdefault(timelines[pod].get('node'), []).append(seconds)
+        overall = percentile(sorted(durations[name].values()), 50)
+        for node, values in sorted(by_node.items(), key=lambda x: str(x[0])):
+            median = percentile(sorted(values), 50)
+            if median > factor * overall and median > overall + slack:
+                out.append((name, node, median, overall, len(values)))
+    return out
+
+
+def report(data):
+    """(stats, outliers, number of worker pods) of collected data"""
+    lines = timelines(data)
+    times = durations(lines)
+    return stats(times), outliers(lines, times), len(lines)
+
+
+def format_report(data, baseline=None):
+    """Text report of collected data, compared with a baseline's if given"""
+    phase_stats, slow, pods = report(data)
+    base = report(baseline)[0] if baseline is not None else {}
+    lines = ['Start-up of {} worker pods'.format(pods),
+             '{:<10} {:>5} {:>8} {:>8} {:>8}{}'.format(
+                 'PHASE', 'PODS', 'P50 (s)', 'P95 (s)', 'MAX (s)',
+                 '  P50 BEFORE' if base else '')]
+    for name, start, end in PHASES:
+        if name not in phase_stats:
+            continue
+        s = phase_stats[name]
+        line = '{:<10} {:>5} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+            name, s.count, s.p50, s.p95, s.max)
+        if name in base:
+            line += '  {:>11.1f}'.format(base[name].p50)
+        lines.append(line)
+    for name, node, median, overall, count in slow:
+        lines.append('slow {} on node {}: {:.1f}s median over {} pods, '
+                     'against {:.1f}s overall'.format(name, node, median,
+                                                     count, overall))
+    return '\n'.join(lines)
+
+
+def load(fn):
+    with open(fn) as f:
+        return json.load(f)
+
+
+def save(data, fn):
+    with open(fn, 'w') as f:
+        json.dump(data, f)
@@ -0,0 +1,187 @@
+"""Deleting clusters, and everything made for them
+
+Deleting a GKE cluster does not delete the load balancers of its services:
+kubernetes removes those only if it gets to before the cluster goes, and
+they are then left behind, and paid for. So the forwarding rules, target
+pools and firewall rules of each cluster's load balancers are found up
+front, from the addresses of its services, and deleted together with the
+cluster, all at once; then everything is listed again until it is gone, so
+that whatever is left over gets reported.
+"""
+from collections import namedtuple
+import json
+import logging
+import time
+
+from .utils import call_many, run_many
+
+logger = logging.getLogger(__name__)
+
+# kind: one of LISTINGS; region: of forwarding rules and target pools, zone
+# of clusters; cluster: name of the cluster it belongs to
+Resource = namedtuple('Resource', ['kind', 'name', 'region', 'cluster'])
+
+LISTINGS = {
+    'forwarding-rules': 'gcloud compute forwarding-rules list --format json',
+    'target-pools': 'gcloud compute target-pools list --format json',
+    'firewall-rules': 'gcloud compute firewall-rules list --format json',
+    'cluster': 'gcloud container clusters list --format json',
+}
+
+
+def region_of(zone):
+    """Region of a zone, e.g. us-central1 for us-central1-b"""
+    return zone.rsplit('-', 1)[0]
+
+
+def basename(url):
+    return (url or '').rstrip('/').rsplit('/', 1)[-1]
+
+
+def external_addresses(services):
+    """Load balancer IPs of the items of ``kubectl get services``"""
+    return {ingress['ip'] for s in services
+            for ingress in s.get('status', {}).get(
+                'loadBalancer', {}).get('ingress') or []
+            if ingress.get('ip')}
+
+
+def find_resources(cluster, zone, addresses, rules, firewalls):
+    """Everything to delete for one cluster
+
+    Parameters
+    ----------
+    cluster, zone: str
+    addresses: set of str
+        External IPs of the cluster's services
+    rules, firewalls: lists of dicts
+        Forwarding rules and firewall rules of the project, as listed by
+        gcloud
+
+    Returns
+    -------
+    list of Resource, the cluster itself last
+    """
+    firewall_names = {f['name'] for f in firewalls}
+    found = []
+    for rule in rules:
+        if rule.get('IPAddress') not in addresses:
+            continue
+        region = basename(rule.get('region')) or region_of(zone)
+        found.append(Resource('forwarding-rules', rule['name'], region,
+                              cluster))
+        if '/targetPools/' in (rule.get('target') or ''):
+            found.append(Resource('target-pools', basename(rule['target']),
+                                  region, cluster))
+        # kubernetes opens the nodes to each load balancer with a rule
+        # named after it
+        firewall = 'k8s-fw-' + rule['name']
+        if firewall in firewall_names:
+            found.append(Resource('firewall-rules', firewall, None, cluster))
+    found.append(Resource('cluster', cluster, zone, cluster))
+    return found
+
+
+def delete_command(resource):
+    if resource.kind == 'cluster':
+        return ("gcloud container clusters delete {} --zone {} --quiet "
+                "--async".format(resource.name, resource.region))
+    cmd = 'gcloud compute {} delete {} --quiet'.format(resource.kind,
+                                                        resource.name)
+    if resource.region:
+        cmd += ' --region ' + resource.region
+    return cmd
+
+
+def _listing(result):
+    cmd, code, out = result
+    if code:
+        raise RuntimeError('Listing failed: {}\n{}'.format(cmd, out))
+    return json.loads(out)
+
+
+def discover(clusters):
+    """Resources of each cluster, listed concurrently
+
+    Parameters
+    ----------
+    clusters: list of (name, zone, context)
+
+    Returns
+    -------
+    list of Resource
+    """
+    cmds = ['kubectl --context {} get services --output=json'.format(context)
+            for name, zone, context in clusters]
+    cmds += [LISTINGS['forwarding-rules'], LISTINGS['firewall-rules']]
+    results = list(run_many(cmds))
+    rules, firewalls = _listing(results[-2]), _listing(results[-1])
+    found = []
+    for (name, zone, context), (cmd, code, out) in zip(clusters, results):
+        if code:
+            logger.warning("Could not list the services of {}, so its load "
+                           "balancers are not deleted: {}".format(
+                               name, out.strip()))
+            addresses = set()
+        else:
+            addresses = external_addresses(json.loads(out)['items'])
+        found.extend(find_resources(name, zone, addresses, rules, firewalls))
+    return found
+
+
+def remaining(resources):
+    """Those of the resources which still exist
+
+    Resources whose kind could not be listed count as remaining.
+    """
+    kinds = sorted({r.kind for r in resources})
+    names = {}
+    for kind, (cmd, code, out) in zip(
+            kinds, run_many([LISTINGS[k] for k in kinds])):
+        names[kind] = None
+        if code:
+            logger.debug("Listing {} failed: {}".format(kind, out.strip()))
+            continue
+        try:
+            names[kind] = {item['name'] for item in json.loads(out)}
+        except ValueError:
+            logger.debug("Unexpected listing of {}: {}".format(kind, out))
+    return [r for r in resources
+            if names[r.kind] is None or r.name in names[r.kind]]
+
+
+def teardown(clusters, timeout=900, interval=5):
+    """Delete clusters and their load balancers; wait until they are gone
+
+    Parameters
+    ----------
+    clusters: list of (name, zone, context)
+    timeout: float
+        Seconds to wait for everything to be gone
+    interval: float
+        Seconds between checks
+
+    Returns
+    -------
+    list of the Resources still there after ``timeout``
+    """
+    resources = discover(clusters)
+    for r in resources:
+        logger.info("Deleting {} {} (of {})".format(r.kind, r.name,
+                                                    r.cluster))
+    # the services go first, so that kubernetes stops managing their load
+    # balancers; target pools can only go once their forwarding rules have
+    first = ['kubectl --context {} delete services --all --wait=false'.format(
+        context) for name, zone, context in clusters]
+    first += [delete_command(r) for r in resources
+              if r.kind in ('forwarding-rules', 'firewall-rules')]
+    call_many(first)
+    call_many([delete_command(r) for r in resources
+               if r.kind in ('target-pools', 'cluster')])
+
+    deadline = time.time() + timeout
+    left = remaining(resources)
+    while left and time.time() < deadline:
+        time.sleep(interval)
+        left = remaining(left)
+    return left
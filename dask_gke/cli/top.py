@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Live view of the workers' load, for the terminal
+
+Each sample combines what the scheduler knows of every worker process (CPU,
+memory, spilled bytes, tasks) with what the metrics server knows of the
+pods and nodes they run on. The last few samples of each worker are kept
+in a fixed-size ring buffer, for sparklines and averages, so that memory
+use stays flat however long ``top`` runs; samples can also be appended to
+a file, as JSON lines, to look at afterwards.
+"""
+from __future__ import unicode_literals
+
+from collections import deque
+import json
+import logging
+import subprocess
+import time
+
+from .backend import SELECTOR
+from .scheduler import host_of
+
+logger = logging.getLogger(__name__)
+
+SPARKS = ' ▁▂▃▄▅▆▇█'
+SORT_KEYS = {
+    'memory': lambda r: -(r['memory'] or 0),
+    'cpu': lambda r: -(r['cpu'] or 0),
+    'tasks': lambda r: -r['processing'],
+    'spilled': lambda r: -(r['spilled'] or 0),
+    'name': lambda r: r['address'],
+}
+
+
+class History(object):
+    """The last ``size`` samples of each worker
+
+    Workers which leave are forgotten, so the buffer is bounded by the
+    number of live workers times ``size``.
+    """
+
+    def __init__(self, size=60):
+        self.size = size
+        self.samples = {}
+
+    def add(self, rows):
+        live = set()
+        for row in rows:
+            live.add(row['address'])
+            self.samples.setdefault(
+                row['address'], deque(maxlen=self.size)).append(row)
+        for address in [a for a in self.samples if a not in live]:
+            del self.samples[address]
+
+    def series(self, address, key):
+        return [s[key] or 0 for s in self.samples.get(address, ())]
+
+    def mean(self, address, key):
+        values = self.series(address, key)
+        return sum(values) / float(len(values)) if values else 0
+
+
+def sparkline(values, top=None):
+    """One character per value, scaled to ``top`` (or the largest value)"""
+    top = top or max(values or [0]) or 1
+    return ''.join(SPARKS[int(round(min(v / float(top), 1) *
+                                    (len(SPARKS) - 1)))] for v in values)
+
+
+def format_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('', 'K', 'M', 'G'):
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024.
+    return '{:.1f}T'.format(n)
+
+
+def _usage(kube, kind):
+    try:
+        return kube.usage(kind)
+    except (RuntimeError, ValueError, KeyError,
+            subprocess.CalledProcessError) as e:
+        logger.debug("No {} metrics: {}".format(kind, e))
+        return {}
+
+
+def sample(client, kube):
+    """Current state of every worker, and usage of the nodes
+
+    Returns
+    -------
+    (rows, nodes): list of dicts, one per worker process, and dict of node
+    name to (cpu cores, memory bytes), empty without a metrics server
+    """
+    load = client.load()
+    pods = {}
+    for pod in kube.list('pods', SELECTOR):
+        ip = pod.get('status', {}).get('podIP')
+        if ip:
+            pods[ip] = (pod['metadata']['name'],
+                        pod.get('spec', {}).get('nodeName'))
+    usage = _usage(kube, 'pods')
+    rows = []
+    for address, w in load.workers.items():
+        pod, node = pods.get(host_of(address), (None, None))
+        pod_cpu, pod_memory = usage.get(pod, (None, None))
+        rows.append(dict(w, address=address, pod=pod, node=node,
+                         pod_cpu=pod_cpu, pod_memory=pod_memory))
+    return rows, _usage(kube, 'nodes')
+
+
+def render(rows, history, nodes=None, sort='memory', width=20):
+    """Text table of the latest sample, with each worker's memory history"""
+    lines = ['{:<24} {:<22} {:>5} {:>6} {:>13} {:>7} {:>5} {:>6} {:>6} '
+             '{}'.format('WORKER', 'POD', 'CPU%', 'AVG%', 'MEMORY', 'SPILLED',
+                         'TASKS', 'P.CPU', 'P.MEM', 'MEMORY HISTORY')]
+    for r in sorted(rows, key=SORT_KEYS[sort]):
+        address = r['address']
+        memory = '{}/{}'.format(format_bytes(r['memory']),
+                                format_bytes(r['memory_limit']))
+        pod_cpu = '-' if r['pod_cpu'] is None else '{:.2f}'.format(
+            r['pod_cpu'])
+        spark = sparkline(history.series(address, 'memory')[-width:],
+                          r['memory_limit'])
+        lines.append('{:<24} {:<22} {:>5.0f} {:>6.0f} {:>13} {:>7} {:>5} '
+                     '{:>6} {:>6} {}'.format(
+                         address.split('://')[-1][:24], (r['pod'] or '-')[:22],
+                         r['cpu'] or 0, history.mean(address, 'cpu'), memory,
+                         format_bytes(r['spilled']), r['processing'], pod_cpu,
+                         format_bytes(r['pod_memory']), spark))
+    total = sum(r['memory'] or 0 for r in rows)
+    limit = sum(r['memory_limit'] or 0 for r in rows)
+    lines.append('{} workers, {} tasks, memory {}/{}, spilled {}'.format(
+        len(rows), sum(r['processing'] for r in rows), format_bytes(total),
+        format_bytes(limit), format_bytes(sum(r['spilled'] or 0
+                                              for r in rows))))
+    for name in sorted(nodes or {}):
+        cpu, memory = nodes[name]
+        lines.append('  node {}: {:.2f} cpus, {}'.format(
+            name, cpu, format_bytes(memory)))
+    return '\n'.join(lines)
+
+
+def run(client, kube, echo, interval=2, history_size=60, sort='memory',
+        log=None, once=False, clear=None):
+    """Sample and display every ``interval`` seconds, until interrupted
+
+    Parameters
+    ----------
+    client: scheduler.SchedulerClient
+    kube: backend.Backend
+    echo: callable
+        Shows the text of each update
+    log: str or None
+        File to which to append every sample, as JSON lines
+    clear: callable or None
+        Clears the screen before each update
+    """
+    history = History(history_size)
+    while True:
+        try:
+            rows, nodes = sample(client, kube)
+        except (IOError, ValueError) as e:
+            logger.warning("Could not reach the scheduler: {}".format(e))
+        else:
+            history.add(rows)
+            if log:
+                with open(log, 'a') as f:
+                    f.write(json.dumps({'time': time.time(), 'workers': rows,
+                                        'nodes': nodes}) + '\n')
+            if clear is not None:
+                clear()
+            echo(render(rows, history, nodes, sort))
+        if once:
+            return history
+        time.sleep(interval)
@@ -0,0 +1,233 @@
+"""History of what clusters ran, and how busy they were
+
+Every command which takes a fresh snapshot of a cluster appends the numbers
+of nodes and workers it saw to a small SQLite database next to the saved
+configs (``~/.dask/kubernetes/usage.sqlite``). ``dask-gke usage --sample``
+adds samples at a regular interval, including the scheduler's load, so
+that the time workers spent idle is known too. The report integrates the
+samples into node-hours and worker-hours, and suggests the number of
+workers, and of nodes to hold them, that would have been enough.
+
+Each sample stands for the time until the next one of its cluster, but
+for no more than ``max_gap`` seconds, so that the hours between sporadic
+commands, or after a cluster was deleted, are not counted.
+"""
+from collections import namedtuple
+import logging
+import math
+import os
+import time
+
+from . import planner
+from .startup import percentile
+from .utils import pardir
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['cluster', 'time', 'nodes', 'workers', 'ready', 'dead',
+           'connected', 'busy', 'queued']
+# one observation of a cluster; unknown values are None
+#   nodes: nodes which can run workers
+#   workers: desired worker pods (replicas)
+#   ready, dead: worker pods ready and not
+#   connected, busy: scheduler workers, and those with tasks to run
+#   queued: unfinished tasks
+Sample = namedtuple('Sample', COLUMNS)
+
+# summary of one cluster's samples; hours are None if never observed
+Usage = namedtuple('Usage', ['cluster', 'samples', 'start', 'end',
+                             'node_hours', 'worker_hours', 'idle',
+                             'peak_busy'])
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS samples (
+    cluster TEXT NOT NULL, time REAL NOT NULL, nodes INTEGER,
+    workers INTEGER, ready INTEGER, dead INTEGER, connected INTEGER,
+    busy INTEGER, queued INTEGER);
+CREATE INDEX IF NOT EXISTS samples_cluster_time ON samples (cluster, time);
+"""
+
+
+def db_path():
+    return pardir('usage.sqlite')
+
+
+def connect():
+    """Connection to the store, or None if there is no config directory"""
+    import sqlite3
+    fn = db_path()
+    if not os.path.isdir(os.path.dirname(fn)):
+        return None
+    conn = sqlite3.connect(fn, timeout=5)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record(cluster, now=None, **values):
+    """Append one sample; failing to is never an error for the caller
+
+    Parameters
+    ----------
+    cluster: str
+    now: float
+        Time of the sample, default now
+    values: the other fields of Sample
+    """
+    import sqlite3
+    row = Sample(cluster, time.time() if now is None else now,
+                 *[values.pop(k, None) for k in COLUMNS[2:]])
+    if values:
+        raise ValueError("Unknown sample values: %s" % sorted(values))
+    try:
+        conn = connect()
+        if conn is None:
+            return
+        with conn:
+            conn.execute('INSERT INTO samples VALUES (%s)' %
+                         ', '.join('?' * len(COLUMNS)), row)
+        conn.close()
+    except sqlite3.Error as e:
+        logger.debug("Could not record usage of {}: {}".format(cluster, e))
+
+
+def record_values(cluster, values, **extra):
+    """Record the values of a Snapshot, by cache key"""
+    live, dead = values.get('pods') or ({}, {})
+    groups = values.get('groups')
+    record(cluster, nodes=values.get('nodes'),
+           workers=(sum(g[0] for g in groups.values()) if groups
+                    else values.get('replicas')),
+           ready=len(live.get('dask-worker', [])),
+           dead=len(dead.get('dask-worker', [])), **extra)
+
+
+def samples(clusters=None, since=None):
+    """Samples in time order, of the given clusters or all of them"""
+    conn = connect()
+    if conn is None:
+        return []
+    query, args = 'SELECT * FROM samples WHERE time >= ?', [since or 0]
+    if clusters:
+        query += ' AND cluster IN (%s)' % ', '.join('?' * len(clusters))
+        args.extend(clusters)
+    try:
+        return [Sample(*row) for row in
+                conn.execute(query + ' ORDER BY time', args)]
+    finally:
+        conn.close()
+
+
+def sample(cluster, state, client):
+    """Take and record one sample of the cluster and its scheduler
+
+    Parameters
+    ----------
+    cluster: str
+    state: callable
+        Returns fresh values by cache key, as snapshot.cluster_state()
+    client: scheduler.SchedulerClient
+    """
+    values = state()
+    load = {}
+    try:
+        workers, queued, idle = client.load()
+        load = {'connected': len(workers),
+                'busy': len(workers) - len(idle), 'queued': queued}
+    except (IOError, ValueError) as e:
+        logger.warning("Could not get the scheduler's load: {}".format(e))
+    record_values(cluster, values, **load)
+    return values, load
+
+
+def run(cluster, state, client, interval=60, once=False):
+    """Sample every ``interval`` seconds, until interrupted"""
+    while True:
+        start = time.time()
+        values, load = sample(cluster, state, client)
+        logger.info("{}: {} nodes, {} of {} workers ready{}".format(
+            cluster, values['nodes'], len(values['pods'][0].get(
+                'dask-worker', [])), values['replicas'],
+            ', {busy} of {connected} busy, {queued} tasks'.format(**load)
+            if load else ''))
+        if once:
+            return
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+def summarize(rows, now=None, max_gap=600):
+    """Usage of each cluster, from its samples in time order
+
+    Returns
+    -------
+    list of Usage, by cluster name
+    """
+    now = time.time() if now is None else now
+    by_cluster = {}
+    for row in rows:
+        by_cluster.setdefault(row.cluster, []).append(row)
+    out = []
+    for cluster, rows in sorted(by_cluster.items()):
+        totals = {'nodes': [0, 0], 'workers': [0, 0], 'idle': [0, 0]}
+        ends = [r.time for r in rows[1:]] + [max(now, rows[-1].time)]
+        for row, end in zip(rows, ends):
+            seconds = min(end - row.time, max_gap)
+            for key, value in [('nodes', row.nodes),
+                               ('workers', row.ready)]:
+                if value is not None:
+                    totals[key][0] += value * seconds
+                    totals[key][1] += seconds
+            if row.connected:
+                totals['idle'][0] += (row.connected - row.busy) * seconds
+                totals['idle'][1] += row.connected * seconds
+        busy = sorted(r.busy for r in rows if r.busy is not None)
+        out.append(Usage(
+            cluster, len(rows), rows[0].time, rows[-1].time,
+            totals['nodes'][0] / 3600. if totals['nodes'][1] else None,
+            totals['workers'][0] / 3600. if totals['workers'][1] else None,
+            (float(totals['idle'][0]) / totals['idle'][1]
+             if totals['idle'][1] else None),
+            percentile(busy, 95) if busy else None))
+    return out
+
+
+def suggest(usage, conf):
+    """Worker pods and nodes that would have held the busy workers
+
+    The 95th percentile of busy scheduler workers, in pods of
+    ``workers.processes`` workers each, and the nodes the planner needs
+    for them.
+
+    Returns
+    -------
+    (workers, nodes), or (None, None) without load samples
+    """
+    if usage.peak_busy is None:
+        return None, None
+    processes = int(conf['workers'].get('processes', 1)) if conf else 1
+    workers = max(1, int(math.ceil(usage.peak_busy / float(processes))))
+    nodes = None
+    if conf:
+        try:
+            nodes = planner.plan(conf, workers).nodes
+        except (KeyError, ValueError) as e:
+            logger.debug("Cannot plan {}: {}".format(usage.cluster, e))
+    return workers, nodes
+
+
+def format_usage(usages, confs):
+    """Text table of Usage, with suggestions from the clusters' configs"""
+    def num(value, fmt='{:.1f}'):
+        return '-' if value is None else fmt.format(value)
+    lines = ['{:<20} {:>7} {:>10} {:>10} {:>6} {:>8} {:>8} {:>8}'.format(
+        'CLUSTER', 'SAMPLES', 'NODE-HRS', 'WORKER-HRS', 'IDLE', 'WORKERS',
+        'SUGGEST', 'NODES')]
+    for u in usages:
+        conf = confs.get(u.cluster)
+        workers, nodes = suggest(u, conf)
+        current = conf['workers']['count'] if conf else None
+        lines.append(
+            '{:<20} {:>7} {:>10} {:>10} {:>6} {:>8} {:>8} {:>8}'.format(
+                u.cluster, u.samples, num(u.node_hours),
+                num(u.worker_hours), num(u.idle and u.idle * 100,
+                                         '{:.0f}%'),
+                num(current, '{}'), num(workers, '{}'), num(nodes, '{}')))
+    return '\n'.join(lines)
@@ -1,15 +1,22 @@
-import collections
 import functools
 from math import ceil
-import jinja2
 import logging
 import os
+import re
 import subprocess
 import sys
+import time
 import yaml
 
 import six
 
+from . import profile
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 defaults = os.path.abspath(os.path.join(os.path.dirname(__file__),
                                         'defaults.yaml'))
 template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
@@ -17,6 +24,30 @@ template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
 logger = logging.getLogger(__name__)
 
 
+try:
+    from shutil import which as find_executable
+except ImportError:  # python 2
+    from distutils.spawn import find_executable
+
+_executables = {}
+
+
+def which(command):
+    """Path of an executable on PATH, or None; looked up once per process"""
+    if command not in _executables:
+        _executables[command] = find_executable(command)
+    return _executables[command]
+
+
+def check_commands(*commands):
+    """Exit if any of the commands is not available"""
+    missing = [command for command in commands if which(command) is None]
+    for command in missing:
+        logger.error("Required command does not exist: {}".format(command))
+    if missing:
+        sys.exit(1)
+
+
 def required_commands(*commands):
     def decorator(f):
         @functools.wraps(f)
@@ -24,39 +55,205 @@ def required_commands(*commands):
             """
             Fails if any required command is not available
             """
-            failed = False
-            for command in commands:
-                try:
-                    # Unix-specific command lookup
-                    subprocess.check_output("which {}".format(command), shell=True)
-                except subprocess.CalledProcessError:
-                    logger.error("Required command does not exist: {}".format(
-                        command))
-                    failed = True
-            if failed:
-                sys.exit(1)
+            check_commands(*commands)
             return f(*args, **kwargs)
         return wrapper
     return decorator
 
 
 def call(cmd):
+    """Execute command, returning its exit code"""
     logger.debug("executing: {}".format(cmd))
-    subprocess.call(cmd, shell=True)
+    with profile.span(cmd, 'command') as rec:
+        rec['exit_code'] = subprocess.call(cmd, shell=True)
+    return rec['exit_code']
 
 
 def check_output(cmd):
     logger.debug("executing: {}".format(cmd))
-    return subprocess.check_output(cmd, shell=True).decode("utf-8")
+    with profile.span(cmd, 'command') as rec:
+        try:
+            out = subprocess.check_output(cmd, shell=True)
+        except subprocess.CalledProcessError as e:
+            rec['exit_code'] = e.returncode
+            raise
+        rec['exit_code'] = 0
+        rec['output_bytes'] = len(out)
+    return out.decode("utf-8")
+
+
+class Spawned(subprocess.Popen):
+    """Popen of a background command, recorded as a ``command`` span, with
+    its exit code, when first waited on"""
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.started = time.time()
+        self.recorded = False
+        subprocess.Popen.__init__(self, cmd, shell=True)
+
+    def wait(self, *args, **kwargs):
+        code = subprocess.Popen.wait(self, *args, **kwargs)
+        if not self.recorded:
+            self.recorded = True
+            profile.record(self.cmd, self.started, time.time(), 'command',
+                           exit_code=code)
+        return code
+
+
+def spawn(cmd):
+    """Start a command in the background, returning its Popen"""
+    logger.debug("starting: {}".format(cmd))
+    return Spawned(cmd)
+
+
+def run(cmd):
+    """Execute command, capturing output; returns (returncode, output)"""
+    logger.debug("executing: {}".format(cmd))
+    with profile.span(cmd, 'command') as rec:
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        out = proc.communicate()[0]
+        rec['exit_code'] = proc.returncode
+        rec['output_bytes'] = len(out)
+    return proc.returncode, out.decode("utf-8")
+
+
+def run_many(cmds, max_workers=8):
+    """Execute independent commands concurrently
+
+    Yields (cmd, returncode, output) in the order of ``cmds``, each as soon
+    as it and all commands before it have finished.
+    """
+    if not cmds:
+        return
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(max_workers, len(cmds)))
+    try:
+        for cmd, (code, out) in zip(cmds, pool.imap(run, cmds)):
+            yield cmd, code, out
+    finally:
+        pool.terminate()
+
+
+def call_many(cmds, max_workers=8, check=False):
+    """Execute independent commands concurrently, logging their output
+
+    Output is logged in the order of ``cmds``, each line prefixed by the
+    position of its command. Every failure is collected and logged, rather
+    than stopping at the first.
+
+    Parameters
+    ----------
+    cmds: list of str
+        Shell commands
+    max_workers: int
+        Most commands to run at once
+    check: bool
+        Raise RuntimeError after all have finished, if any failed
+
+    Returns
+    -------
+    List of (cmd, returncode, output), in the order of ``cmds``
+    """
+    results, failed = [], []
+    for i, (cmd, code, out) in enumerate(run_many(cmds, max_workers)):
+        prefix = "[{}] ".format(i)
+        logger.info(prefix + cmd)
+        for line in out.splitlines():
+            logger.info(prefix + line)
+        if code:
+            logger.error("{}failed with exit code {}".format(prefix, code))
+            failed.append(cmd)
+        results.append((cmd, code, out))
+    if failed and check:
+        raise RuntimeError("Commands failed:\n" + "\n".join(failed))
+    return results
+
+
+def parse_services(items):
+    """Find the external endpoints of the jupyter and scheduler services
+
+    Parameters
+    ----------
+    items: list of dict
+        Service objects, as returned by kubernetes
+
+    Returns
+    -------
+    (jupyter, jupyter_port, jupyterl_port, scheduler, scheduler_port,
+     bokeh_port), with None for anything not yet assigned.
+    """
+    (jupyter, jupyter_port, jupyterl_port, scheduler, scheduler_port,
+     bokeh_port) = [None] * 6
+    for item in items:
+        try:
+            name = item['spec']['selector']['name']
+            ports = item['spec']['ports']
+            if item['spec'].get('type') == 'ClusterIP':
+                # reached through ``dask-gke tunnel``
+                ip = 'localhost'
+            else:
+                ip = item['status']['loadBalancer']['ingress'][0]['ip']
+        except KeyError:
+            continue
+        if name == 'jupyter-notebook':
+            jupyter = ip
+            for port in ports:
+                if port['name'] == 'jupyter-http':
+                    jupyter_port = port['port']
+                if port['name'] == 'jupyter-lab-http':
+                    jupyterl_port = port['port']
+        if name == 'dask-scheduler':
+            scheduler = ip
+            for port in ports:
+                if port['name'] == 'dask-scheduler-tcp':
+                    scheduler_port = port['port']
+                if port['name'] == 'dask-scheduler-bokeh':
+                    bokeh_port = port['port']
+    return jupyter, jupyter_port, jupyterl_port, scheduler, scheduler_port, bokeh_port
+
+
+def parse_pods(items):
+    """Sort dask pods into live and dead, by container name
+
+    Parameters
+    ----------
+    items: list of dict
+        Pod objects, as returned by kubernetes
+
+    Returns
+    -------
+    live, dead: dicts of container name to list of pod names
+    """
+    live, dead = {}, {}
+    for item in items:
+        try:
+            container = item['spec']['containers'][0]
+            name = container['name']
+            if name in ['jupyter-notebook', 'dask-scheduler', 'dask-worker']:
+                ready = item['status']['containerStatuses'][0]['ready']
+                pod = item['metadata']['name']
+                if ready:
+                    live.setdefault(name, []).append(pod)
+                else:
+                    dead.setdefault(name, []).append(pod)
+        except:
+            continue
+    return live, dead
 
 
 def mem_bytes(m):
     """Translate java memory spec to bytes"""
+    if isinstance(m, six.integer_types):
+        return m
     mult = {'Ki': 2 ** 10, 'Mi': 2 ** 20, 'Gi': 2 ** 30}
     for k, v in mult.items():
         if k in m:
             return v * int(m.replace(k, ''))
-    return m
+    try:
+        return int(m)
+    except ValueError:
+        return m
 
 
 def read_conf(config):
@@ -78,7 +275,7 @@ def nested_update(d, u):
     """
     # http://stackoverflow.com/a/3233356/1889400
     for k, v in u.items():
-        if isinstance(v, collections.Mapping):
+        if isinstance(v, Mapping):
             r = nested_update(d.get(k, {}), v)
             d[k] = r
         else:
@@ -110,9 +307,9 @@ def get_conf(settings, args=None):
         YAML file with some or all of the entries in defaults.yaml
     args: list of strings
         Override parameters like "jupyter.port=443"."""
-    conf = yaml.load(open(defaults).read())
+    conf = yaml.safe_load(open(defaults).read())
     if settings is not None:
-        settings = yaml.load(read_conf(settings))
+        settings = yaml.safe_load(read_conf(settings))
         nested_update(conf, settings)
 
     if args:
@@ -120,15 +317,278 @@ def get_conf(settings, args=None):
         for override in overrides:
             nested_update(conf, override)
 
-    # worker memory should be slightly less than container capacity
-    factor = float(conf['workers']['mem_factor'])
-    conf['workers']['memory_per_worker2'] = int(factor * mem_bytes(
-        conf['workers']['memory_per_worker']))
-    conf['workers']['cpus_per_worker2'] = int(ceil(
-        float(conf['workers']['cpus_per_worker'])))
+    workers = conf['workers']
+    derive_workers(conf, workers, 'workers')
+    workers['prepull'] = as_bool(workers.get('prepull', False))
+    conf['scheduler']['probes'] = as_bool(
+        conf['scheduler'].get('probes', False))
+    # keep workers off the scheduler/jupyter pool
+    pool = worker_pool(conf)
+    conf['workers']['node_selector'] = (
+        {'cloud.google.com/gke-nodepool': pool} if pool else {})
+    workers['controller'] = 'dask-worker'
+    workers['groups'] = worker_group_confs(conf)
+    # tunnelled services get no external IP, so are quick to create
+    access = conf['cluster'].get('access') or 'loadbalancer'
+    if access not in ACCESS_MODES:
+        raise ValueError("cluster.access must be one of {}".format(
+            ACCESS_MODES))
+    service_type = 'ClusterIP' if access == 'tunnel' else 'LoadBalancer'
+    conf['scheduler']['service_type'] = service_type
+    conf['jupyter']['service_type'] = service_type
     return conf
 
 
+def derive_workers(conf, workers, section):
+    """Validate the settings of a group of workers, and derive the values
+    the templates use, in place
+
+    Parameters
+    ----------
+    conf: dict
+        Configuration
+    workers: dict
+        ``conf['workers']``, or the settings of one of its groups
+    section: str
+        Where the settings come from, for error messages
+    """
+    processes = workers.get('processes')
+    processes = 1 if processes in (None, '') else int(processes)
+    if processes < 1:
+        raise ValueError("{}.processes must be at least 1".format(section))
+    cores = int(ceil(float(workers['cpus_per_worker'])))
+    threads = workers.get('threads_per_process')
+    if threads is None or threads == 'null':
+        threads = max(1, int(ceil(cores / float(processes))))
+    threads = int(threads)
+    if threads < 1:
+        raise ValueError("{}.threads_per_process must be at least 1".format(
+            section))
+    if processes * threads > cores:
+        logger.warning("{} processes of {} threads oversubscribe {} cores "
+                       "per worker of {}".format(processes, threads, cores,
+                                                  section))
+    workers['processes'] = processes
+    memory = mem_bytes(workers['memory_per_worker'])
+    if not isinstance(memory, six.integer_types):
+        raise ValueError("Can't interpret {}.memory_per_worker: "
+                         "{}".format(section, memory))
+    memory -= check_spill(conf, memory)
+    # worker memory should be slightly less than container capacity,
+    # and is shared between the processes
+    factor = float(workers['mem_factor'])
+    workers['memory_per_worker2'] = int(factor * memory / processes)
+    workers['cpus_per_worker2'] = threads
+    workers['guaranteed'] = as_bool(workers.get('guaranteed', False))
+    workers['probes'] = as_bool(workers.get('probes', False))
+    resources = workers.get('resources') or {}
+    if not isinstance(resources, Mapping):
+        raise ValueError("{}.resources must be a mapping of name to "
+                         "amount".format(section))
+    workers['resources'] = dict(resources)
+    workers['resources_arg'] = ','.join(
+        '{}={}'.format(k, v) for k, v in sorted(resources.items()))
+
+
+GROUP_KEYS = ['name', 'count', 'cpus_per_worker', 'memory_per_worker',
+              'processes', 'threads_per_process', 'image',
+              'image_pull_policy', 'guaranteed', 'node_selector',
+              'resources']
+GROUP_NAME = re.compile('^[a-z0-9]([-a-z0-9]*[a-z0-9])?$')
+
+
+def worker_group_confs(conf):
+    """Settings of each of ``workers.groups``, complete with those of the
+    workers they do not override
+
+    Each group's controller is ``dask-worker-<name>``; its node selector
+    adds to (or replaces entries of) that of the workers.
+    """
+    workers = conf['workers']
+    groups = workers.get('groups') or []
+    if isinstance(groups, six.string_types):
+        # from the command line, like -s 'workers.groups=[{name: big}]'
+        groups = yaml.safe_load(groups) or []
+    if not isinstance(groups, list):
+        raise ValueError("workers.groups must be a list")
+    out, names = [], set()
+    for i, group in enumerate(groups):
+        if not isinstance(group, Mapping) or 'name' not in group:
+            raise ValueError("workers.groups[{}] needs a name".format(i))
+        name = str(group['name'])
+        section = 'workers.groups[{}]'.format(name)
+        if not GROUP_NAME.match(name) or len(name) > 50:
+            raise ValueError("{}: names are lower case letters, digits and "
+                             "dashes".format(section))
+        if name in names:
+            raise ValueError("{} is given twice".format(section))
+        names.add(name)
+        unknown = set(group) - set(GROUP_KEYS)
+        if unknown:
+            raise ValueError("{} has unknown settings: {}".format(
+                section, ', '.join(sorted(unknown))))
+        settings = {k: v for k, v in workers.items()
+                    if k not in ('groups', 'count', 'resources')}
+        settings.update(group)
+        settings['node_selector'] = dict(workers['node_selector'],
+                                         **(group.get('node_selector') or {}))
+        settings['count'] = int(group.get('count', 0))
+        derive_workers(conf, settings, section)
+        settings['name'] = name
+        settings['controller'] = 'dask-worker-' + name
+        out.append(settings)
+    return out
+
+
+def worker_groups(conf):
+    """Settings of every group of workers, the main ``dask-worker`` first"""
+    return [conf['workers']] + list(conf['workers'].get('groups') or [])
+
+
+def pull_policy(section):
+    """imagePullPolicy of the containers of a section of the config
+
+    Unless set, images pinned to a digest are kept on the nodes, but tags,
+    which may move, are checked with the registry each time, as kubernetes
+    does for ``latest``.
+    """
+    policy = section.get('image_pull_policy')
+    if policy:
+        return policy
+    return 'IfNotPresent' if '@' in (section.get('image') or '') else 'Always'
+
+
+def prepull_sets(conf):
+    """The pre-pulling DaemonSets the workers need: one per distinct node
+    selector of the groups, pulling the images of the groups it selects
+
+    Returns
+    -------
+    list of dicts with name, node_selector and images, a list of
+    (image, pull policy), the main workers' DaemonSet first
+    """
+    out = []
+    for group in worker_groups(conf):
+        selector = group.get('node_selector') or {}
+        for prepull in out:
+            if prepull['node_selector'] == selector:
+                break
+        else:
+            prepull = {'name': 'dask-prepull' + (
+                '-%d' % len(out) if out else ''),
+                'node_selector': selector, 'images': []}
+            out.append(prepull)
+        image = (group['image'], pull_policy(group))
+        if image[0] not in [i for i, _ in prepull['images']]:
+            prepull['images'].append(image)
+    return out
+
+
+ACCESS_MODES = ['loadbalancer', 'tunnel']
+MEMORY_FRACTIONS = ['target', 'spill', 'pause', 'terminate']
+SPILL_MEDIA = ['disk', 'ssd', 'memory']
+LOCAL_SSD_BYTES = 375 * 10 ** 9
+
+
+def check_spill(conf, memory):
+    """Validate spill settings, and derive the workers' environment
+
+    Parameters
+    ----------
+    conf: dict
+        Configuration, updated in place
+    memory: int
+        Bytes of memory per worker container
+
+    Returns
+    -------
+    Bytes of the container's memory taken by a memory-backed volume
+    """
+    workers = conf['workers']
+    fractions = [float(workers['memory_' + k]) for k in MEMORY_FRACTIONS]
+    if not all(0 < f <= 1 for f in fractions) or fractions != sorted(
+            fractions):
+        raise ValueError("workers.memory_target/spill/pause/terminate must "
+                         "be increasing fractions, between 0 and 1")
+    workers['env'] = {
+        'DASK_DISTRIBUTED__WORKER__MEMORY__' + k.upper(): str(f)
+        for k, f in zip(MEMORY_FRACTIONS, fractions)}
+    spill = workers['spill']
+    if spill['medium'] not in SPILL_MEDIA:
+        raise ValueError("workers.spill.medium must be one of {}".format(
+            SPILL_MEDIA))
+    size = mem_bytes(spill['size'])
+    if not isinstance(size, six.integer_types) or size <= 0:
+        raise ValueError("Can't interpret workers.spill.size: {}".format(
+            spill['size']))
+    if spill['medium'] == 'memory':
+        if size >= memory:
+            raise ValueError("Memory-backed workers.spill.size must be less "
+                             "than workers.memory_per_worker")
+        return size
+    if spill['medium'] == 'ssd':
+        ssds = int(conf['cluster'].get('local_ssd_count') or 0)
+        if not ssds:
+            raise ValueError("Spilling to SSD needs cluster.local_ssd_count")
+        if size > ssds * LOCAL_SSD_BYTES:
+            raise ValueError("workers.spill.size is larger than the local "
+                             "SSDs of a node")
+    elif size > int(conf['cluster']['disk_size']) * 2 ** 30:
+        raise ValueError("workers.spill.size is larger than "
+                         "cluster.disk_size")
+    return 0
+
+
+def as_bool(value):
+    """Interpret config value, which may be a string from the command line"""
+    if isinstance(value, six.string_types):
+        return value.strip().lower() not in ('false', 'no', 'off', '0', '')
+    return bool(value)
+
+
+def worker_target(value, count):
+    """Number of workers to wait for
+
+    ``value`` is a number of workers, or a fraction of ``count``, like "0.9"
+    or "90%", rounded up.
+    """
+    value = str(value).strip()
+    if value.endswith('%'):
+        return int(ceil(float(value[:-1]) * int(count) / 100.))
+    if '.' in value:
+        return int(ceil(float(value) * int(count)))
+    return int(value)
+
+
+def worker_targets(value, groups):
+    """Number of worker pods to wait for, by controller
+
+    A fraction, like "0.9" or "90%", is of the count of each group; a
+    number is of the main ``dask-worker`` pods only.
+
+    Parameters
+    ----------
+    value: str
+        As for worker_target()
+    groups: list of dict
+        Settings of the groups of workers, as from worker_groups()
+    """
+    value = str(value).strip()
+    if value.endswith('%') or '.' in value:
+        return {g['controller']: worker_target(value, g['count'])
+                for g in groups}
+    return {'dask-worker': worker_target(value, 0)}
+
+
+def worker_pool(conf):
+    """Name of the node pool for workers, or None if the workers share the
+    cluster's default pool with the scheduler and jupyter"""
+    main = conf['cluster'].get('main_pool') or {}
+    if as_bool(main.get('enabled', False)):
+        return conf['cluster'].get('worker_pool') or 'dask-workers'
+    return None
+
+
 def render_templates(conf, par):
     """Render given config into kubernetes yaml files, in par directory
 
@@ -139,19 +599,31 @@ def render_templates(conf, par):
     par: str
         Directory to write to
     """
+    import jinja2
     loader = jinja2.PackageLoader("dask_gke", package_path="kubernetes")
     jenv = jinja2.Environment(loader=loader)
-    configs = {
-        os.path.join(par, name): jenv.get_template(name).render(conf)
-        for name in jenv.list_templates()
-    }
+    jenv.filters['pull_policy'] = pull_policy
+    configs = {}
+    prepull = (prepull_sets(conf) if conf['workers'].get('prepull')
+               else [])
+    for name in jenv.list_templates():
+        out = jenv.get_template(name).render(conf, prepull_sets=prepull)
+        # optional objects render to nothing when switched off
+        if out.strip():
+            configs[os.path.join(par, name)] = out
     configs[par + '.yaml'] = yaml.dump(conf, default_flow_style=False)
     return configs
 
 
 def load_config(cluster):
     """Load back the saved configuration for given cluster"""
-    return yaml.load(open(pardir(cluster) + '.yaml'))
+    return yaml.safe_load(open(pardir(cluster) + '.yaml'))
+
+
+def save_config(cluster, conf):
+    """Overwrite the saved configuration of given cluster"""
+    with open(pardir(cluster) + '.yaml', 'wt') as f:
+        f.write(yaml.dump(conf, default_flow_style=False))
 
 
 def write_templates(configs):
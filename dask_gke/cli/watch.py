@@ -0,0 +1,235 @@
+"""Event-driven readiness checks, following ``kubectl get --watch``
+
+Rather than repeatedly listing every pod and service, we keep one long-lived
+watch stream open per kind of object and update a local picture of the
+cluster as events arrive, so that waiting finishes as soon as the cluster
+is usable.
+"""
+from collections import Counter
+import json
+import logging
+import subprocess
+import threading
+import time
+
+from six.moves import queue
+
+from . import profile
+from .utils import parse_pods, parse_services
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('pods', 'services')
+
+
+def iter_json(stream):
+    """Yield the JSON documents in a stream of concatenated objects
+
+    This is what ``kubectl get --watch --output=json`` prints: one,
+    possibly pretty-printed, object per event, with no delimiter.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    for line in iter(stream.readline, b''):
+        buf += line.decode('utf-8')
+        while True:
+            buf = buf.lstrip()
+            if not buf:
+                break
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except ValueError:
+                # incomplete document, wait for more lines
+                break
+            yield obj
+            buf = buf[end:]
+
+
+def unwrap(obj):
+    """(event type, object) of a watch event
+
+    ``obj`` may be a bare object, or an event of the form
+    ``{"type": "MODIFIED", "object": {...}}``. Objects being deleted count
+    as deleted.
+    """
+    event = 'MODIFIED'
+    if 'object' in obj and 'type' in obj:
+        event, obj = obj['type'], obj['object']
+    if obj.get('metadata', {}).get('deletionTimestamp'):
+        event = 'DELETED'
+    return event, obj
+
+
+class ClusterState(object):
+    """Picture of the dask objects in a context, built from watch events"""
+
+    def __init__(self):
+        self.objects = {kind: {} for kind in KINDS}
+        # container of each ready pod, and how many there are of each, kept
+        # up to date as events arrive, so that checking readiness does not
+        # mean going through thousands of pods on every event
+        self.ready = {}
+        self.ready_count = Counter()
+
+    def update(self, kind, obj):
+        """Apply an event (see unwrap()) to the state"""
+        event, obj = unwrap(obj)
+        name = obj.get('metadata', {}).get('name')
+        if name is None:
+            return
+        store = self.objects.setdefault(kind, {})
+        if event == 'DELETED':
+            store.pop(name, None)
+            obj = None
+        else:
+            store[name] = obj
+        if kind == 'pods':
+            container = self.ready.pop(name, None)
+            if container:
+                self.ready_count[container] -= 1
+            live = parse_pods([obj])[0] if obj else {}
+            for container in live:
+                self.ready[name] = container
+                self.ready_count[container] += 1
+
+    def services(self):
+        return parse_services(self.objects['services'].values())
+
+    def pods(self):
+        return parse_pods(self.objects['pods'].values())
+
+    def services_ready(self):
+        jupyter, jport, jlport, scheduler, sport, bport = self.services()
+        return bool(jport and sport)
+
+    def pods_ready(self, workers=0):
+        count = self.ready_count
+        return (count['jupyter-notebook'] > 0 and count['dask-scheduler'] > 0
+                and count['dask-worker'] >= workers)
+
+
+class Watcher(object):
+    """Stream of (kind, object) events for the dask objects in a context
+
+    One ``kubectl get KIND --watch`` process is run per kind; if a stream
+    closes (the API server ends watches periodically), it is restarted.
+    Use as a context manager, so that the processes are cleaned up.
+    ``selector`` may be a dict of kind to label selector (or None, for all
+    objects of that kind).
+    """
+
+    def __init__(self, context, kinds=KINDS, kubectl='kubectl',
+                 selector='app=dask'):
+        self.context = context
+        self.kinds = kinds
+        self.kubectl = kubectl
+        self.selector = selector
+        self.queue = queue.Queue()
+        self.procs = {}
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def command(self, kind):
+        cmd = [self.kubectl, 'get', kind, '--watch', '--output=json']
+        if self.context:
+            cmd[1:1] = ['--context', self.context]
+        selector = self.selector
+        if isinstance(selector, dict):
+            selector = selector.get(kind)
+        if selector:
+            cmd.extend(['-l', selector])
+        return cmd
+
+    def _follow(self, kind):
+        while not self.stopped:
+            cmd = self.command(kind)
+            logger.debug("watching: {}".format(' '.join(cmd)))
+            with self.lock:
+                if self.stopped:
+                    break
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+                self.procs[kind] = proc
+            for obj in iter_json(proc.stdout):
+                self.queue.put((kind, obj))
+            proc.wait()
+            if not self.stopped:
+                logger.debug("watch on {} ended, restarting".format(kind))
+                time.sleep(1)
+
+    def start(self):
+        for kind in self.kinds:
+            thread = threading.Thread(target=self._follow, args=(kind, ))
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            for proc in self.procs.values():
+                if proc.poll() is None:
+                    proc.terminate()
+                    proc.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def events(self, deadline=None):
+        """Yield events until the deadline (a time.time() value), if given"""
+        while True:
+            if deadline is None:
+                timeout = 1
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return
+            try:
+                yield self.queue.get(timeout=min(timeout, 1))
+            except queue.Empty:
+                continue
+
+
+def wait_until_ready(context, workers=0, timeout=None, kubectl='kubectl'):
+    """Block until the services and pods of a dask cluster are up
+
+    Parameters
+    ----------
+    context: str
+        kubernetes context of the cluster
+    workers: int
+        Number of worker pods which must also be ready
+    timeout: float or None
+        Seconds to wait before raising RuntimeError
+    kubectl: str
+        kubectl executable to run
+
+    Returns
+    -------
+    ClusterState as of the moment the cluster was ready
+    """
+    state = ClusterState()
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+    services_up = first_worker = None
+    with Watcher(context, kubectl=kubectl) as watcher:
+        for kind, obj in watcher.events(deadline):
+            state.update(kind, obj)
+            if first_worker is None and state.ready_count['dask-worker']:
+                # how long a cold (or pre-pulled) worker takes to start
+                first_worker = time.time()
+                logger.info('First worker up after {:.1f}s'.format(
+                    first_worker - start))
+                profile.record('first-worker', start, first_worker)
+            if services_up is None and state.services_ready():
+                logger.info('Services are up')
+                services_up = time.time()
+                profile.record('wait-for-services', start, services_up)
+            if services_up and state.pods_ready(workers):
+                logger.info('Pods are up')
+                profile.record('wait-for-pods', services_up, time.time(),
+                               workers=workers)
+                return state
+    raise RuntimeError('Cluster not ready after {} seconds'.format(timeout))
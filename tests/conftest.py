@@ -0,0 +1,167 @@
+"""Fixtures shared by the tests
+
+``home`` is a scratch HOME with the config directory; ``fakecli`` puts
+``gcloud`` and ``kubectl`` on PATH, run by the scripted stand-in of the
+benchmarks; ``FakeBackend`` holds kubernetes objects in memory, for code
+which takes a backend.
+"""
+import json
+import os
+import stat
+import sys
+
+import pytest
+import six
+
+from dask_gke.cli.backend import SNAPSHOT_KINDS, SELECTOR, Backend
+from dask_gke.cli.utils import makedirs
+
+FAKECLI = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks', 'fakecli.py')
+
+
+@pytest.fixture
+def home(tmpdir, monkeypatch):
+    """HOME in a scratch directory, with an empty ~/.dask/kubernetes"""
+    monkeypatch.setenv('HOME', str(tmpdir))
+    makedirs(str(tmpdir.join('.dask', 'kubernetes')), exist_ok=True)
+    return tmpdir
+
+
+class FakeCLI(object):
+    """gcloud and kubectl run by benchmarks/fakecli.py
+
+    Every command line is logged; it is answered by the last rule given
+    which matches it, or else prints nothing and succeeds.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.log = path.join('log')
+        self.log.write('')
+        self.rules = []
+        self.save()
+
+    def answer(self, match, output=None, exit=0, after=None):
+        """Add a rule, as in fakecli.py; ``output`` is text, or an object
+        printed as JSON
+
+        Returns the rule, which can be removed from ``rules`` again
+        (followed by save()).
+        """
+        rule = {'match': match, 'exit': exit}
+        if output is not None:
+            fn = 'output-%i.txt' % len(os.listdir(str(self.path)))
+            self.path.join(fn).write(
+                output if isinstance(output, six.string_types)
+                else json.dumps(output))
+            rule['output'] = fn
+        if after is not None:
+            rule['after'] = after
+        self.rules.insert(0, rule)
+        self.save()
+        return rule
+
+    def save(self):
+        self.path.join('scenario.json').write(json.dumps(
+            {'rules': self.rules}))
+
+    def commands(self):
+        return self.log.read().splitlines()
+
+
+@pytest.fixture
+def fakecli(tmpdir, monkeypatch):
+    path = tmpdir.mkdir('fakecli')
+    bin = path.mkdir('bin')
+    for tool in ('gcloud', 'kubectl'):
+        script = bin.join(tool)
+        script.write('#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(
+            sys.executable, FAKECLI, tool))
+        os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', str(bin) + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('DASK_GKE_BENCH_SCENARIO',
+                       str(path.join('scenario.json')))
+    monkeypatch.setenv('DASK_GKE_BENCH_LOG', str(path.join('log')))
+    return FakeCLI(path)
+
+
+def pod(name, container='dask-worker', ready=True, ip=None, node=None,
+        labels=None):
+    out = {'metadata': {'name': name},
+           'spec': {'containers': [{'name': container}]},
+           'status': {'containerStatuses': [{'ready': ready}]}}
+    if labels is not None:
+        out['metadata']['labels'] = labels
+    if ip is not None:
+        out['status']['podIP'] = ip
+    if node is not None:
+        out['spec']['nodeName'] = node
+    return out
+
+
+def service(name, ports, ip='1.2.3.4'):
+    return {'metadata': {'name': name},
+            'spec': {'selector': {'name': name},
+                     'ports': [{'name': n, 'port': p} for n, p in ports]},
+            'status': {'loadBalancer': {'ingress': [{'ip': ip}]}}}
+
+
+def rc(name, replicas):
+    return {'metadata': {'name': name}, 'spec': {'replicas': replicas}}
+
+
+class FakeBackend(Backend):
+    """Kubernetes objects of one context in memory, by kind
+
+    Objects without labels match every selector. Snapshots, listings and
+    changes are counted or recorded, for the tests to check.
+    """
+    def __init__(self, objects=None, context='ctx'):
+        self.context = context
+        self.objects = {kind: list(items)
+                        for kind, items in (objects or {}).items()}
+        self.usages = {}
+        self.snapshots = 0
+        self.listed = []
+        self.deleted = []
+        self.cordoned = []
+
+    def list(self, kind, selector=None):
+        self.listed.append((kind, selector))
+        return self.select(kind, selector)
+
+    def select(self, kind, selector=None):
+        items = self.objects.get(kind, [])
+        if not selector:
+            return list(items)
+        key, value = selector.split('=')
+        labels = [i.get('metadata', {}).get('labels') for i in items]
+        return [item for item, found in zip(items, labels)
+                if found is None or found.get(key) == value]
+
+    def get(self, kind, name):
+        for item in self.objects.get(kind, []):
+            if item.get('metadata', {}).get('name') == name:
+                return item
+        raise RuntimeError("{} {} not found".format(kind, name))
+
+    def snapshot(self, kinds=SNAPSHOT_KINDS):
+        self.snapshots += 1
+        return {kind: self.select(kind, SELECTOR) for kind in kinds}
+
+    def scale(self, name, replicas):
+        self.get('replicationcontrollers', name)['spec'][
+            'replicas'] = replicas
+
+    def delete(self, kind, name):
+        self.deleted.append((kind, name))
+        self.objects[kind] = [i for i in self.objects.get(kind, [])
+                              if i.get('metadata', {}).get('name') != name]
+
+    def cordon(self, name, unschedulable=True):
+        self.cordoned.append((name, unschedulable))
+        self.get('nodes', name).setdefault('spec', {})[
+            'unschedulable'] = unschedulable
+
+    def metrics(self, kind):
+        return self.usages.get(kind, [])
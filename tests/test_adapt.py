@@ -0,0 +1,195 @@
+import json
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer
+
+from dask_gke.cli.adapt import Adaptive, cordon_empty, step
+from dask_gke.cli.scheduler import Load, SchedulerClient, worker_pods
+
+from conftest import FakeBackend, pod, rc
+
+
+def make_load(processing, queued, memory=0, limit=100):
+    workers = {'tcp://10.0.0.%i:4000' % i: {
+        'processing': p, 'memory': memory, 'memory_limit': limit}
+        for i, p in enumerate(processing)}
+    idle = sorted(a for a, w in workers.items() if not w['processing'])
+    return Load(workers, queued, idle)
+
+
+class FakeScheduler(BaseHTTPServer.BaseHTTPRequestHandler):
+    routes = {
+        '/workers.json': {
+            'tcp://10.0.0.1:4000': {'ncores': 2, 'memory_limit': 100,
+                                    'metrics': {'memory': 10, 'cpu': 50}},
+            'tcp://10.0.0.2:4000': {'ncores': 2, 'memory_limit': 100,
+                                    'metrics': {'memory': 90, 'cpu': 0}}},
+        '/processing.json': {'tcp://10.0.0.1:4000': ['x', 'y'],
+                             'tcp://10.0.0.2:4000': []},
+        '/tasks.json': {'waiting': 10, 'processing': 2, 'memory': 5},
+    }
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = json.dumps(self.routes[self.path]).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def workers(replicas):
+    """Four pods of the main workers, and one of a worker group"""
+    pods = [pod('worker-%i' % i, ip='10.0.0.%i' % i,
+                labels={'name': 'dask-worker'}) for i in range(4)]
+    pods.append(pod('big-0', ip='10.0.0.4',
+                    labels={'name': 'dask-worker-big'}))
+    return FakeBackend({'pods': pods, 'replicationcontrollers': [
+        rc('dask-worker', replicas), rc('dask-worker-big', replicas)]})
+
+
+class FakeClient(object):
+    def __init__(self, load):
+        self.load_ = load
+        self.retired = []
+
+    def load(self):
+        return self.load_
+
+    def retire_workers(self, addresses):
+        self.retired.extend(addresses)
+        return True
+
+
+@pytest.fixture
+def scheduler():
+    httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeScheduler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield SchedulerClient('127.0.0.1', httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_scheduler_load(scheduler):
+    load = scheduler.load()
+    assert load.queued == 12
+    assert load.idle == ['tcp://10.0.0.2:4000']
+    assert load.workers['tcp://10.0.0.1:4000']['processing'] == 2
+    assert load.workers['tcp://10.0.0.2:4000']['memory'] == 90
+    assert scheduler.n_workers() == 2
+
+
+def test_scale_up_with_cooldown():
+    a = Adaptive(minimum=1, maximum=10, tasks_per_worker=2, cooldown_up=30)
+    assert a.recommend(make_load([2, 2], 12), 2, now=0) == (6, [])
+    assert a.recommend(make_load([2] * 6, 16), 6, now=10) == (6, [])
+    assert a.recommend(make_load([2] * 6, 16), 6, now=40) == (8, [])
+    # bounded by maximum
+    assert a.recommend(make_load([2] * 8, 100), 8, now=80) == (10, [])
+
+
+def test_scale_up_on_memory():
+    a = Adaptive(minimum=1, maximum=10, memory_target=0.5)
+    assert a.recommend(make_load([1, 1], 0, memory=80), 2)[0] == 4
+
+
+def test_scale_down_hysteresis():
+    a = Adaptive(minimum=1, maximum=10, tasks_per_worker=2, wait_count=2,
+                 cooldown_down=0)
+    busy = make_load([1, 1, 0, 0], 2)
+    # wants 1 worker, but must ask twice; only idle workers are removed
+    assert a.recommend(busy, 4, now=0) == (4, [])
+    target, retire = a.recommend(busy, 4, now=1)
+    assert target == 2
+    assert retire == ['tcp://10.0.0.2:4000', 'tcp://10.0.0.3:4000']
+    # small differences are ignored
+    a = Adaptive(minimum=9, maximum=10, wait_count=1, cooldown_down=0)
+    assert a.recommend(make_load([0] * 10, 0), 10, now=0) == (10, [])
+
+
+def test_step_retires_and_scales():
+    a = Adaptive(minimum=1, maximum=10, tasks_per_worker=2, wait_count=1,
+                 cooldown_down=0)
+    client = FakeClient(make_load([1, 0, 0, 0], 1))
+    kube = workers(4)
+    nodes = []
+    assert step(a, client, kube, nodes.append) == 1
+    assert kube.replicas('dask-worker') == 1
+    assert client.retired == ['tcp://10.0.0.1:4000', 'tcp://10.0.0.2:4000',
+                              'tcp://10.0.0.3:4000']
+    assert kube.deleted == [('pods', 'worker-%i' % i) for i in (1, 2, 3)]
+    assert nodes == [1]
+
+
+def test_step_leaves_groups_alone():
+    a = Adaptive(minimum=1, maximum=10, tasks_per_worker=2, wait_count=1,
+                 cooldown_down=0)
+    # the group's worker is busy with 3 of the 4 tasks, and the last
+    # main worker idle: neither is retired, nor counted as main workers
+    client = FakeClient(make_load([1, 0, 0, 0, 3], 4))
+    kube = workers(4)
+    assert step(a, client, kube) == 1
+    assert client.retired == ['tcp://10.0.0.1:4000', 'tcp://10.0.0.2:4000',
+                              'tcp://10.0.0.3:4000']
+    assert kube.deleted == [('pods', 'worker-%i' % i) for i in (1, 2, 3)]
+
+    # adapting the group touches only its own pods
+    client = FakeClient(make_load([0, 0, 0, 0, 0], 0))
+    kube = workers(2)
+    assert step(a, client, kube, name='dask-worker-big') == 1
+    assert client.retired == ['tcp://10.0.0.4:4000']
+    assert kube.deleted == [('pods', 'big-0')]
+    assert kube.replicas('dask-worker') == 2
+
+
+class NodesBackend(FakeBackend):
+    """Three worker nodes and a main one; a pod lands on node-2 once it is
+    cordoned, as if scheduled meanwhile"""
+    def __init__(self):
+        nodes = [{'metadata': {'name': 'node-%i' % i, 'labels': {}}}
+                 for i in range(3)]
+        nodes.append({'metadata': {'name': 'main',
+                                   'labels': {'dask_main': 'thisone'}}})
+        FakeBackend.__init__(self, {'nodes': nodes,
+                                    'pods': [pod('a', node='node-0')]})
+
+    def cordon(self, name, unschedulable=True):
+        FakeBackend.cordon(self, name, unschedulable)
+        if name == 'node-2':
+            self.objects['pods'].append(pod('b', node=name))
+
+
+def test_cordon_empty():
+    kube = NodesBackend()
+    # node-0 is busy, main is not a worker node, and node-2 got a pod
+    nodes = cordon_empty(kube, 5)
+    assert [n['metadata']['name'] for n in nodes] == ['node-1']
+    assert kube.cordoned == [('node-1', True), ('node-2', True),
+                             ('node-2', False)]
+    kube = NodesBackend()
+    assert cordon_empty(kube, 1, exclude=['node-1']) == []
+    assert cordon_empty(kube, 0) == []
+
+
+def test_worker_pods():
+    pods = workers(0).list('pods')
+    assert worker_pods(pods, ['tcp://10.0.0.3:1', 'tcp://10.0.0.3:2',
+                              'tcp://10.9.9.9:1']) == ['worker-3']
+
+
+def test_scale_down_whole_pods():
+    # two processes per pod: only pods with both processes idle go
+    workers = {'tcp://10.0.0.1:1': {'processing': 1},
+               'tcp://10.0.0.1:2': {'processing': 0},
+               'tcp://10.0.0.2:1': {'processing': 0},
+               'tcp://10.0.0.2:2': {'processing': 0}}
+    load = Load(workers, 0, sorted(a for a, w in workers.items()
+                                   if not w['processing']))
+    a = Adaptive(minimum=0, maximum=10, wait_count=1, cooldown_down=0)
+    assert a.recommend(load, 2, now=0) == (
+        1, ['tcp://10.0.0.2:1', 'tcp://10.0.0.2:2'])
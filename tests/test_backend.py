@@ -0,0 +1,173 @@
+import json
+import sys
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer
+import yaml
+
+from dask_gke.cli.backend import (APIBackend, KubectlBackend, _token,
+                                  get_backend, use)
+
+
+PODS = {'items': [
+    {'metadata': {'name': 'dask-worker-a'},
+     'spec': {'containers': [{'name': 'dask-worker'}]},
+     'status': {'containerStatuses': [{'ready': True}]}},
+    {'metadata': {'name': 'dask-scheduler-b'},
+     'spec': {'containers': [{'name': 'dask-scheduler'}]},
+     'status': {'containerStatuses': [{'ready': False}]}},
+]}
+RC = {'metadata': {'name': 'dask-worker'}, 'spec': {'replicas': 8}}
+
+
+class StubAPI(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, self.client_address))
+        self.server.auth.append(self.headers.get('Authorization'))
+        if self.path.startswith('/api/v1/namespaces/default/pods'):
+            self.reply(PODS)
+        elif self.path == ('/api/v1/namespaces/default/replicationcontrollers'
+                           '/dask-worker'):
+            self.reply(RC)
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def do_PATCH(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(('PATCH', self.path, json.loads(
+            body.decode()), self.headers['Content-Type']))
+        self.reply({})
+
+
+@pytest.fixture
+def server():
+    httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubAPI)
+    httpd.requests = []
+    httpd.auth = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_queries_reuse_connection(server):
+    api = APIBackend('http://127.0.0.1:{}'.format(server.server_port))
+    live, dead = api.pods()
+    assert live == {'dask-worker': ['dask-worker-a']}
+    assert dead == {'dask-scheduler': ['dask-scheduler-b']}
+    assert api.replicas('dask-worker') == 8
+    method, path, client = server.requests[0]
+    assert path == '/api/v1/namespaces/default/pods?labelSelector=app%3Ddask'
+    # both requests went over the same kept-alive connection
+    assert server.requests[1][2] == client
+
+
+def test_scale(server):
+    api = APIBackend('http://127.0.0.1:{}'.format(server.server_port))
+    api.scale('dask-worker', 3)
+    method, path, body, ctype = server.requests[0]
+    assert method == 'PATCH'
+    assert path.endswith('/replicationcontrollers/dask-worker/scale')
+    assert body == {'spec': {'replicas': 3}}
+    assert ctype == 'application/merge-patch+json'
+
+
+def test_errors(server):
+    api = APIBackend('http://127.0.0.1:{}'.format(server.server_port))
+    with pytest.raises(RuntimeError):
+        api.get('services', 'nope')
+
+
+def test_fallback(tmpdir, monkeypatch):
+    monkeypatch.setenv('KUBECONFIG', str(tmpdir.join('missing')))
+    use('api')
+    try:
+        assert isinstance(get_backend('ctx'), KubectlBackend)
+    finally:
+        use('kubectl')
+
+
+# an exec credential plugin, counting its runs in the file given
+PLUGIN = """
+import sys
+with open(sys.argv[1], 'a') as f:
+    f.write('x')
+print('{"apiVersion": "client.authentication.k8s.io/v1beta1", '
+      '"kind": "ExecCredential", "status": {"token": "tok", '
+      '"expirationTimestamp": "%s"}}' % sys.argv[2])
+"""
+
+
+def exec_user(tmpdir, expiry):
+    return {'exec': {
+        'apiVersion': 'client.authentication.k8s.io/v1beta1',
+        'command': sys.executable,
+        'args': ['-c', PLUGIN, str(tmpdir.join('runs')), expiry]}}
+
+
+def test_token(tmpdir):
+    assert _token({'token': 'abc'}) == 'abc'
+    assert _token({'client-certificate-data': 'x'}) is None
+    with pytest.raises(ValueError):
+        _token({'username': 'me'})
+
+    # cached until shortly before it expires
+    token = _token(exec_user(tmpdir, '2999-01-01T00:00:00Z'))
+    assert token() == 'tok'
+    assert token() == 'tok'
+    assert tmpdir.join('runs').read() == 'x'
+    token = _token(exec_user(tmpdir, '2000-01-01T00:00:00Z'))
+    token()
+    token()
+    assert tmpdir.join('runs').read() == 'xxx'
+
+    failing = _token({'exec': {'command': str(tmpdir.join('nope'))}})
+    with pytest.raises(ValueError):
+        failing()
+
+
+def test_from_kubeconfig(server, tmpdir, monkeypatch):
+    config = {
+        'clusters': [{'name': 'c', 'cluster': {
+            'server': 'http://127.0.0.1:{}'.format(server.server_port)}}],
+        'users': [{'name': 'u',
+                   'user': exec_user(tmpdir, '2999-01-01T00:00:00Z')}],
+        'contexts': [{'name': 'ctx', 'context': {
+            'cluster': 'c', 'user': 'u', 'namespace': 'default'}}]}
+    fn = tmpdir.join('config')
+    fn.write(yaml.safe_dump(config))
+    monkeypatch.setenv('KUBECONFIG', str(fn))
+    api = APIBackend.from_kubeconfig('ctx')
+    assert api.replicas('dask-worker') == 8
+    assert api.replicas('dask-worker') == 8
+    assert server.auth == ['Bearer tok', 'Bearer tok']
+    assert tmpdir.join('runs').read() == 'x'
+    with pytest.raises(KeyError):
+        APIBackend.from_kubeconfig('other')
+
+    # a plugin which fails means kubectl is used instead
+    config['users'][0]['user'] = {'exec': {'command': str(tmpdir.join('no'))}}
+    fn.write(yaml.safe_dump(config))
+    use('api')
+    try:
+        assert isinstance(get_backend('ctx'), KubectlBackend)
+    finally:
+        use('kubectl')
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+import run as bench  # noqa: E402
+
+
+def test_benchmark_smoke():
+    doc = bench.run(workers=50, latency=0, repeat=1, only=['info-refresh'])
+    results = doc['results']
+    assert set(results) == {'create', 'info-refresh'}
+    # one snapshot of services, pods, rcs and nodes
+    assert results['info-refresh']['commands'] == 1
+    assert results['create']['peak_rss_mb'] > 0
+
+
+def test_compare():
+    base = {'meta': {'latency': 0.05},
+            'results': {'info': {'wall': 0.3, 'commands': 2,
+                                 'peak_rss_mb': 30}}}
+    doc = {'meta': {'latency': 0.05},
+           'results': {'info': {'wall': 0.9, 'commands': 2,
+                                'peak_rss_mb': 30}}}
+    text, regressed = bench.format_results(doc, base)
+    assert regressed == ['info']
+    assert '3.00x !' in text
+    text, regressed = bench.format_results(base, doc)
+    assert regressed == []
+
+
+def test_startup_budget():
+    doc = {'results': {'help': {'wall': 0.3}, 'info': {'wall': 2}}}
+    assert bench.over_budget(doc, 0.5) == []
+    assert bench.over_budget(doc, 0.2) == ['help']
@@ -0,0 +1,38 @@
+import os
+
+from dask_gke.cli import cache
+
+
+def test_cached(home):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return [1, 2]
+
+    assert cache.cached('c', 'services', fetch) == [1, 2]
+    assert cache.cached('c', 'services', fetch) == [1, 2]
+    assert len(calls) == 1
+    assert cache.cached('c', 'services', fetch, refresh=True) == [1, 2]
+    assert len(calls) == 2
+    assert cache.cached('c', 'services', fetch, ttl=-1) == [1, 2]
+    assert len(calls) == 3
+    assert cache.cached('other', 'services', fetch) == [1, 2]
+    assert len(calls) == 4
+
+
+def test_not_valid(home):
+    assert cache.cached('c', 'services', lambda: [None, 1], valid=all) == [
+        None, 1]
+    assert cache.lookup('c', 'services') is None
+
+
+def test_invalidate(home):
+    cache.store('c', 'pods', [{}, {}])
+    cache.store('c', 'nodes', 3)
+    cache.invalidate('c', 'pods')
+    assert cache.lookup('c', 'pods') is None
+    assert cache.lookup('c', 'nodes') == 3
+    cache.invalidate('c')
+    assert not os.path.exists(cache.cache_path('c'))
+    assert cache.lookup('c', 'nodes') is None
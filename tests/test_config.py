@@ -4,6 +4,7 @@ import os
 from dask_gke.cli.utils import get_conf, render_templates
 
 import pytest
+import yaml
 
 
 PKG = os.path.dirname(os.path.dirname(__file__))
@@ -11,7 +12,7 @@ PKG = os.path.dirname(os.path.dirname(__file__))
 
 @pytest.fixture
 def config():
-    return io.BytesIO(dedent(b"""\
+    return io.StringIO(dedent(u"""\
     cluster:
       num_nodes: 12
     """))
@@ -49,3 +50,176 @@ def test_render_templates():
     result = render_templates(config, '')
     # probably want to do some more verification here.
     assert len(result)
+
+
+def test_worker_pool_selector():
+    result = get_conf(None, None)
+    assert result['workers']['node_selector'] == {
+        'cloud.google.com/gke-nodepool': 'dask-workers'}
+    rendered = render_templates(result, 'par')[
+        os.path.join('par', 'dask_workers.yaml')]
+    assert 'cloud.google.com/gke-nodepool: "dask-workers"' in rendered
+    result = get_conf(None, ['cluster.main_pool.enabled=False'])
+    assert result['workers']['node_selector'] == {}
+
+
+def test_worker_processes():
+    result = get_conf(None, ['workers.processes=2',
+                             'workers.memory_per_worker=4096Mi',
+                             'workers.mem_factor=1'])
+    assert result['workers']['processes'] == 2
+    assert result['workers']['cpus_per_worker2'] == 1
+    assert result['workers']['memory_per_worker2'] == 2048 * 2 ** 20
+    assert result['workers']['guaranteed'] is False
+    result = get_conf(None, ['workers.threads_per_process=4',
+                             'workers.guaranteed=True'])
+    assert result['workers']['cpus_per_worker2'] == 4
+    rendered = render_templates(result, 'par')[
+        os.path.join('par', 'dask_workers.yaml')]
+    assert 'limits' in rendered
+    with pytest.raises(ValueError):
+        get_conf(None, ['workers.processes=0'])
+
+
+def test_spill_and_memory_thresholds():
+    result = get_conf(None, ['workers.memory_per_worker=4096Mi',
+                             'workers.mem_factor=1'])
+    assert result['workers']['memory_per_worker2'] == 4096 * 2 ** 20
+    env = result['workers']['env']
+    assert env['DASK_DISTRIBUTED__WORKER__MEMORY__SPILL'] == '0.7'
+    rendered = render_templates(result, 'par')[
+        os.path.join('par', 'dask_workers.yaml')]
+    assert '"--local-directory",\n                 "/spill"' in rendered
+    assert 'sizeLimit: 10Gi' in rendered
+    assert 'medium: Memory' not in rendered
+
+    # tmpfs comes out of the container's memory
+    result = get_conf(None, ['workers.memory_per_worker=4096Mi',
+                             'workers.mem_factor=1',
+                             'workers.spill.medium=memory',
+                             'workers.spill.size=1024Mi'])
+    assert result['workers']['memory_per_worker2'] == 3072 * 2 ** 20
+    rendered = render_templates(result, 'par')[
+        os.path.join('par', 'dask_workers.yaml')]
+    assert 'medium: Memory' in rendered
+
+    for bad in (['workers.memory_pause=0.5'],
+                ['workers.memory_terminate=1.5'],
+                ['workers.spill.medium=tape'],
+                ['workers.spill.size=100Gi', 'cluster.disk_size=50'],
+                ['workers.spill.medium=memory', 'workers.spill.size=8Gi'],
+                ['workers.spill.medium=ssd']):
+        with pytest.raises(ValueError):
+            get_conf(None, bad)
+    result = get_conf(None, ['workers.spill.medium=ssd',
+                             'workers.spill.size=100Gi',
+                             'cluster.local_ssd_count=1'])
+    assert result['workers']['spill']['medium'] == 'ssd'
+
+
+def test_pull_policy_and_prepull():
+    result = get_conf(None, ['scheduler.image_pull_policy=IfNotPresent'])
+    rendered = render_templates(result, 'par')
+    assert 'imagePullPolicy: IfNotPresent' in rendered[
+        os.path.join('par', 'dask_scheduler.yaml')]
+    # a tag may move, so is pulled again; a digest is not
+    assert 'imagePullPolicy: Always' in rendered[
+        os.path.join('par', 'dask_workers.yaml')]
+    result['workers']['image'] += '@sha256:' + '0' * 64
+    rendered = render_templates(result, 'par')
+    assert 'imagePullPolicy: IfNotPresent' in rendered[
+        os.path.join('par', 'dask_workers.yaml')]
+    result = get_conf(None, None)
+    rendered = render_templates(result, 'par')
+    prepull = rendered[os.path.join('par', 'dask_prepull.yaml')]
+    assert 'kind: DaemonSet' in prepull
+    assert 'image: mdurant/dask-kubernetes:latest' in prepull
+    assert 'cloud.google.com/gke-nodepool: "dask-workers"' in prepull
+    # switched off, the DaemonSet is not written at all
+    result = get_conf(None, ['workers.prepull=False'])
+    rendered = render_templates(result, 'par')
+    assert os.path.join('par', 'dask_prepull.yaml') not in rendered
+
+
+def test_probes():
+    rendered = render_templates(get_conf(None, None), 'par')
+    scheduler = yaml.safe_load(rendered[os.path.join(
+        'par', 'dask_scheduler.yaml')])['spec']['template']['spec']
+    probe = scheduler['containers'][0]['readinessProbe']
+    assert probe['tcpSocket'] == {'port': 'http'}
+    assert probe['timeoutSeconds'] == 5
+    workers = yaml.safe_load(rendered[os.path.join(
+        'par', 'dask_workers.yaml')])['spec']['template']['spec']
+    container = workers['containers'][0]
+    assert 'dask-scheduler' in container['readinessProbe']['exec'][
+        'command'][-1]
+    assert container['readinessProbe']['timeoutSeconds'] == 10
+    # workers are not restarted for the scheduler's failures
+    assert 'livenessProbe' not in container
+
+    conf = get_conf(None, ['workers.probes=False', 'scheduler.probes=False'])
+    rendered = render_templates(conf, 'par')
+    assert not any('Probe' in text for text in rendered.values())
+
+
+def test_worker_groups():
+    groups = dedent(u"""\
+    workers:
+      resources: {CPU: 2}
+      groups:
+        - name: highmem
+          count: 2
+          memory_per_worker: 24Gi
+          image: other/image:1
+          resources: {MEMORY: 1}
+          node_selector: {cloud.google.com/gke-nodepool: highmem}
+        - name: light
+          count: 6
+          cpus_per_worker: 1
+    """)
+    conf = get_conf(io.StringIO(groups), None)
+    highmem, light = conf['workers']['groups']
+    assert highmem['controller'] == 'dask-worker-highmem'
+    assert highmem['memory_per_worker2'] == int(0.95 * 24 * 2 ** 30)
+    assert highmem['cpus_per_worker'] == 1.8  # as the other workers
+    assert highmem['resources_arg'] == 'MEMORY=1'
+    assert highmem['node_selector'] == {
+        'cloud.google.com/gke-nodepool': 'highmem'}
+    assert light['resources'] == {}
+    assert light['image'] == conf['workers']['image']
+    assert light['node_selector'] == conf['workers']['node_selector']
+
+    rendered = render_templates(conf, 'par')
+    controllers = list(yaml.safe_load_all(
+        rendered[os.path.join('par', 'dask_workers.yaml')]))
+    assert [c['metadata']['name'] for c in controllers] == [
+        'dask-worker', 'dask-worker-highmem', 'dask-worker-light']
+    assert [c['spec']['replicas'] for c in controllers] == [8, 2, 6]
+    args = [c['spec']['template']['spec']['containers'][0]['args']
+            for c in controllers]
+    assert args[0][-2:] == ['--resources', 'CPU=2']
+    assert args[1][-2:] == ['--resources', 'MEMORY=1']
+    assert '--resources' not in args[2]
+    assert controllers[1]['spec']['template']['metadata']['labels'][
+        'name'] == 'dask-worker-highmem'
+    # the highmem pool gets its own pre-pulling DaemonSet
+    prepull = list(yaml.safe_load_all(
+        rendered[os.path.join('par', 'dask_prepull.yaml')]))
+    assert [d['metadata']['name'] for d in prepull] == [
+        'dask-prepull', 'dask-prepull-1']
+    specs = [d['spec']['template']['spec'] for d in prepull]
+    assert [c['image'] for c in specs[0]['initContainers']] == [
+        conf['workers']['image']]
+    assert [c['image'] for c in specs[1]['initContainers']] == [
+        'other/image:1']
+    assert specs[1]['nodeSelector'] == highmem['node_selector']
+
+    # from the command line too
+    conf = get_conf(None, ['workers.groups=[{name: big, count: 1}]'])
+    assert conf['workers']['groups'][0]['controller'] == 'dask-worker-big'
+
+    for bad in ('[{count: 1}]', '[{name: Big}]', '[{name: a}, {name: a}]',
+                '[{name: a, colour: red}]', '[{name: a, processes: 0}]',
+                '{name: a}'):
+        with pytest.raises(ValueError):
+            get_conf(None, ['workers.groups=' + bad])
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+import yaml
+
+from dask_gke.cli import fleet
+
+from conftest import FakeBackend, pod, rc, service
+
+
+@pytest.fixture
+def home(home):
+    par = home.join('.dask', 'kubernetes')
+    for name in ['alpha', 'beta', 'slow']:
+        par.join(name + '.yaml').write(yaml.dump(
+            {'context': 'gke_p_z_' + name, 'cluster': {}}))
+    par.mkdir('alpha')
+    return home
+
+
+OBJECTS = {
+    'services': [service('jupyter-notebook', [
+        ('jupyter-http', 80), ('jupyter-lab-http', 81)], '1.1.1.1'),
+        service('dask-scheduler', [('dask-scheduler-tcp', 8786),
+                                   ('dask-scheduler-bokeh', 8787)],
+                '2.2.2.2')],
+    'pods': [pod('a'), pod('b'), pod('s', 'dask-scheduler'),
+             pod('c', ready=False)],
+    'replicationcontrollers': [rc('dask-worker', 3)],
+    'nodes': [{'metadata': {'name': 'n%i' % i}} for i in range(3)],
+}
+
+
+class Backend(FakeBackend):
+    """Hangs for cluster slow, and fails for cluster beta"""
+    def __init__(self, context):
+        FakeBackend.__init__(self, OBJECTS, context)
+
+    def snapshot(self):
+        if self.context.endswith('slow'):
+            time.sleep(5)
+        if self.context.endswith('beta'):
+            raise RuntimeError('Unable to connect to the server')
+        return FakeBackend.snapshot(self)
+
+
+def test_fleet_status(home, monkeypatch):
+    monkeypatch.setattr(fleet, 'get_backend', Backend)
+    assert fleet.saved_clusters() == ['alpha', 'beta', 'slow']
+    start = time.time()
+    rows = fleet.fleet_status(timeout=1)
+    assert time.time() - start < 3
+    alpha, beta, slow = rows
+    assert alpha['scheduler'] == '2.2.2.2:8786'
+    assert alpha['nodes'] == 3 and alpha['workers'] == 3
+    assert alpha['live'] == {'dask-worker': 2, 'dask-scheduler': 1}
+    assert beta['error'] == 'Unable to connect to the server'
+    assert slow['error'] == 'timed out'
+
+    table = fleet.format_table(rows).split('\n')
+    assert table[0].startswith('CLUSTER')
+    assert '2/3' in table[1] and '3/1' in table[1]
+    assert 'timed out' in table[3]
+
+
+def test_timeout_per_cluster(home, monkeypatch):
+    # with both threads taken by hanging clusters, the third is still
+    # queried once they time out, and has its own time limit
+    class Hanging(FakeBackend):
+        def __init__(self, context):
+            FakeBackend.__init__(self, OBJECTS, context)
+
+        def snapshot(self):
+            if not self.context.endswith('beta'):
+                time.sleep(3)
+            return FakeBackend.snapshot(self)
+    monkeypatch.setattr(fleet, 'get_backend', Hanging)
+    start = time.time()
+    alpha, slow, beta = fleet.fleet_status(['alpha', 'slow', 'beta'],
+                                           max_workers=2, timeout=1)
+    assert time.time() - start < 2.5
+    assert alpha['error'] == slow['error'] == 'timed out'
+    assert beta['error'] is None
+    assert beta['workers'] == 3
+    assert fleet.fleet_status([]) == []
@@ -0,0 +1,87 @@
+import json
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer
+
+from dask_gke.cli import images
+from dask_gke.cli.images import pin_images, resolve_digest, split_image
+from dask_gke.cli.utils import get_conf
+
+DIGEST = 'sha256:' + 'ab' * 32
+
+
+class StubRegistry(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        port = self.server.server_port
+        if self.path.startswith('/token'):
+            data = json.dumps({'token': 'secret'}).encode()
+            self.send_response(200)
+        elif self.headers.get('Authorization') != 'Bearer secret':
+            data = b''
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', (
+                'Bearer realm="http://127.0.0.1:{}/token",'
+                'service="stub"'.format(port)))
+        elif self.path == '/v2/dask/worker/manifests/1.0':
+            data = b'{}'
+            self.send_response(200)
+            self.send_header('Docker-Content-Digest', DIGEST)
+        else:
+            data = b''
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def registry():
+    httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubRegistry)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield '127.0.0.1:{}'.format(httpd.server_port), httpd.requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_split_image():
+    assert split_image('ubuntu') == (images.DOCKER_HUB, 'library/ubuntu',
+                                     'latest')
+    assert split_image('mdurant/dask-kubernetes:latest') == (
+        images.DOCKER_HUB, 'mdurant/dask-kubernetes', 'latest')
+    assert split_image('gcr.io/proj/img:v1') == ('gcr.io', 'proj/img', 'v1')
+    assert split_image('localhost:5000/img') == ('localhost:5000', 'img',
+                                                 'latest')
+
+
+def test_resolve_digest(registry):
+    host, requests = registry
+    assert resolve_digest(host + '/dask/worker:1.0') == DIGEST
+    assert requests[1].startswith('/token?')
+    assert 'scope=repository%3Adask%2Fworker%3Apull' in requests[1]
+    with pytest.raises(RuntimeError):
+        resolve_digest(host + '/dask/worker:missing')
+
+
+def test_pin_images(registry):
+    host, requests = registry
+    conf = get_conf(None, ['workers.image={}/dask/worker:1.0'.format(host),
+                           'scheduler.image={}/dask/worker:1.0'.format(host),
+                           'jupyter.image={}/other:1.0'.format(host)])
+    pin_images(conf)
+    pinned = '{}/dask/worker:1.0@{}'.format(host, DIGEST)
+    assert conf['workers']['image'] == pinned
+    assert conf['scheduler']['image'] == pinned
+    # unresolvable images are left as they were
+    assert conf['jupyter']['image'] == host + '/other:1.0'
+    # each image is looked up once
+    manifests = [r for r in requests if '/dask/worker/manifests/' in r]
+    assert len(manifests) == 2  # challenged, then authorized
@@ -0,0 +1,122 @@
+import os
+
+from click.testing import CliRunner
+import pytest
+import yaml
+
+from dask_gke.cli import main, manifests, planner
+from dask_gke.cli.main import cli
+from dask_gke.cli.utils import (get_conf, makedirs, pardir, render_templates,
+                                write_templates)
+
+
+@pytest.fixture
+def cluster(home, fakecli):
+    """Saved cluster "c", with its manifests recorded as applied"""
+    conf = get_conf(None, None)
+    conf['context'] = 'ctx'
+    conf['cluster']['num_nodes'] = planner.num_nodes(conf)
+    par = pardir('c')
+    configs = render_templates(conf, par)
+    makedirs(par, exist_ok=True)
+    write_templates(configs)
+    manifests.save_applied('c', configs)
+    return home
+
+
+def test_diff():
+    conf = get_conf(None, None)
+    old = render_templates(conf, 'par')
+    applied = {k: h for k, (h, fn) in manifests.objects(old).items()}
+    assert 'ReplicationController/dask-worker' in applied
+    assert 'Service/jupyter-notebook' in applied
+    assert manifests.diff(applied, old) == ([], [], [], [])
+    # formatting changes do not count
+    reformatted = {fn: text.replace('\n', '\n\n') for fn, text in old.items()}
+    assert manifests.diff(applied, reformatted) == ([], [], [], [])
+
+    conf = get_conf(None, ['workers.count=4', 'workers.prepull=False'])
+    changes = manifests.diff(applied, render_templates(conf, 'par'))
+    assert changes.changed == ['ReplicationController/dask-worker']
+    assert changes.removed == ['DaemonSet/dask-prepull']
+    assert changes.files == [os.path.join('par', 'dask_workers.yaml')]
+    text = manifests.format_changes(changes, (3, 2))
+    assert text.splitlines() == ['~ ReplicationController/dask-worker',
+                                 '- DaemonSet/dask-prepull',
+                                 '~ nodes: 3 -> 2']
+
+    # with no record, everything is applied
+    assert len(manifests.diff(None, old).files) == len(old) - 1
+
+
+def test_rerender_unchanged(cluster, fakecli):
+    result = CliRunner().invoke(cli, ['rerender', 'c'])
+    assert result.exit_code == 0, result.output
+    assert 'No changes' in result.output
+    assert not any(c.startswith('kubectl --context')
+                   for c in fakecli.commands())
+
+
+def test_rerender_applies_changes(cluster, fakecli):
+    settings = cluster.join('settings.yaml')
+    settings.write("cluster: {num_nodes: 5}\n"
+                   "workers: {count: 10, prepull: False}\n")
+    result = CliRunner().invoke(cli, ['rerender', 'c', str(settings),
+                                      '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert '~ nodes: 3 -> 5' in result.output
+    assert not any(c.startswith(('kubectl --context', 'gcloud container'))
+                   for c in fakecli.commands())
+
+    result = CliRunner().invoke(cli, ['rerender', 'c', str(settings)])
+    assert result.exit_code == 0, result.output
+    ran = fakecli.commands()
+    par = pardir('c')
+    assert ('kubectl --context ctx apply -f ' +
+            os.path.join(par, 'dask_workers.yaml')) in ran
+    assert 'kubectl --context ctx delete daemonset/dask-prepull' in ran
+    assert any(c.startswith('gcloud container clusters resize c') and
+               '--size 5' in c for c in ran)
+    assert not os.path.exists(os.path.join(par, 'dask_prepull.yaml'))
+
+    # applied state was recorded, so a second push does nothing
+    result = CliRunner().invoke(cli, ['rerender', 'c', str(settings)])
+    assert 'No changes' in result.output
+
+
+def test_failed_apply_is_retried(cluster, fakecli):
+    settings = cluster.join('settings.yaml')
+    settings.write("cluster: {num_nodes: 5}\nworkers: {count: 10}\n")
+    failing = fakecli.answer('^(gcloud|kubectl)', exit=1)
+    result = CliRunner().invoke(cli, ['rerender', 'c', str(settings)])
+    assert result.exit_code != 0
+    assert 'Commands failed' in str(result.exception)
+    assert yaml.safe_load(
+        cluster.join('.dask', 'kubernetes', 'c.yaml').read())['cluster'][
+            'num_nodes'] == 3
+
+    # nothing was recorded as applied, so it is all tried again
+    fakecli.rules.remove(failing)
+    fakecli.save()
+    result = CliRunner().invoke(cli, ['rerender', 'c', str(settings)])
+    assert result.exit_code == 0, result.output
+    assert '~ ReplicationController/dask-worker' in result.output
+    assert '~ nodes: 3 -> 5' in result.output
+
+
+def test_failed_create_is_not_recorded(home, fakecli):
+    fakecli.answer('^kubectl config get-contexts', 'gke_p_z_new\n')
+    failing = fakecli.answer('^kubectl create', exit=1)
+    result = CliRunner().invoke(cli, ['create', 'new', '--nowait', '-s',
+                                      'cluster.pin_images=False'])
+    assert result.exit_code != 0
+    assert main.update_config.name + ' new' in str(result.exception)
+    assert manifests.load_applied('new') is None
+
+    # so everything is applied again
+    fakecli.rules.remove(failing)
+    fakecli.save()
+    result = CliRunner().invoke(cli, [main.update_config.name, 'new'])
+    assert result.exit_code == 0, result.output
+    assert '~ ReplicationController/dask-worker' in result.output
+    assert manifests.load_applied('new') is not None
@@ -0,0 +1,72 @@
+import pytest
+
+from dask_gke.cli.planner import (allocatable, capacity, group_nodes,
+                                  machine_shape, num_nodes, plan)
+from dask_gke.cli.utils import get_conf
+
+
+def test_machine_shape():
+    assert machine_shape('n1-standard-4') == (4, 15 * 2 ** 30)
+    assert machine_shape('custom-6-20480') == (6, 20 * 2 ** 30)
+    with pytest.raises(ValueError):
+        machine_shape('n9-imaginary-3')
+
+
+def test_allocatable():
+    cpu, mem = allocatable(*machine_shape('n1-standard-8'))
+    assert 7.5 < cpu < 8
+    assert 25 * 2 ** 30 < mem < 28 * 2 ** 30
+
+
+def test_plan_separate_pools():
+    conf = get_conf(None)
+    p = plan(conf)
+    assert p.main_pool == 'n1-standard-4'
+    assert p.workers_on_main == 0
+    assert p.nodes == -(-8 // p.workers_per_node)
+    assert plan(conf, 0).nodes == 0
+    assert capacity(conf, 2) == 2 * p.workers_per_node
+    conf = get_conf(None, ['cluster.main_pool.machine_type=n1-standard-1'])
+    with pytest.raises(ValueError):
+        plan(conf)
+
+
+def test_plan_shared_pool():
+    conf = get_conf(None, ['cluster.main_pool.enabled=False'])
+    p = plan(conf)
+    assert p.main_pool is None
+    assert p.workers == 8
+    # scheduler and jupyter displace workers on the first node
+    assert p.workers_on_main < p.workers_per_node
+    assert p.nodes == 1 + -(-(8 - p.workers_on_main) // p.workers_per_node)
+    assert p.wasted_cpu >= 0 and p.wasted_memory >= 0
+    assert plan(conf, p.workers_on_main).nodes == 1
+    assert plan(conf, p.workers_on_main + 1).nodes == 2
+
+
+def test_plan_too_big():
+    conf = get_conf(None, ['workers.memory_per_worker=64Gi'])
+    with pytest.raises(ValueError):
+        plan(conf)
+
+
+def test_num_nodes_auto():
+    conf = get_conf(None, ['cluster.num_nodes=auto', 'workers.count=30'])
+    assert num_nodes(conf) == plan(conf).nodes
+    conf = get_conf(None, ['cluster.num_nodes=2'])
+    assert num_nodes(conf) == 2
+
+
+def test_group_nodes():
+    # n1-standard-8 nodes hold one 24Gi worker each; the group on a pool
+    # of its own needs none of them
+    conf = get_conf(None, [
+        'cluster.num_nodes=auto', 'workers.count=4',
+        'workers.groups=[{name: big, count: 3, memory_per_worker: 24Gi}, '
+        '{name: gpu, count: 5, node_selector: {pool: gpu}}]'])
+    assert group_nodes(conf) == 3
+    assert num_nodes(conf) == plan(conf).nodes + 3
+    conf = get_conf(None, ['workers.groups=[{name: huge, count: 1, '
+                           'memory_per_worker: 64Gi}]'])
+    with pytest.raises(ValueError):
+        group_nodes(conf)
@@ -0,0 +1,126 @@
+import os
+import socket
+import stat
+import sys
+import time
+from textwrap import dedent
+
+import pytest
+
+from dask_gke.cli import main, portforward
+from dask_gke.cli.portforward import PortForward, Tunnel, wait_for_port
+from dask_gke.cli.utils import (get_conf, parse_services, render_templates,
+                                save_config)
+
+
+@pytest.fixture
+def kubectl(tmpdir):
+    """Fake kubectl port-forward, logging its arguments; the first run
+    prints a lot and fails at once, later ones stay up"""
+    script = tmpdir.join('kubectl')
+    script.write(dedent("""\
+        #!{python}
+        import os, sys, time
+        log = {log!r}
+        first = not os.path.exists(log)
+        with open(log, 'a') as f:
+            f.write(' '.join(sys.argv[1:]) + '\\n')
+        if first:
+            for i in range(100):
+                print('Handling connection for %i' % i)
+            sys.stdout.flush()
+            sys.exit('error: lost connection to pod')
+        time.sleep(60)
+        """.format(python=sys.executable, log=str(tmpdir.join('log')))))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    return str(script), tmpdir.join('log')
+
+
+def test_restarts(kubectl, caplog):
+    script, log = kubectl
+    forward = PortForward('ctx', 'dask-scheduler', [8786, 8787],
+                          kubectl=script, backoff=0.1).start()
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline and forward.restarts < 1:
+            time.sleep(0.05)
+        time.sleep(0.5)
+    finally:
+        forward.stop()
+    assert forward.restarts == 1
+    # only the last lines of output are kept for the warning
+    warning, = [r.getMessage() for r in caplog.records
+                if r.levelname == 'WARNING']
+    assert 'lost connection to pod' in warning
+    assert 'connection for 99' in warning
+    assert 'connection for 0\n' not in warning
+    lines = log.read().splitlines()
+    assert len(lines) == 2
+    assert lines[0] == ('--context ctx port-forward service/dask-scheduler '
+                        '8786:8786 8787:8787')
+    # stopped, the forward is not restarted
+    time.sleep(0.3)
+    assert len(log.read().splitlines()) == 2
+
+
+def test_tunnel_ports():
+    conf = get_conf(None, ['cluster.access=tunnel'])
+    tunnel = Tunnel(conf, 'ctx')
+    assert tunnel.ports() == [8786, 9786, 8787, 8888, 8889]
+
+
+def test_tunnel_services():
+    conf = get_conf(None, ['cluster.access=tunnel'])
+    rendered = render_templates(conf, 'par')[
+        os.path.join('par', 'dask_external.yaml')]
+    assert 'type: ClusterIP' in rendered
+    assert 'LoadBalancer' not in rendered
+    services = [{'spec': {'type': 'ClusterIP',
+                          'selector': {'name': 'dask-scheduler'},
+                          'ports': [{'name': 'dask-scheduler-tcp',
+                                     'port': 8786}]}}]
+    assert parse_services(services)[3:5] == ('localhost', 8786)
+    with pytest.raises(ValueError):
+        get_conf(None, ['cluster.access=vpn'])
+
+
+def test_wait_for_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    assert not wait_for_port(port, '127.0.0.1', timeout=0.3)
+    sock.listen(1)
+    try:
+        assert wait_for_port(port, '127.0.0.1', timeout=2)
+    finally:
+        sock.close()
+
+
+class FakeTunnel(object):
+    events = []
+
+    def __init__(self, conf, context):
+        self.events.append(('new', context))
+
+    def __enter__(self):
+        self.events.append('start')
+        return self
+
+    def __exit__(self, *args):
+        self.events.append('stop')
+
+
+def test_scheduler_client_tunnel(home, monkeypatch):
+    monkeypatch.setattr(portforward, 'Tunnel', FakeTunnel)
+    monkeypatch.setattr(portforward, 'wait_for_port', lambda port: True)
+    monkeypatch.setattr(main, 'cluster_services', lambda cluster, context: (
+        'localhost', 8888, 8889, 'localhost', 8786, 8787))
+    for access, events in [('loadbalancer', []),
+                           ('tunnel', [('new', 'ctx'), 'start', 'stop'])]:
+        conf = get_conf(None, ['cluster.access=' + access])
+        conf['context'] = 'ctx'
+        save_config('c', conf)
+        del FakeTunnel.events[:]
+        with main.scheduler_client('c', conf) as client:
+            assert client.host == 'localhost'
+        assert FakeTunnel.events == events
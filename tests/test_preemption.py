@@ -0,0 +1,110 @@
+from dask_gke.cli.preemption import Supervisor, node_doomed
+from dask_gke.cli.scheduler import Load
+
+from conftest import FakeBackend
+
+
+def pod(name, node, ip, ready=True, **status):
+    status.update({'podIP': ip, 'containerStatuses': [{'ready': ready}]})
+    return {'metadata': {'name': name},
+            'spec': {'nodeName': node,
+                     'containers': [{'name': 'dask-worker'}]},
+            'status': status}
+
+
+def node(name, taints=(), unschedulable=False):
+    return {'metadata': {'name': name},
+            'spec': {'taints': [{'key': k} for k in taints],
+                     'unschedulable': unschedulable},
+            'status': {'conditions': [{'type': 'Ready', 'status': 'True'}]}}
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.retired = []
+
+    def load(self):
+        workers = {'tcp://10.0.0.%i:4000' % i: {} for i in (1, 2, 3)}
+        return Load(workers, 0, [])
+
+    def retire_workers(self, addresses):
+        self.retired.append(addresses)
+        return True
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+STEADY = [
+    ('nodes', node('node-a')),
+    ('nodes', node('node-b')),
+    ('pods', pod('dask-worker-1', 'node-a', '10.0.0.1')),
+    ('pods', pod('dask-worker-2', 'node-a', '10.0.0.2')),
+    ('pods', pod('dask-worker-3', 'node-b', '10.0.0.3')),
+]
+PREEMPTED = ('nodes', node(
+    'node-a', taints=['cloud.google.com/impending-node-termination']))
+
+
+def replacements(name='dask-worker-1'):
+    gone = dict(pod(name, 'node-a', '10.0.0.1'))
+    gone['metadata'] = {'name': name, 'deletionTimestamp': 'now'}
+    return [('pods', gone),
+            ('pods', {'type': 'DELETED',
+                      'object': pod('dask-worker-2', 'node-a', '10.0.0.2')}),
+            ('pods', pod('dask-worker-4', 'node-b', '10.0.0.4',
+                         ready=False)),
+            ('pods', pod('dask-worker-4', 'node-b', '10.0.0.4')),
+            ('pods', pod('dask-worker-5', 'node-b', '10.0.0.5'))]
+
+
+def test_node_doomed():
+    assert node_doomed('MODIFIED', node('a')) is None
+    assert node_doomed('DELETED', node('a')) == 'deleted'
+    assert node_doomed('MODIFIED', node('a', unschedulable=True))
+    assert node_doomed('MODIFIED', PREEMPTED[1])
+    down = node('a')
+    down['status']['conditions'][0]['status'] = 'Unknown'
+    assert node_doomed('MODIFIED', down) == 'not ready'
+
+
+def test_retire_and_replace():
+    client, kube = FakeClient(), FakeBackend()
+    supervisor = Supervisor(client, kube, clock=Clock())
+    supervisor.run(STEADY)
+    assert supervisor.workers() == 3
+
+    supervisor.run([PREEMPTED, PREEMPTED])
+    # only the workers on the doomed node, and only once
+    assert client.retired == [['tcp://10.0.0.1:4000', 'tcp://10.0.0.2:4000']]
+    assert kube.deleted == [('pods', 'dask-worker-1'),
+                            ('pods', 'dask-worker-2')]
+    assert not supervisor.recoveries
+
+    events = replacements()
+    supervisor.run(events[:-1])
+    assert supervisor.workers() == 2
+    assert not supervisor.recoveries
+    supervisor.run(events[-1:])
+    [rec] = supervisor.recoveries
+    assert rec.node == 'node-a'
+    assert rec.pods == ['dask-worker-1', 'dask-worker-2']
+    assert rec.notice < rec.retired_at < rec.recovered_at
+    assert not supervisor.pending
+
+
+def test_pod_notice_without_replace():
+    client, kube = FakeClient(), FakeBackend()
+    supervisor = Supervisor(client, kube, replace=False, clock=Clock())
+    supervisor.run(STEADY)
+    supervisor.run([('pods', pod('dask-worker-3', 'node-b', '10.0.0.3',
+                                 reason='NodeShutdown'))])
+    assert client.retired == [['tcp://10.0.0.3:4000']]
+    assert kube.deleted == []
+    assert supervisor.pending
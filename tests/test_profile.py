@@ -0,0 +1,36 @@
+import json
+
+from dask_gke.cli import profile
+from dask_gke.cli.utils import call, check_output, spawn
+
+
+def test_commands_recorded(tmpdir):
+    profile.clear()
+    with profile.span('phase'):
+        call('exit 2')
+        assert check_output('echo hello') == 'hello\n'
+    names = [r['name'] for r in profile.records]
+    assert names == ['exit 2', 'echo hello', 'phase']
+    assert profile.records[0]['args']['exit_code'] == 2
+    assert profile.records[1]['args']['output_bytes'] == 6
+
+    table = profile.summary()
+    assert 'echo hello' in table and 'phase' in table
+
+    fn = str(tmpdir.join('trace.json'))
+    profile.write_trace(fn)
+    with open(fn) as f:
+        events = json.load(f)['traceEvents']
+    assert [e['name'] for e in events] == names
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+
+
+def test_spawned_recorded_when_waited():
+    profile.clear()
+    proc = spawn('exit 3')
+    assert profile.records == []
+    assert proc.wait() == 3
+    assert proc.wait() == 3
+    assert [r['name'] for r in profile.records] == ['exit 3']
+    assert profile.records[0]['cat'] == 'command'
+    assert profile.records[0]['args']['exit_code'] == 3
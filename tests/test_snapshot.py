@@ -0,0 +1,84 @@
+from dask_gke.cli import cache
+from dask_gke.cli.snapshot import Snapshot, cluster_state
+from dask_gke.cli.utils import get_conf
+
+from conftest import FakeBackend
+
+
+def node(name, pool):
+    return {'metadata': {'name': name, 'labels': {
+        'cloud.google.com/gke-nodepool': pool, 'app': 'dask'}}}
+
+
+OBJECTS = {
+    'services': [{'spec': {'selector': {'name': 'dask-scheduler'},
+                           'ports': [{'name': 'dask-scheduler-tcp',
+                                      'port': 8786}]},
+                  'status': {'loadBalancer': {
+                      'ingress': [{'ip': '1.2.3.4'}]}}}],
+    'pods': [{'metadata': {'name': 'w%i' % i},
+              'spec': {'containers': [{'name': 'dask-worker'}]},
+              'status': {'containerStatuses': [{'ready': i < 3}]}}
+             for i in range(4)],
+    'replicationcontrollers': [{'metadata': {'name': 'dask-worker'},
+                                'spec': {'replicas': 4}}],
+    'nodes': [node('m', 'default-pool'), node('a', 'dask-workers'),
+              node('b', 'dask-workers')],
+}
+
+
+def test_snapshot():
+    snap = Snapshot(OBJECTS)
+    assert snap.services[3:5] == ('1.2.3.4', 8786)
+    live, dead = snap.pods
+    assert live == {'dask-worker': ['w0', 'w1', 'w2']}
+    assert dead == {'dask-worker': ['w3']}
+    assert snap.replicas == {'dask-worker': 4}
+    assert snap.worker_nodes('dask-workers') == 2
+    assert snap.worker_nodes() == 3
+    assert Snapshot({}).worker_nodes() is None
+
+
+def test_cluster_state_cached(home):
+    conf = get_conf(None, None)
+    kube = FakeBackend(OBJECTS)
+    state = cluster_state('c', conf, kube, ('nodes', 'replicas'))
+    assert (state['nodes'], state['replicas']) == (2, 4)
+    # everything came with that one query, incomplete services apart
+    state = cluster_state('c', conf, kube, ('pods', 'nodes'))
+    assert state['pods'][0] == {'dask-worker': ['w0', 'w1', 'w2']}
+    assert kube.snapshots == 1
+    assert cache.lookup('c', 'services') is None
+    cluster_state('c', conf, kube, ('services', ))
+    assert kube.snapshots == 2
+    cluster_state('c', conf, kube, ('pods', ), refresh=True)
+    assert kube.snapshots == 3
+    assert kube.listed == []
+
+
+def test_unlabelled_nodes(home):
+    conf = get_conf(None, None)
+    # worker nodes made without the app=dask label, as by GKE itself
+    kube = FakeBackend(dict(OBJECTS, nodes=[
+        {'metadata': {'name': n, 'labels': {
+            'cloud.google.com/gke-nodepool': 'dask-workers'}}}
+        for n in 'ab']))
+    assert cluster_state('c', conf, kube, ('nodes', ))['nodes'] == 2
+    assert kube.listed == [('nodes', 'cloud.google.com/gke-nodepool='
+                                     'dask-workers')]
+
+
+def test_worker_groups():
+    pods = [{'metadata': {'name': 'w%i' % i, 'labels': {'name': rc}},
+             'spec': {'containers': [{'name': 'dask-worker'}]},
+             'status': {'containerStatuses': [{'ready': ready}]}}
+            for i, (rc, ready) in enumerate([
+                ('dask-worker', True), ('dask-worker-big', True),
+                ('dask-worker-big', False)])]
+    rcs = [{'metadata': {'name': name}, 'spec': {'replicas': n}}
+           for name, n in [('dask-worker', 1), ('dask-worker-big', 3),
+                           ('other', 1)]]
+    snap = Snapshot({'pods': pods, 'replicationcontrollers': rcs})
+    assert snap.groups == {'dask-worker': [1, 1, 0],
+                           'dask-worker-big': [3, 1, 1]}
+    assert snap.values()['replicas'] == 1
@@ -0,0 +1,110 @@
+import json
+import time
+
+from click.testing import CliRunner
+
+from dask_gke.cli import startup, utils
+from dask_gke.cli.main import cli
+
+T0 = 1500000000
+
+
+def stamp(seconds):
+    whole = int(seconds)
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(T0 + whole))
+    if seconds != whole:
+        text += '.{:06d}'.format(int(round((seconds - whole) * 1e6)))
+    return text + 'Z'
+
+
+def pod(name, node, created, scheduled, ready, container='dask-worker'):
+    return {'metadata': {'name': name, 'creationTimestamp': stamp(created)},
+            'spec': {'nodeName': node, 'containers': [{'name': container}]},
+            'status': {'conditions': [
+                {'type': 'PodScheduled', 'status': 'True',
+                 'lastTransitionTime': stamp(scheduled)},
+                {'type': 'Ready', 'status': 'True',
+                 'lastTransitionTime': stamp(ready)}]}}
+
+
+def event(pod, reason, at):
+    return {'involvedObject': {'kind': 'Pod', 'name': pod},
+            'reason': reason, 'firstTimestamp': stamp(at)}
+
+
+def node(name, created, ready):
+    return {'metadata': {'name': name, 'creationTimestamp': stamp(created)},
+            'status': {'conditions': [{'type': 'Ready', 'status': 'True',
+                                       'lastTransitionTime': stamp(ready)}]}}
+
+
+def cluster(pull=(2, 2, 30, 30)):
+    """Workers w0, w1 on node a; w2, w3 on node b, added by the autoscaler
+    after they were created"""
+    nodes = [node('a', -100, -90), node('b', 5, 40)]
+    pods, events = [], []
+    for i, seconds in enumerate(pull):
+        name = 'w%i' % i
+        scheduled = 1 if i < 2 else 41
+        pulled = scheduled + 1 + seconds
+        pods.append(pod(name, 'a' if i < 2 else 'b', 0, scheduled,
+                        pulled + 3))
+        events += [event(name, 'Started', pulled + 2),
+                   event(name, 'Created', pulled + 1),
+                   event(name, 'Pulled', pulled),
+                   event(name, 'Pulling', scheduled + 1)]
+    pods.append(pod('s', 'a', 0, 1, 2, container='dask-scheduler'))
+    return {'pods': pods, 'nodes': nodes, 'events': events}
+
+
+def test_parse_time():
+    assert startup.parse_time(stamp(0)) == T0
+    assert abs(startup.parse_time(stamp(1.25)) - T0 - 1.25) < 1e-6
+    assert startup.parse_time(None) is None
+
+
+def test_report():
+    lines = startup.timelines(cluster())
+    assert sorted(lines) == ['w0', 'w1', 'w2', 'w3']
+    assert lines['w2']['node_ready'] - lines['w2']['created'] == 40
+    assert 'node_ready' not in lines['w0']
+    stats, slow, pods = startup.report(cluster())
+    assert pods == 4
+    assert stats['pull'] == startup.Stats(4, 2, 30, 30)
+    assert stats['node'].count == 2
+    assert stats['total'].max == 41 + 1 + 30 + 3
+    assert stats['start'].p50 == 1
+    # w2 and w3 waited for node b, which was also slow to pull
+    assert slow == [('schedule', 'b', 41, 1, 2), ('pull', 'b', 30, 2, 2)]
+
+    # an image already on the node takes no time to pull
+    data = cluster(pull=(2, 2, 2, 2))
+    data['events'] = [e for e in data['events']
+                      if not (e['reason'] == 'Pulling' and
+                              e['involvedObject']['name'] == 'w0')]
+    assert startup.durations(startup.timelines(data))['pull']['w0'] == 0
+
+
+def test_startup_report_command(tmpdir):
+    before, after = tmpdir.join('before.json'), tmpdir.join('after.json')
+    before.write(json.dumps(cluster()))
+    after.write(json.dumps(cluster(pull=(2, 2, 2, 2))))
+    result = CliRunner().invoke(cli, ['startup-report', '--load', str(after),
+                                      '--compare', str(before)])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0] == 'Start-up of 4 worker pods'
+    assert 'P50 BEFORE' in lines[1]
+    pull = [line for line in lines if line.startswith('pull')][0]
+    assert pull.split() == ['pull', '4', '2.0', '2.0', '2.0', '2.0']
+    assert not any(line.startswith('slow pull') for line in lines)
+
+    result = CliRunner().invoke(cli, ['startup-report'])
+    assert result.exit_code != 0
+
+
+def test_startup_report_needs_kubectl(monkeypatch):
+    monkeypatch.setattr(utils, '_executables', {'kubectl': None})
+    result = CliRunner().invoke(cli, ['startup-report', 'c'])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, SystemExit)
@@ -0,0 +1,124 @@
+from click.testing import CliRunner
+import pytest
+
+from dask_gke.cli import planner
+from dask_gke.cli.main import cli, format_groups
+from dask_gke.cli.scheduler import SchedulerClient
+from dask_gke.cli.utils import get_conf, load_config, save_config
+
+NODES = {'items': [{'kind': 'Node', 'metadata': {
+    'name': 'n%i' % i,
+    'labels': {'cloud.google.com/gke-nodepool': 'dask-workers'}}}
+    for i in range(3)]}
+DESCRIBE = {'nodePools': [{'name': 'default-pool'},
+                          {'name': 'dask-workers'}]}
+
+
+@pytest.fixture
+def cluster(home, fakecli):
+    """Saved cluster "c" with 5 workers on 3 nodes"""
+    fakecli.answer('^gcloud .*describe', DESCRIBE)
+    fakecli.answer('^kubectl .*,nodes ', NODES)
+    fakecli.answer('^kubectl .*get replicationcontrollers',
+                   {'spec': {'replicas': 5}})
+    conf = get_conf(None, None)
+    conf['context'] = 'ctx'
+    conf['cluster']['num_nodes'] = planner.num_nodes(conf)
+    save_config('c', conf)
+    return home
+
+
+def commands(fakecli):
+    return [line for line in fakecli.commands()
+            if ' get ' not in line and 'describe' not in line]
+
+
+def test_suspend_resume(cluster, fakecli):
+    result = CliRunner().invoke(cli, ['suspend', 'c'])
+    assert result.exit_code == 0, result.output
+    assert load_config('c')['suspended'] == {'workers': 5, 'nodes': 3}
+    assert commands(fakecli) == [
+        'kubectl --context ctx scale rc dask-worker --replicas 0',
+        'gcloud container clusters resize c --node-pool dask-workers '
+        '--size 0 --async --quiet']
+
+    # suspending twice would lose the sizes
+    result = CliRunner().invoke(cli, ['suspend', 'c'])
+    assert result.exit_code != 0
+    assert 'already suspended' in str(result.exception)
+
+    fakecli.log.write('')
+    result = CliRunner().invoke(cli, ['resume', 'c', '--nowait'])
+    assert result.exit_code == 0, result.output
+    assert 'suspended' not in load_config('c')
+    assert commands(fakecli) == [
+        'gcloud container clusters resize c --node-pool dask-workers '
+        '--size 3 --async --quiet',
+        'kubectl --context ctx scale rc dask-worker --replicas 5']
+
+    result = CliRunner().invoke(cli, ['resume', 'c', '--nowait'])
+    assert 'not suspended' in str(result.exception)
+
+
+class Scheduler(SchedulerClient):
+    def __init__(self, counts):
+        SchedulerClient.__init__(self, 'host')
+        self.counts = counts
+
+    def n_workers(self):
+        count = self.counts.pop(0)
+        if count is None:
+            raise IOError('connection refused')
+        return count
+
+
+def test_wait_for_workers():
+    client = Scheduler([None, 1, 3, 5])
+    assert client.wait_for_workers(4, timeout=5, interval=0) == 5
+    with pytest.raises(RuntimeError) as e:
+        Scheduler([0] * 100).wait_for_workers(2, timeout=0.05,
+                                              interval=0.01)
+    assert '0 of 2 workers' in str(e.value)
+
+
+def test_worker_groups(cluster, fakecli):
+    conf = get_conf(None, ['workers.groups=[{name: big, count: 2}]'])
+    conf['context'] = 'ctx'
+    save_config('c', conf)
+    result = CliRunner().invoke(cli, ['resize', 'pods', 'c', '3', '-g',
+                                      'big'])
+    assert result.exit_code == 0, result.output
+    result = CliRunner().invoke(cli, ['resize', 'pods', 'c', '3', '-g',
+                                      'small'])
+    assert 'no worker group small' in str(result.exception)
+
+    result = CliRunner().invoke(cli, ['suspend', 'c'])
+    assert result.exit_code == 0, result.output
+    assert 'Suspended 10 workers' in result.output
+    assert load_config('c')['suspended']['groups'] == {
+        'dask-worker-big': 5}
+    result = CliRunner().invoke(cli, ['resume', 'c', '--nowait'])
+    assert result.exit_code == 0, result.output
+    assert [line for line in commands(fakecli) if 'scale' in line] == [
+        'kubectl --context ctx scale rc dask-worker-big --replicas 3',
+        'kubectl --context ctx scale rc dask-worker --replicas 0',
+        'kubectl --context ctx scale rc dask-worker-big --replicas 0',
+        'kubectl --context ctx scale rc dask-worker --replicas 5',
+        'kubectl --context ctx scale rc dask-worker-big --replicas 5']
+
+    lines = format_groups(load_config('c'), {
+        'dask-worker': [5, 5, 0], 'dask-worker-big': [2, 1, 1]}).splitlines()
+    assert lines[1].split()[:3] == ['dask-worker', '5/5', 'ready']
+    assert lines[2].split()[:2] == ['dask-worker-big', '1/2']
+
+
+def test_resize_both_leaves_room_for_groups(cluster, fakecli):
+    conf = get_conf(None, ['workers.groups=[{name: big, count: 3, '
+                           'memory_per_worker: 24Gi}]'])
+    conf['context'] = 'ctx'
+    save_config('c', conf)
+    result = CliRunner().invoke(cli, ['resize', 'both', 'c', '4'])
+    assert result.exit_code == 0, result.output
+    size = planner.plan(conf, 4).nodes + 3
+    assert ('gcloud container clusters resize c --node-pool dask-workers '
+            '--size {} --async'.format(size)) in commands(fakecli)
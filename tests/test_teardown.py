@@ -0,0 +1,97 @@
+import os
+
+from click.testing import CliRunner
+import pytest
+
+from dask_gke.cli import teardown
+from dask_gke.cli.main import cli
+from dask_gke.cli.teardown import Resource, find_resources
+from dask_gke.cli.utils import get_conf, makedirs, pardir, save_config
+
+REGION = 'https://www.googleapis.com/compute/v1/projects/p/regions/us-east1'
+RULES = [{'name': 'a%i' % i, 'IPAddress': '1.2.3.%i' % i, 'region': REGION,
+          'target': REGION + '/targetPools/a%i' % i} for i in range(4)]
+FIREWALLS = [{'name': 'k8s-fw-a%i' % i} for i in range(4)]
+
+
+def services(*ips):
+    return {'items': [{'metadata': {'name': 's'}, 'status': {
+        'loadBalancer': {'ingress': [{'ip': ip}]}}} for ip in ips]}
+
+
+def test_find_resources():
+    found = find_resources('c', 'us-east1-b', {'1.2.3.1'}, RULES,
+                           FIREWALLS[:1])
+    assert found == [Resource('forwarding-rules', 'a1', 'us-east1', 'c'),
+                     Resource('target-pools', 'a1', 'us-east1', 'c'),
+                     Resource('cluster', 'c', 'us-east1-b', 'c')]
+    found = find_resources('c', 'us-east1-b', {'1.2.3.1'}, RULES, FIREWALLS)
+    assert Resource('firewall-rules', 'k8s-fw-a1', None, 'c') in found
+    assert teardown.region_of('europe-west1-b') == 'europe-west1'
+    assert teardown.delete_command(found[0]) == (
+        'gcloud compute forwarding-rules delete a1 --quiet --region us-east1')
+    assert teardown.delete_command(found[-1]) == (
+        'gcloud container clusters delete c --zone us-east1-b --quiet --async')
+
+
+@pytest.fixture
+def clusters(home, fakecli):
+    """Saved clusters "c0" and "c1", with listings of their resources
+    which are empty once deleting started"""
+    for kind, content in [
+            ('forwarding-rules', RULES), ('firewall-rules', FIREWALLS),
+            ('target-pools', [{'name': r['name']} for r in RULES]),
+            ('clusters', [{'name': 'c0'}, {'name': 'c1'}])]:
+        match = '^gcloud [a-z]+ {} list '.format(kind)
+        fakecli.answer(match, content)
+        fakecli.answer(match, [], after=' delete ')
+    for ctx, ips in [('ctx0', ['1.2.3.0']), ('ctx1', ['1.2.3.1', '1.2.3.2'])]:
+        fakecli.answer('^kubectl --context {} get services'.format(ctx),
+                       services(*ips))
+    for i in range(2):
+        conf = get_conf(None, None)
+        conf['cluster']['zone'] = 'us-east1-b'
+        conf['context'] = 'ctx%i' % i
+        makedirs(pardir('c%i' % i), exist_ok=True)
+        save_config('c%i' % i, conf)
+    return home
+
+
+def deletions(fakecli):
+    return sorted(line for line in fakecli.commands() if ' delete ' in line)
+
+
+def test_delete_all(clusters, fakecli):
+    result = CliRunner().invoke(cli, ['delete', '--all', '--yes'])
+    assert result.exit_code == 0, result.output
+    zone = ' --quiet --region us-east1'
+    assert deletions(fakecli) == sorted(
+        ['gcloud compute forwarding-rules delete a%i' % i + zone
+         for i in range(3)] +
+        ['gcloud compute target-pools delete a%i' % i + zone
+         for i in range(3)] +
+        ['gcloud compute firewall-rules delete k8s-fw-a%i --quiet' % i
+         for i in range(3)] +
+        ['gcloud container clusters delete c%i --zone us-east1-b --quiet '
+         '--async' % i for i in range(2)] +
+        ['kubectl --context ctx%i delete services --all --wait=false' % i
+         for i in range(2)])
+    # nothing left, so the saved state goes too
+    assert not os.path.exists(pardir('c0') + '.yaml')
+    assert not os.path.exists(pardir('c1'))
+
+
+def test_delete_reports_leftovers(clusters, fakecli):
+    # the target pools are never deleted
+    fakecli.answer('^gcloud [a-z]+ target-pools list ',
+                   [{'name': r['name']} for r in RULES])
+    result = CliRunner().invoke(cli, ['delete', 'c1', '--yes',
+                                      '--timeout', '0'])
+    assert result.exit_code != 0
+    assert 'Not everything was deleted' in str(result.exception)
+    assert ('gcloud compute target-pools delete a2 --quiet --region '
+            'us-east1') in result.output
+    assert 'a0' not in result.output
+    # kept, so that the cluster can be looked at again
+    assert os.path.exists(pardir('c1') + '.yaml')
+    assert os.path.exists(pardir('c0') + '.yaml')
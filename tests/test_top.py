@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from dask_gke.cli.scheduler import Load
+from dask_gke.cli.top import History, render, run, sample, sparkline
+
+from conftest import FakeBackend, pod
+
+
+def worker(memory, cpu, processing=0, spilled=0):
+    return {'ncores': 2, 'memory_limit': 1000, 'memory': memory, 'cpu': cpu,
+            'processing': processing, 'spilled': spilled}
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.memory = 100
+
+    def load(self):
+        self.memory += 100
+        workers = {'tcp://10.0.0.1:4000': worker(self.memory, 90, 3),
+                   'tcp://10.0.0.2:4000': worker(50, 5, spilled=2048)}
+        return Load(workers, 3, ['tcp://10.0.0.2:4000'])
+
+
+def backend():
+    """Two worker pods on one node, with the metrics of one of them"""
+    kube = FakeBackend({'pods': [
+        pod('dask-worker-%i' % i, ip='10.0.0.%i' % i, node='node-0')
+        for i in (1, 2)]})
+    kube.usages = {
+        'nodes': [{'metadata': {'name': 'node-0'},
+                   'usage': {'cpu': '1500000000n', 'memory': '2048Ki'}}],
+        'pods': [{'metadata': {'name': 'dask-worker-1'}, 'containers': [
+            {'usage': {'cpu': '250m', 'memory': '1Mi'}},
+            {'usage': {'cpu': '250000u', 'memory': '1Mi'}}]}]}
+    return kube
+
+
+def test_history_bounded():
+    history = History(size=3)
+    for i in range(10):
+        history.add([{'address': 'a', 'memory': i, 'cpu': 10 * i},
+                     {'address': 'b%i' % i, 'memory': 1, 'cpu': 1}])
+    assert history.series('a', 'memory') == [7, 8, 9]
+    assert history.mean('a', 'cpu') == 80
+    # departed workers are dropped
+    assert sorted(history.samples) == ['a', 'b9']
+
+
+def test_sparkline():
+    assert sparkline([0, 50, 100], 100) == ' ▄█'
+    assert sparkline([2, 4]) == '▄█'
+    assert sparkline([]) == ''
+
+
+def test_sample_and_render():
+    rows, nodes = sample(FakeClient(), backend())
+    by_pod = {r['pod']: r for r in rows}
+    assert by_pod['dask-worker-1']['pod_cpu'] == 0.5
+    assert by_pod['dask-worker-1']['pod_memory'] == 2 * 2 ** 20
+    assert by_pod['dask-worker-2']['pod_cpu'] is None
+    assert by_pod['dask-worker-2']['node'] == 'node-0'
+    assert nodes == {'node-0': (1.5, 2 * 2 ** 20)}
+    history = History()
+    history.add(rows)
+    text = render(rows, history, nodes, sort='memory')
+    lines = text.splitlines()
+    assert lines[1].startswith('10.0.0.1:4000')
+    assert '2 workers, 3 tasks' in text
+    assert 'node node-0: 1.50 cpus' in text
+
+
+def test_run_logs(tmpdir):
+    log = str(tmpdir.join('samples.jsonl'))
+    out = []
+    history = run(FakeClient(), backend(), out.append, log=log,
+                  once=True)
+    assert len(out) == 1
+    with open(log) as f:
+        samples = [json.loads(line) for line in f]
+    assert len(samples[0]['workers']) == 2
+    assert history.series('tcp://10.0.0.1:4000', 'memory') == [200]
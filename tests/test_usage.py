@@ -0,0 +1,114 @@
+import json
+
+from click.testing import CliRunner
+import pytest
+
+from dask_gke.cli import usage
+from dask_gke.cli.main import cli
+from dask_gke.cli.scheduler import Load
+from dask_gke.cli.snapshot import cluster_state
+from dask_gke.cli.utils import get_conf, save_config
+
+from conftest import FakeBackend, pod, rc
+
+T0 = 1500000000
+
+
+def test_record_and_summarize(home):
+    # an hour on 2 nodes with 4 workers, then half an hour on 4 with 8,
+    # half of them busy
+    usage.record('c', now=T0, nodes=2, ready=4, connected=4, busy=4)
+    usage.record('c', now=T0 + 3600, nodes=4, ready=8, connected=8, busy=4)
+    usage.record('d', now=T0, nodes=1)
+    rows = usage.samples()
+    assert [(r.cluster, r.time) for r in rows] == [
+        ('c', T0), ('d', T0), ('c', T0 + 3600)]
+    assert usage.samples(['d'])[0].nodes == 1
+    assert usage.samples(since=T0 + 1) == rows[2:]
+
+    c, d = usage.summarize(rows, now=T0 + 5400, max_gap=3600)
+    assert c.samples == 2
+    assert c.node_hours == 2 + 4 * 0.5
+    assert c.worker_hours == 4 + 8 * 0.5
+    assert c.idle == pytest.approx(4 * 0.5 / (4 + 8 * 0.5))
+    assert c.peak_busy == 4
+    # the only sample of d counts for max_gap, and says nothing of workers
+    assert d.node_hours == 1
+    assert (d.worker_hours, d.idle, d.peak_busy) == (None, None, None)
+    assert usage.suggest(d, None) == (None, None)
+
+    # gaps between samples longer than max_gap are not counted
+    c = usage.summarize(rows, now=T0 + 5400, max_gap=600)[0]
+    assert c.node_hours == pytest.approx((2 + 4) / 6.)
+
+    conf = get_conf(None, None)
+    conf['workers']['processes'] = 2
+    workers, nodes = usage.suggest(c, conf)
+    assert workers == 2
+    assert nodes >= 1
+
+
+def test_no_store(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    usage.record('c', nodes=1)
+    assert usage.samples() == []
+    with pytest.raises(ValueError):
+        usage.record('c', node=1)
+
+
+def backend():
+    """Two worker nodes, and four worker pods of which one is not ready"""
+    node = {'metadata': {'labels': {
+        'cloud.google.com/gke-nodepool': 'dask-workers', 'app': 'dask'}}}
+    return FakeBackend({
+        'pods': [pod('w%i' % i, ready=i < 3) for i in range(4)],
+        'nodes': [node, node],
+        'replicationcontrollers': [rc('dask-worker', 4)]})
+
+
+class Client(object):
+    def load(self):
+        return Load({'a': {}, 'b': {}, 'c': {}}, 5, ['c'])
+
+
+def test_recorded_by_commands_and_sampler(home):
+    conf = get_conf(None, None)
+    kube = backend()
+    cluster_state('c', conf, kube, ('nodes', ))
+    cluster_state('c', conf, kube, ('nodes', ))  # cached: not recorded
+    rows = usage.samples()
+    assert len(rows) == 1
+    assert rows[0][2:] == (2, 4, 3, 1, None, None, None)
+
+    def state():
+        return cluster_state('c', conf, kube, refresh=True, record=False)
+    usage.run('c', state, Client(), once=True)
+    rows = usage.samples()
+    assert len(rows) == 2
+    assert rows[1][2:] == (2, 4, 3, 1, 3, 2, 5)
+
+
+def test_usage_command(home):
+    conf = get_conf(None, None)
+    save_config('c', conf)
+    now = usage.time.time()
+    for i in range(4):
+        usage.record('c', now=now - 240 + 60 * i, nodes=2, ready=4,
+                     connected=4, busy=i)
+    usage.record('old', now=now - 40 * 86400, nodes=10)
+    result = CliRunner().invoke(cli, ['usage'])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].split()[:3] == ['CLUSTER', 'SAMPLES', 'NODE-HRS']
+    assert len(lines) == 2
+    assert lines[1].split()[:2] == ['c', '4']
+
+    result = CliRunner().invoke(cli, ['usage', 'c', '--json'])
+    assert result.exit_code == 0, result.output
+    [row] = json.loads(result.output)
+    assert row['cluster'] == 'c'
+    assert row['suggested_workers'] == 3
+    assert row['idle'] == pytest.approx(1 - 6 / 16., rel=1e-3)
+
+    result = CliRunner().invoke(cli, ['usage', '--sample'])
+    assert result.exit_code != 0
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from dask_gke.cli import utils
+from dask_gke.cli.utils import call_many, run_many
+
+
+def test_run_many_concurrent():
+    cmds = ['sleep 0.5 && echo {}'.format(i) for i in range(4)]
+    start = time.time()
+    results = list(run_many(cmds))
+    assert time.time() - start < 1.5
+    assert [out.strip() for cmd, code, out in results] == ['0', '1', '2', '3']
+    assert [cmd for cmd, code, out in results] == cmds
+
+
+def test_call_many_collects_failures():
+    cmds = ['exit 3', 'echo ok', 'exit 1']
+    results = call_many(cmds)
+    assert [code for cmd, code, out in results] == [3, 0, 1]
+    with pytest.raises(RuntimeError) as e:
+        call_many(cmds, check=True)
+    assert 'exit 3' in str(e.value) and 'exit 1' in str(e.value)
+
+
+def test_which_cached(monkeypatch):
+    calls = []
+
+    def find(command):
+        calls.append(command)
+        return '/usr/bin/' + command
+    monkeypatch.setattr(utils, 'find_executable', find)
+    monkeypatch.setattr(utils, '_executables', {})
+    assert utils.which('kubectl') == '/usr/bin/kubectl'
+    assert utils.which('kubectl') == '/usr/bin/kubectl'
+    assert calls == ['kubectl']
+
+
+def test_lazy_imports():
+    # modules only some commands need are not loaded at start-up
+    code = ("import sys, dask_gke.cli.main; print(' '.join(m for m in "
+            "['jinja2', 'ssl', 'webbrowser', 'multiprocessing.pool', "
+            "'urllib.request'] if m in sys.modules))")
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.decode().strip() == ''
+
+
+def test_worker_target():
+    assert utils.worker_target('0', 10) == 0
+    assert utils.worker_target('7', 10) == 7
+    assert utils.worker_target('0.9', 8) == 8
+    assert utils.worker_target('50%', 9) == 5
+    with pytest.raises(ValueError):
+        utils.worker_target('most', 10)
+
+
+def test_worker_targets_with_groups():
+    conf = utils.get_conf(None, ['workers.count=8',
+                                 'workers.groups=[{name: big, count: 2}]'])
+    groups = utils.worker_groups(conf)
+    # a number is of the main workers; a fraction, of every group
+    assert utils.worker_targets('8', groups) == {'dask-worker': 8}
+    assert utils.worker_targets('50%', groups) == {
+        'dask-worker': 4, 'dask-worker-big': 1}
+    assert utils.worker_targets('1.0', groups) == {
+        'dask-worker': 8, 'dask-worker-big': 2}
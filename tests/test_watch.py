@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import stat
+import sys
+from textwrap import dedent
+
+import pytest
+
+from dask_gke.cli.watch import ClusterState, iter_json, wait_until_ready
+
+from conftest import pod, service
+
+
+SERVICES = [
+    {'metadata': {'name': 'dask-scheduler'}, 'spec': {}, 'status': {}},
+    service('jupyter-notebook', [('jupyter-http', 8888),
+                                 ('jupyter-lab-http', 8889)]),
+    service('dask-scheduler', [('dask-scheduler-tcp', 8786),
+                               ('dask-scheduler-bokeh', 8787)]),
+]
+PODS = [
+    pod('jupyter-notebook-a', 'jupyter-notebook', ready=False),
+    pod('jupyter-notebook-a', 'jupyter-notebook'),
+    pod('dask-scheduler-b', 'dask-scheduler'),
+    pod('dask-worker-c', 'dask-worker'),
+    pod('dask-worker-d', 'dask-worker'),
+]
+
+
+@pytest.fixture
+def kubectl(tmpdir):
+    """Fake kubectl, printing scripted watch events for each kind, then
+    hanging like a real watch"""
+    events = {'pods': PODS, 'services': SERVICES}
+    for kind, objs in events.items():
+        with open(str(tmpdir.join(kind + '.json')), 'w') as f:
+            for obj in objs:
+                f.write(json.dumps(obj, indent=2) + '\n')
+    script = tmpdir.join('kubectl')
+    script.write(dedent("""\
+        #!{python}
+        import sys, time
+        kind = sys.argv[sys.argv.index('get') + 1]
+        sys.stdout.write(open({path!r} + '/' + kind + '.json').read())
+        sys.stdout.flush()
+        time.sleep(60)
+        """.format(python=sys.executable, path=str(tmpdir))))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def test_iter_json():
+    text = json.dumps({'a': 1}, indent=2) + json.dumps({'b': [1, 2]})
+    stream = io.BytesIO(text.encode())
+    assert list(iter_json(stream)) == [{'a': 1}, {'b': [1, 2]}]
+
+
+def test_state_events():
+    state = ClusterState()
+    for obj in SERVICES:
+        state.update('services', obj)
+    assert state.services_ready()
+    for obj in PODS[:3]:
+        state.update('pods', obj)
+    assert state.pods_ready()
+    assert not state.pods_ready(workers=1)
+    state.update('pods', {'type': 'DELETED', 'object': PODS[2]})
+    assert not state.pods_ready()
+
+
+def test_wait_until_ready(kubectl):
+    state = wait_until_ready('ctx', workers=2, timeout=20, kubectl=kubectl)
+    live, dead = state.pods()
+    assert sorted(live['dask-worker']) == ['dask-worker-c', 'dask-worker-d']
+
+
+def test_wait_timeout(kubectl):
+    with pytest.raises(RuntimeError):
+        wait_until_ready('ctx', workers=3, timeout=1, kubectl=kubectl)